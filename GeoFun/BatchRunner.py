@@ -0,0 +1,265 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import concurrent.futures
+
+from . import KMLBuilder
+from .Instrumentation import MetricsCollector
+from .BuildManifest import MANIFEST_FILE_NAME
+
+
+
+##############################################################################
+### Jobs
+
+OVERWRITE_POLICIES = ('skip', 'overwrite', 'incremental', 'fail')
+
+
+
+### Loads the jobs of a batch from a JSON manifest
+"""The manifest is either a list of jobs, or a dict with the 'jobs' list and optional 'defaults' applied to every job.
+Each job is a dict of CreateKmlFile arguments: 'output_folder' is required, 'coords_df' is the file location of a CSV
+(see CreateKmlFile), and 'img_input_folder', 'resize_opt', 'engine', 'kmz', etc. are optional.
+Input:
+- manifest_file: the file name of the JSON manifest
+Output:
+- The list of jobs
+"""
+def LoadJobs(manifest_file):
+	with open(manifest_file, 'r', encoding='utf-8') as f:
+		manifest = json.load(f)
+
+	if isinstance(manifest, list):
+		manifest = {'jobs': manifest}
+
+	defaults = manifest.get('defaults', {})
+	jobs = [dict(defaults, **job) for job in manifest['jobs']]
+	for job in jobs:
+		if 'output_folder' not in job:
+			raise ValueError("Each job needs an 'output_folder': %s" % job)
+
+	return jobs
+
+
+
+### Returns the file (KMZ) or folder a job writes to
+"""
+Input:
+- job: the job, as returned by LoadJobs
+Output:
+- The output path
+"""
+def JobOutput(job):
+	if job.get('kmz'):
+		return os.path.normpath(job['output_folder'])+".kmz"
+
+	return os.path.join(os.path.normpath(job['output_folder']), '')
+
+
+
+### Returns the key of the images work of a job
+"""Jobs with the same key produce the same resized images, so the work is done once and shared.
+Input:
+- job: the job, as returned by LoadJobs
+Output:
+- A hashable key, or None if the job has no images or cannot share them (KMZ outputs have no images folder)
+"""
+def ImagesKey(job):
+	if job.get('img_input_folder') is None or job.get('kmz'):
+		return None
+
+	return os.path.abspath(job['img_input_folder']), job.get('resize_opt', 1.0), job.get('pyramid_tile_size')
+
+
+
+### Seeds the output folder of a job with the images of another one
+"""Files are hard linked where possible, and copied otherwise; the build manifest is copied too, so that an incremental build
+of the job finds the images up to date and does not process them again.
+Input:
+- source_folder: the output folder of the job that processed the images
+- out_folder: the output folder of the job to be seeded
+Output:
+- The images folder and manifest, in out_folder
+"""
+def SeedImages(source_folder, out_folder):
+	source_img = os.path.join(source_folder, 'img')
+	if not os.path.isdir(source_img) or not os.path.isfile(os.path.join(source_folder, MANIFEST_FILE_NAME)):
+		return
+
+	for root, dirs, files in os.walk(source_img):
+		destination_root = os.path.join(out_folder, 'img', os.path.relpath(root, source_img))
+		os.makedirs(destination_root, exist_ok=True)
+
+		for file in files:
+			destination = os.path.join(destination_root, file)
+			if os.path.exists(destination):
+				continue
+			try:
+				os.link(os.path.join(root, file), destination)
+			except OSError:
+				shutil.copy2(os.path.join(root, file), destination)
+
+	shutil.copy2(os.path.join(source_folder, MANIFEST_FILE_NAME), os.path.join(out_folder, MANIFEST_FILE_NAME))
+
+
+
+### Runs a job
+"""Defined at module level, so that it can be sent to worker processes.
+Input:
+- job: the job, as returned by LoadJobs
+- overwrite='skip': what to do if the output exists, one of OVERWRITE_POLICIES
+- seed_from=None: the output folder of a job whose images can be reused, see SeedImages
+- metadata_cache=None: a folder where the images metadata is cached, shared by all jobs
+Output:
+- A dict with the 'output_folder', the 'status' ("done", "skipped" or "failed"), the elapsed 'seconds', the 'errors', and the metrics 'summary' (see MetricsCollector)
+"""
+def RunJob(job, overwrite='skip', seed_from=None, metadata_cache=None):
+	start = time.perf_counter()
+	output = JobOutput(job)
+	status = {'output_folder': job['output_folder'], 'status': 'done', 'seconds': 0.0, 'errors': [], 'summary': None}
+
+	try:
+		if os.path.exists(output):
+			if overwrite == 'skip':
+				status['status'] = 'skipped'
+				return status
+			if overwrite == 'fail':
+				raise FileExistsError("'%s' already exists" % output)
+			if overwrite == 'overwrite':
+				if os.path.isdir(output):
+					shutil.rmtree(output)
+				else:
+					os.unlink(output)
+
+		options = dict(job)
+		output_folder = options.pop('output_folder')
+		options.setdefault('metadata_cache', metadata_cache)
+		if not options.get('kmz'):
+			# Incremental builds never prompt, and keep the manifest other jobs can be seeded from
+			options['incremental'] = True
+			if seed_from is not None:
+				SeedImages(seed_from, output)
+
+		metrics = MetricsCollector()
+		KMLBuilder.CreateKmlFile(output_folder, overwrite=True, observer=metrics, **options)
+
+		summary = metrics.Summary()
+		status['summary'] = summary
+		status['errors'] = ["%s: %s" % error for error in summary['errors']]
+		kml_output = output if options.get('kmz') else os.path.join(output, os.path.basename(os.path.normpath(output_folder))+".kml")
+		if not os.path.exists(kml_output):
+			status['errors'].append("no KML was produced")
+		if status['errors']:
+			status['status'] = 'failed'
+
+	except Exception as e:
+		status['status'] = 'failed'
+		status['errors'].append("%s: %s" % (type(e).__name__, e))
+
+	finally:
+		status['seconds'] = time.perf_counter() - start
+
+	return status
+
+
+
+##############################################################################
+### Batch
+
+### Runs many jobs concurrently
+"""Jobs sharing the same images (same folder, resize_opt and image pyramid) only process them once: the first one does, and the others
+are seeded with its images once it is done. The image metadata is shared through metadata_cache, if given.
+Input:
+- jobs: the jobs, as returned by LoadJobs
+- workers=None: the number of jobs run at once; None uses the number of CPUs
+- overwrite='skip': what to do with the outputs that already exist, one of OVERWRITE_POLICIES:
+				   - "skip" leaves them as they are, "fail" reports the job as failed
+				   - "overwrite" removes them first, "incremental" updates them (see CreateKmlFile)
+- metadata_cache=None: a folder where the images metadata is cached, shared by all jobs (and runs); keep it outside of the output folders
+- verbose=False: whether to print the status of each job as it ends
+Output:
+- The list of the job statuses (see RunJob), in the same order as jobs
+"""
+def RunBatch(jobs, workers=None, overwrite='skip', metadata_cache=None, verbose=False):
+	if overwrite not in OVERWRITE_POLICIES:
+		raise ValueError("overwrite must be one of %s" % (OVERWRITE_POLICIES,))
+
+	# The first job of each images key processes the images, the others wait for it
+	leaders = {}
+	followers = {}
+	for job_ix, job in enumerate(jobs):
+		key = ImagesKey(job)
+		if key is not None and key in leaders:
+			followers.setdefault(leaders[key], []).append(job_ix)
+		elif key is not None:
+			leaders[key] = job_ix
+
+	statuses = [None] * len(jobs)
+	waiting = set(ix for ixs in followers.values() for ix in ixs)
+	with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+		running = {executor.submit(RunJob, job, overwrite, None, metadata_cache): job_ix for job_ix, job in enumerate(jobs) if job_ix not in waiting}
+
+		while running:
+			done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+			for future in done:
+				job_ix = running.pop(future)
+				try:
+					statuses[job_ix] = future.result()
+				except Exception as e:
+					statuses[job_ix] = {'output_folder': jobs[job_ix]['output_folder'], 'status': 'failed', 'seconds': 0.0, 'errors': ["%s: %s" % (type(e).__name__, e)], 'summary': None}
+
+				if verbose:
+					PrintStatus(statuses[job_ix])
+
+				seed_from = JobOutput(jobs[job_ix]) if statuses[job_ix]['status'] == 'done' else None
+				for follower_ix in followers.get(job_ix, []):
+					running[executor.submit(RunJob, jobs[follower_ix], overwrite, seed_from, metadata_cache)] = follower_ix
+
+	return statuses
+
+
+
+### Prints the status of a job
+"""
+Input:
+- status: the job status, as returned by RunJob
+Output:
+- The status, printed on one line (plus one line per error)
+"""
+def PrintStatus(status):
+	print("%-8s %8.1f s  %s" % (status['status'], status['seconds'], status['output_folder']))
+	for error in status['errors']:
+		print("         "+error)
+
+
+
+##############################################################################
+### Console command
+
+def Main(argv=None):
+	parser = argparse.ArgumentParser(prog='geofun-batch', description='Builds many KML files from a JSON manifest of jobs, in parallel and without prompting.')
+	parser.add_argument('manifest', help="the JSON manifest: a list of jobs (or {'defaults': {...}, 'jobs': [...]}), each a dict of CreateKmlFile arguments")
+	parser.add_argument('--workers', type=int, default=None, help='the number of jobs run at once (default: the number of CPUs)')
+	parser.add_argument('--overwrite', choices=OVERWRITE_POLICIES, default='skip', help='what to do with the outputs that already exist (default: skip)')
+	parser.add_argument('--metadata-cache', default=None, help='a folder where the images metadata is cached, shared by all the jobs')
+	parser.add_argument('--report', default=None, help='a file where the job statuses are saved, as JSON')
+	args = parser.parse_args(argv)
+
+	statuses = RunBatch(LoadJobs(args.manifest), args.workers, args.overwrite, args.metadata_cache, verbose=True)
+
+	if args.report:
+		with open(args.report, 'w', encoding='utf-8') as f:
+			json.dump(statuses, f, indent=1, default=str)
+
+	failed = sum(status['status'] == 'failed' for status in statuses)
+	print("\n%d jobs: %d done, %d skipped, %d failed" % (len(statuses), sum(status['status'] == 'done' for status in statuses), sum(status['status'] == 'skipped' for status in statuses), failed))
+
+	return 1 if failed else 0
+
+
+
+if __name__ == '__main__':
+	sys.exit(Main())
@@ -0,0 +1,140 @@
+import os
+import json
+import hashlib
+
+from .ImagePyramid import PyramidFolder
+
+
+
+##############################################################################
+### Build manifest, used for incremental builds
+
+MANIFEST_FILE_NAME = 'GeoFun_manifest.json'
+MANIFEST_VERSION = 1
+
+
+
+### Computes the hash of a file
+"""
+Input:
+- file_name: the name of the file
+Output:
+- The SHA-1 hex digest of the file content
+"""
+def FileHash(file_name):
+	sha1 = hashlib.sha1()
+	with open(file_name, 'rb') as f:
+		for block in iter(lambda: f.read(1024*1024), b''):
+			sha1.update(block)
+
+	return sha1.hexdigest()
+
+
+
+### Loads the manifest of a previous build
+"""
+Input:
+- out_folder: the KML output folder
+Output:
+- A dict mapping the output image names to the source they were produced from: {'source', 'size', 'mtime_ns', 'sha1', 'resize_opt'};
+  empty if there is no (readable) manifest
+"""
+def LoadManifest(out_folder):
+	try:
+		with open(os.path.join(out_folder, MANIFEST_FILE_NAME), 'r', encoding='utf-8') as f:
+			manifest = json.load(f)
+
+		if manifest.get('version') != MANIFEST_VERSION:
+			return {}
+
+		return manifest['images']
+
+	except:
+		return {}
+
+
+
+### Saves the manifest of the current build
+"""
+Input:
+- out_folder: the KML output folder
+- images: the dict mapping the output image names to their source, as returned by LoadManifest
+Output:
+- The manifest file, in the output folder
+"""
+def SaveManifest(out_folder, images):
+	with open(os.path.join(out_folder, MANIFEST_FILE_NAME), 'w', encoding='utf-8') as f:
+		json.dump({'version': MANIFEST_VERSION, 'images': images}, f, indent=1, sort_keys=True)
+
+
+
+### Creates the manifest entry of a processed image
+"""
+Input:
+- source: the source image file name
+- resize_opt: the resizing option the image was produced with
+- sha1=None: the hash of the source, if already known
+- pyramid_tile_size=None: the tile size of the image pyramid produced with the image, if any
+Output:
+- The manifest entry
+"""
+def ManifestEntry(source, resize_opt, sha1=None, pyramid_tile_size=None):
+	source_stat = os.stat(source)
+
+	return {
+		'source': source,
+		'size': source_stat.st_size,
+		'mtime_ns': source_stat.st_mtime_ns,
+		'sha1': sha1 if sha1 is not None else FileHash(source),
+		'resize_opt': resize_opt,
+		'pyramid_tile_size': pyramid_tile_size,
+	}
+
+
+
+### Compares the sources with the manifest of the previous build
+"""A source is up to date if its output image exists and was produced from the same file, with the same resize_opt (and image pyramid),
+and the file has not changed: same size and modification time or, if only the latter changed, same hash.
+Input:
+- sources: the source image file names
+- images: the manifest images, as returned by LoadManifest; the entries of touched but unchanged sources are refreshed, those of removed sources are dropped
+- out_folder_img: the folder where the output images are saved
+- resize_opt: the resizing option of the current build
+- pyramid_tile_size=None: the tile size of the image pyramids of the current build, if any
+Output:
+- A tuple with the set of up to date sources, and the list of output image names (and pyramid folders) that are no longer produced by any source
+"""
+def CompareManifest(sources, images, out_folder_img, resize_opt, pyramid_tile_size=None):
+	up_to_date = set()
+	current_names = set()
+
+	for source in sources:
+		name = os.path.basename(source)
+		current_names.add(name)
+
+		entry = images.get(name)
+		if entry is None or entry['source'] != source or entry['resize_opt'] != resize_opt or not os.path.exists(out_folder_img+name):
+			continue
+		if entry.get('pyramid_tile_size') != pyramid_tile_size or (pyramid_tile_size and not os.path.isdir(out_folder_img+PyramidFolder(name))):
+			continue
+
+		source_stat = os.stat(source)
+		if source_stat.st_size != entry['size']:
+			continue
+
+		if source_stat.st_mtime_ns != entry['mtime_ns']:
+			sha1 = FileHash(source)
+			if sha1 != entry['sha1']:
+				continue
+			images[name] = ManifestEntry(source, resize_opt, sha1, pyramid_tile_size)
+
+		up_to_date.add(source)
+
+	for name in list(images):
+		if name not in current_names:
+			del images[name]
+
+	current_pyramids = set(PyramidFolder(name)[:-1] for name in current_names) if pyramid_tile_size else set()
+	stale = [name for name in os.listdir(out_folder_img) if name not in current_names and name not in current_pyramids] if os.path.isdir(out_folder_img) else []
+
+	return up_to_date, stale
@@ -0,0 +1,139 @@
+from .LazyImport import LazyModule
+from .Tiling import TILE_MAX_LEVEL, PyramidBounds
+
+np = LazyModule('numpy')
+
+
+
+##############################################################################
+### Grid clustering of photos, one level per zoom
+
+CLUSTER_MAX_LEVEL = TILE_MAX_LEVEL
+
+
+
+### Finds the grid cells of points at a level
+"""
+Input:
+- lon: the longitudes array (decimal WGS84)
+- lat: the latitudes array (decimal WGS84)
+- bounds: the (west, south, east, north) bounds of the grid, see Tiling.PyramidBounds
+- level: the level of the grid; it has 2**level x 2**level cells, the same as the tiles of that level (see Tiling.TileBounds)
+Output:
+- A tuple with the x and y arrays of the cells
+"""
+def GridCells(lon, lat, bounds, level):
+	west, south, east, north = bounds
+	cells = 2**level
+	fx = np.clip((np.asarray(lon, dtype=np.float64) - west) / (east - west), 0.0, 1.0)
+	fy = np.clip((np.asarray(lat, dtype=np.float64) - south) / (north - south), 0.0, 1.0)
+
+	return np.minimum((fx * cells).astype(np.int64), cells-1), np.minimum((fy * cells).astype(np.int64), cells-1)
+
+
+
+### Interleaves the bits of the cells coordinates (Z-order, or Morton, codes), and back
+"""Cells sharing a parent at any level have codes sharing the same leading bits: sorted by code, the points of a cell are contiguous at every level.
+Input:
+- x, y: the cells arrays, up to 2**16 each
+- codes: the Morton codes
+Output:
+- The codes, or a tuple with the x and y arrays
+"""
+def MortonCodes(x, y):
+	codes = np.zeros(len(x), dtype=np.int64)
+	for axis, values in ((0, np.asarray(x, dtype=np.int64)), (1, np.asarray(y, dtype=np.int64))):
+		values = values & 0xFFFF
+		values = (values | (values << 8)) & 0x00FF00FF
+		values = (values | (values << 4)) & 0x0F0F0F0F
+		values = (values | (values << 2)) & 0x33333333
+		values = (values | (values << 1)) & 0x55555555
+		codes |= values << axis
+
+	return codes
+
+def CellsFromCodes(codes):
+	cells = []
+	for axis in (0, 1):
+		values = (np.asarray(codes, dtype=np.int64) >> axis) & 0x55555555
+		values = (values | (values >> 1)) & 0x33333333
+		values = (values | (values >> 2)) & 0x0F0F0F0F
+		values = (values | (values >> 4)) & 0x00FF00FF
+		values = (values | (values >> 8)) & 0x0000FFFF
+		cells.append(values)
+
+	return cells[0], cells[1]
+
+
+
+### Clusters photos by grid cell, at every level of a quadtree
+"""The photos are sorted once along a Z-order curve over the cells of the deepest level; this order is the spatial index of the clustering,
+as the clusters of every level are then runs of consecutive photos, reduced all at once with NumPy (no sort or search per level).
+A photo alone in its cell stays alone at the deeper levels: it is no longer clustered from that level on.
+Input:
+- lon: the longitudes array (decimal WGS84) of the photos
+- lat: the latitudes array (decimal WGS84) of the photos
+- bounds=None: the (west, south, east, north) bounds of the grid; None fits them to the photos
+- max_level=CLUSTER_MAX_LEVEL: the deepest level, up to 16
+Output:
+- A tuple with:
+  - the bounds of the grid
+  - the list of the levels with clusters of two or more photos, from level 0: each is a dict with the 'level', and the arrays of its clusters
+	'x' and 'y' cells, photos 'count', bounding box of the photos ('west', 'south', 'east', 'north'), centroid ('lon', 'lat') and
+	'representative' (the position, in lon and lat, of the photo closest to the centroid)
+  - the array of the level where each photo is first alone in its cell; max_level+1 for the photos never alone (e.g. taken at the same position)
+"""
+def ClusterPhotos(lon, lat, bounds=None, max_level=CLUSTER_MAX_LEVEL):
+	lon = np.asarray(lon, dtype=np.float64)
+	lat = np.asarray(lat, dtype=np.float64)
+	if bounds is None:
+		bounds = PyramidBounds(lon, lat) if len(lon) else (-180.0, -90.0, 180.0, 90.0)
+
+	n = len(lon)
+	photo_levels = np.full(n, max_level+1, dtype=np.int64)
+	if n == 0:
+		return bounds, [], photo_levels
+
+	codes = MortonCodes(*GridCells(lon, lat, bounds, max_level))
+	order = np.argsort(codes, kind='stable')
+	codes = codes[order]
+	sorted_lon, sorted_lat = lon[order], lat[order]
+	cos_lat = np.cos(np.radians(np.mean(lat)))
+
+	levels = []
+	for level in range(max_level+1):
+		cells = codes >> 2*(max_level - level)
+		starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+		counts = np.diff(np.r_[starts, n])
+
+		alone = order[starts[counts == 1]]
+		photo_levels[alone] = np.minimum(photo_levels[alone], level)
+		if counts.max() == 1:
+			break
+
+		cluster_lon = np.add.reduceat(sorted_lon, starts) / counts
+		cluster_lat = np.add.reduceat(sorted_lat, starts) / counts
+
+		# Representative: the photo closest to the centroid of its cluster (the first one, if tied)
+		cluster_id = np.repeat(np.arange(len(starts)), counts)
+		distance_sq = ((sorted_lon - cluster_lon[cluster_id]) * cos_lat)**2 + (sorted_lat - cluster_lat[cluster_id])**2
+		min_distance_sq = np.minimum.reduceat(distance_sq, starts)
+		position = np.where(distance_sq == min_distance_sq[cluster_id], np.arange(n), n)
+
+		clustered = counts > 1
+		x, y = CellsFromCodes(cells[starts[clustered]])
+		levels.append({
+			'level': level,
+			'x': x,
+			'y': y,
+			'count': counts[clustered],
+			'west': np.minimum.reduceat(sorted_lon, starts)[clustered],
+			'south': np.minimum.reduceat(sorted_lat, starts)[clustered],
+			'east': np.maximum.reduceat(sorted_lon, starts)[clustered],
+			'north': np.maximum.reduceat(sorted_lat, starts)[clustered],
+			'lon': cluster_lon[clustered],
+			'lat': cluster_lat[clustered],
+			'representative': order[np.minimum.reduceat(position, starts)][clustered],
+		})
+
+	return bounds, levels, photo_levels
@@ -0,0 +1,314 @@
+import os
+import csv
+import json
+
+from .LazyImport import LazyModule
+from .KMLWriter import KmlStreamWriter, FormatLines
+
+np = LazyModule('numpy')
+
+
+
+##############################################################################
+### Helpers
+
+### Output formats written next to the KML, with the extension of their files
+EXPORT_FORMATS = {
+	'geojson': '.geojson',
+	'gpx': '.gpx',
+	'csv': '.csv',
+}
+GPX_NAMESPACE = 'http://www.topografix.com/GPX/1/1'
+
+
+
+### Formats an array of times as ISO 8601 text
+"""
+Input:
+- times: the times array (datetime64, UTC)
+Output:
+- An array of strings, e.g. '2020-01-01T00:00:00Z', to the millisecond if any time has a fraction of a second; '' for NaT
+"""
+def TimeStrings(times):
+	times = np.asarray(times, dtype='datetime64[ns]')
+	valid = ~np.isnat(times)
+	unit = 'ms' if np.any(times[valid].astype(np.int64) % 1000000000) else 's'
+
+	return np.where(valid, np.datetime_as_string(times, unit=unit, timezone='UTC'), '')
+
+
+
+### Leaves the points without a finite position out of chunks of track points
+"""JSON and GPX have no way to write NaN coordinates (e.g. GPS dropouts): these points are left out, with their time.
+Input:
+- chunks: an iterator of (lon, lat, elevation, times) arrays, elevation and times None if not kept
+Output:
+- The same iterator, without the points whose longitude, latitude or kept elevation is NaN (or infinite)
+"""
+def FiniteChunks(chunks):
+	for lon, lat, elevation, times in chunks:
+		finite = np.isfinite(lon) & np.isfinite(lat)
+		if elevation is not None:
+			finite &= np.isfinite(elevation)
+
+		if not np.all(finite):
+			lon, lat = lon[finite], lat[finite]
+			elevation = elevation[finite] if elevation is not None else None
+			times = times[finite] if times is not None else None
+
+		yield lon, lat, elevation, times
+
+
+
+##############################################################################
+### Writers
+
+### Writes a GeoJSON FeatureCollection incrementally, one feature per line
+"""Tracks are LineString features, with their 'name', 'keep_elevation' and, if the points have times, the 'coordTimes' (ISO 8601 text, null where missing);
+points without a finite position are left out (see FiniteChunks). Photos are Point features, with their 'name', 'href', 'timestamp', 'width' and 'height' (a null geometry if not located).
+Input:
+- output: the file name of the GeoJSON
+- document_name: the name of the collection
+- precision=None: the number of decimals of the coordinates; if None, they are written as they are
+Output:
+- A writer object; close it to finalise the file
+"""
+class GeoJsonStreamWriter:
+	def __init__(self, output, document_name, precision=None):
+		self.file = open(output, 'w', encoding='utf-8')
+		self.file_names = [output]
+		self.value_fmt = '%s' if precision is None else '%.'+str(int(precision))+'f'
+		self.features = 0
+		self.file.write('{"type": "FeatureCollection", "name": %s, "features": [\n' % json.dumps(document_name))
+
+	def StartFeature(self):
+		if self.features:
+			self.file.write(',\n')
+		self.features += 1
+
+	def WritePhoto(self, photo):
+		geometry = None
+		if photo['latitude'] is not None and photo['longitude'] is not None:
+			geometry = {'type': 'Point', 'coordinates': [photo['longitude'], photo['latitude'], photo['altitude'] or 0]}
+		properties = {key: photo[key] for key in ('name', 'href', 'timestamp', 'width', 'height')}
+
+		self.StartFeature()
+		self.file.write(json.dumps({'type': 'Feature', 'properties': properties, 'geometry': geometry}))
+
+	### Writes a track; 'chunks' is a function returning an iterator of (lon, lat, elevation, times) arrays, elevation and times None if not kept
+	def WriteTrack(self, placemark_name, keep_elevation, chunks):
+		def Points():
+			return FiniteChunks(chunks())
+
+		self.StartFeature()
+		self.file.write('{"type": "Feature", "properties": {"name": %s, "keep_elevation": %d' % (json.dumps(placemark_name), keep_elevation))
+
+		if next((times is not None for lon, lat, elevation, times in Points()), False):
+			self.file.write(', "coordTimes": [')
+			separator = ''
+			for lon, lat, elevation, times in Points():
+				if len(times):
+					self.file.write(separator+','.join(json.dumps(time) if time else 'null' for time in TimeStrings(times).tolist()))
+					separator = ','
+			self.file.write(']')
+
+		self.file.write('}, "geometry": {"type": "LineString", "coordinates": [')
+		separator = ''
+		for lon, lat, elevation, times in Points():
+			if len(lon):
+				columns = [lon, lat] if elevation is None else [lon, lat, elevation]
+				self.file.write(separator+FormatLines('['+','.join([self.value_fmt]*len(columns))+']', columns).replace('\n', ','))
+				separator = ','
+		self.file.write(']}}')
+
+	def Close(self):
+		if self.file.closed:
+			return
+
+		self.file.write('\n]}\n')
+		self.file.close()
+
+
+
+### Writes a GPX 1.1 file incrementally
+"""Photos are waypoints (wpt), linking to their image; tracks are trk elements, with a single trkseg of all their points. GPX lists the waypoints
+before the tracks: write all the photos first. Photos without a location are left out, as a waypoint needs one, and so are track points
+without a finite position (see FiniteChunks).
+Input:
+- output: the file name of the GPX
+- document_name: the name of the GPX, in its metadata
+- precision=None: the number of decimals of the coordinates; if None, they are written as they are
+- pretty_print=True: whether to indent the elements and put them on separate lines
+Output:
+- A writer object; close it to finalise the file
+"""
+class GpxStreamWriter(KmlStreamWriter):
+	def __init__(self, output, document_name, precision=None, pretty_print=True):
+		KmlStreamWriter.__init__(self, output, pretty_print=pretty_print)
+		self.file_names = [output]
+		self.value_fmt = '%s' if precision is None else '%.'+str(int(precision))+'f'
+
+		self.Write('<?xml version="1.0" encoding="%s"?>' % self.encoding+self.newl)
+		self.StartElement('gpx', {'version': '1.1', 'creator': 'GeoFun', 'xmlns': GPX_NAMESPACE})
+		self.StartElement('metadata')
+		self.WriteElement('name', document_name)
+		self.EndElement()
+
+	def WritePhoto(self, photo):
+		if photo['latitude'] is None or photo['longitude'] is None:
+			return
+
+		self.StartElement('wpt', {'lat': repr(photo['latitude']), 'lon': repr(photo['longitude'])})
+		if photo['altitude'] is not None:
+			self.WriteElement('ele', repr(photo['altitude']))
+		if photo['timestamp'] is not None:
+			self.WriteElement('time', photo['timestamp'])
+		self.WriteElement('name', photo['name'])
+		self.StartElement('link', {'href': photo['href']})
+		self.WriteElement('text', photo['name'])
+		self.EndElement()
+		self.EndElement()
+
+	### Writes a track; 'chunks' is a function returning an iterator of (lon, lat, elevation, times) arrays, see GeoJsonStreamWriter.WriteTrack
+	def WriteTrack(self, placemark_name, keep_elevation, chunks):
+		self.StartElement('trk')
+		self.WriteElement('name', placemark_name)
+		self.StartElement('trkseg')
+		self.WriteElementLines(self.PointChunks(FiniteChunks(chunks())))
+		self.EndElement()
+		self.EndElement()
+
+	def PointChunks(self, chunks):
+		for lon, lat, elevation, times in chunks:
+			if not len(lon):
+				continue
+
+			columns = [lat, lon]
+			line_fmt = '<trkpt lat="%s" lon="%s">' % (self.value_fmt, self.value_fmt)
+			if elevation is not None:
+				columns.append(elevation)
+				line_fmt += '<ele>%s</ele>' % self.value_fmt
+			if times is not None:
+				time_text = TimeStrings(times)
+				columns.append(np.where(time_text != '', np.char.add(np.char.add('<time>', time_text), '</time>'), ''))
+				line_fmt += '%s'
+
+			yield FormatLines(line_fmt+'</trkpt>', columns)+'\n'
+
+
+
+### Writes the points and the photos as CSV files
+"""The points are written with the same columns as the coordinates input ('placemark', 'keep_elevation', 'time', 'lat', 'lon', 'elevation'),
+so that they can be read back; the photos, if any, go to a second file, next to it.
+Input:
+- output: the file name of the points CSV
+- photos_output: the file name of the photos CSV ('name', 'href', 'timestamp', 'latitude', 'longitude', 'altitude', 'width', 'height');
+  only created if there are photos
+- precision=None: the number of decimals of the coordinates; if None, they are written as they are
+Output:
+- A writer object; close it to finalise the files. Its 'file_names' lists the files written, the photos CSV once created
+"""
+class CsvStreamWriter:
+	def __init__(self, output, photos_output, precision=None):
+		self.file = open(output, 'w', encoding='utf-8', newline='')
+		self.file.write('placemark,keep_elevation,time,lat,lon,elevation\n')
+		self.file_names = [output]
+		self.photos_output = photos_output
+		self.photos_file = None
+		self.photos_csv = None
+		self.value_fmt = '%s' if precision is None else '%.'+str(int(precision))+'f'
+
+	def WritePhoto(self, photo):
+		if self.photos_file is None:
+			self.photos_file = open(self.photos_output, 'w', encoding='utf-8', newline='')
+			self.file_names.append(self.photos_output)
+			self.photos_csv = csv.writer(self.photos_file, lineterminator='\n')
+			self.photos_csv.writerow(['name', 'href', 'timestamp', 'latitude', 'longitude', 'altitude', 'width', 'height'])
+
+		self.photos_csv.writerow(['' if photo[key] is None else photo[key] for key in ('name', 'href', 'timestamp', 'latitude', 'longitude', 'altitude', 'width', 'height')])
+
+	### Writes a track; 'chunks' is a function returning an iterator of (lon, lat, elevation, times) arrays, see GeoJsonStreamWriter.WriteTrack
+	def WriteTrack(self, placemark_name, keep_elevation, chunks):
+		# The placemark name is quoted as needed once, then repeated on each line; '%' is doubled, as the prefix is part of the template
+		prefix = str(placemark_name)
+		if any(c in prefix for c in ',"\r\n'):
+			prefix = '"%s"' % prefix.replace('"', '""')
+		prefix = (prefix+',%d,' % keep_elevation).replace('%', '%%')
+
+		for lon, lat, elevation, times in chunks():
+			if not len(lon):
+				continue
+
+			columns = [TimeStrings(times) if times is not None else np.full(len(lon), ''), lat, lon]
+			line_fmt = prefix+'%s,'+self.value_fmt+','+self.value_fmt+','
+			if elevation is not None:
+				columns.append(elevation)
+				line_fmt += self.value_fmt
+
+			self.file.write(FormatLines(line_fmt, columns)+'\n')
+
+	def Close(self):
+		self.file.close()
+		if self.photos_file is not None:
+			self.photos_file.close()
+
+
+
+### Writes the photos and the tracks of a build in several formats at once
+"""Each photo and each track is handed to the writer of every format as it comes, so that the data is only read (and the images only processed) once.
+Input:
+- base_file_name: the file name of the outputs, without extension; e.g. 'out/trip' gives 'out/trip.geojson', 'out/trip.gpx', 'out/trip.csv'
+  (and 'out/trip_photos.csv')
+- document_name: the name of the documents
+- formats=(): the formats to write, among EXPORT_FORMATS
+- precision=None: the number of decimals of the coordinates
+- pretty_print=True: whether to indent the XML formats
+Output:
+- A writer object; close it (or use it as a context manager) to finalise the files, then FileNames() lists them
+"""
+class ExportWriters:
+	def __init__(self, base_file_name, document_name, formats=(), precision=None, pretty_print=True):
+		self.writers = []
+
+		for export_format in formats:
+			if export_format not in EXPORT_FORMATS:
+				print("'%s' is not an export format: please choose among %s." % (export_format, ', '.join(EXPORT_FORMATS)))
+				continue
+
+			file_name = base_file_name+EXPORT_FORMATS[export_format]
+			if os.path.dirname(file_name):
+				os.makedirs(os.path.dirname(file_name), exist_ok=True)
+
+			if export_format == 'geojson':
+				self.writers.append(GeoJsonStreamWriter(file_name, document_name, precision))
+			elif export_format == 'gpx':
+				self.writers.append(GpxStreamWriter(file_name, document_name, precision, pretty_print))
+			else:
+				self.writers.append(CsvStreamWriter(file_name, base_file_name+'_photos.csv', precision))
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.Close()
+
+	def __len__(self):
+		return len(self.writers)
+
+	### Writes a photo; 'photo' is the dict of values returned by KMLBuilder.PhotoExportValues
+	def WritePhoto(self, photo):
+		for writer in self.writers:
+			writer.WritePhoto(photo)
+
+	### Writes a track, see GeoJsonStreamWriter.WriteTrack
+	def WriteTrack(self, placemark_name, keep_elevation, chunks):
+		for writer in self.writers:
+			writer.WriteTrack(placemark_name, keep_elevation, chunks)
+
+	### Returns the files written so far; the photos CSV is only listed if there were photos
+	def FileNames(self):
+		return [file_name for writer in self.writers for file_name in writer.file_names]
+
+	def Close(self):
+		for writer in self.writers:
+			writer.Close()
@@ -0,0 +1,87 @@
+import io
+import math
+
+from .LazyImport import LazyModule
+
+Image = LazyModule('PIL.Image')
+
+
+
+##############################################################################
+### Image pyramids, used by the PhotoOverlays
+
+PYRAMID_TILE_SIZE = 256
+PYRAMID_HREF = '$[level]/$[x]_$[y].jpg'
+
+
+
+### Computes the number of levels of the pyramid of an image
+"""Level 0 fits the whole image into a single tile; each following level doubles the resolution, the last one being the image itself.
+Input:
+- width, height: the sides of the image, in pixels
+- tile_size=PYRAMID_TILE_SIZE: the side of the (square) tiles, in pixels
+Output:
+- The number of levels
+"""
+def PyramidLevels(width, height, tile_size=PYRAMID_TILE_SIZE):
+	return 1 + max(0, math.ceil(math.log2(max(width, height) / tile_size)))
+
+
+
+### Cuts an image into the tiles of its pyramid
+"""Tiles are counted from the upper left corner (gridOrigin 'upperLeft'); those on the right and bottom edges are padded to the tile size,
+as viewers crop anything beyond the size of the image.
+Input:
+- img: the PIL image
+- tile_size=PYRAMID_TILE_SIZE: the side of the (square) tiles, in pixels
+Output:
+- A generator of (file name, PIL tile) tuples, the file names being relative to the pyramid folder (see PYRAMID_HREF)
+"""
+def PyramidTiles(img, tile_size=PYRAMID_TILE_SIZE):
+	width, height = img.size
+	levels = PyramidLevels(width, height, tile_size)
+
+	# From the full resolution down, each level being reduced from the previous one
+	level_img = img.convert('RGB') if img.mode not in ('RGB', 'L') else img
+	for level in range(levels-1, -1, -1):
+		scale = 2**(levels-1-level)
+		level_size = (max(1, math.ceil(width / scale)), max(1, math.ceil(height / scale)))
+		if level_img.size != level_size:
+			level_img = level_img.resize(level_size, Image.LANCZOS)
+
+		for y in range(math.ceil(level_size[1] / tile_size)):
+			for x in range(math.ceil(level_size[0] / tile_size)):
+				tile = level_img.crop((x*tile_size, y*tile_size, (x+1)*tile_size, (y+1)*tile_size))
+				yield '%d/%d_%d.jpg' % (level, x, y), tile
+
+
+
+### Encodes the tiles of an image pyramid
+"""
+Input:
+- img: the PIL image
+- tile_size=PYRAMID_TILE_SIZE: the side of the (square) tiles, in pixels
+- quality=85: the JPEG quality of the tiles
+Output:
+- A dict mapping the tiles file names (relative to the pyramid folder) to their JPEG bytes
+"""
+def EncodePyramid(img, tile_size=PYRAMID_TILE_SIZE, quality=85):
+	tiles = {}
+	for tile_name, tile in PyramidTiles(img, tile_size):
+		with io.BytesIO() as buffer:
+			tile.save(buffer, format="JPEG", quality=quality)
+			tiles[tile_name] = buffer.getvalue()
+
+	return tiles
+
+
+
+### Names the folder of the pyramid of an image
+"""
+Input:
+- file_name: the name of the (resized) image
+Output:
+- The folder name, relative to the images folder
+"""
+def PyramidFolder(file_name):
+	return 'pyramid_'+file_name.replace('.', '_')+'/'
@@ -0,0 +1,179 @@
+import time
+import traceback
+import collections
+
+
+
+##############################################################################
+### Build events
+
+### Events sent to the observers of a build, with their values:
+### - 'stage_start': stage
+### - 'stage_end': stage, seconds, error (None on success)
+### - 'image': file_name, decode_seconds, resize_seconds, encode_seconds, iterations, bytes, error (None on success)
+### - 'points': points_read, points_emitted
+### - 'output': file_name, bytes
+### - 'error': stage, error, traceback
+EVENTS = ('stage_start', 'stage_end', 'image', 'points', 'output', 'error')
+
+
+
+### Base class of the build observers
+"""Subclasses override Notify; a plain callable taking (event, values) can be used instead of an observer object.
+Input:
+- None
+Output:
+- An observer, ignoring all the events
+"""
+class BuildObserver:
+	def Notify(self, event, values):
+		pass
+
+
+
+### Sends an event to an observer
+"""
+Input:
+- observer: a BuildObserver, a callable taking (event, values), or None
+- event: the event name, see EVENTS
+- **values: the values of the event
+Output:
+- None; errors raised by the observer are reported and ignored, so that they never break a build
+"""
+def NotifyObserver(observer, event, **values):
+	if observer is None:
+		return
+
+	try:
+		if hasattr(observer, 'Notify'):
+			observer.Notify(event, values)
+		else:
+			observer(event, values)
+	except Exception as e:
+		print("The build observer failed on '%s' (%s: %s)" % (event, type(e).__name__, e))
+
+
+
+### Times a stage of a build, sending its start and end events
+"""
+Input:
+- observer: a BuildObserver, a callable, or None
+- stage: the name of the stage
+Output:
+- A context manager; errors are sent with the 'stage_end' and 'error' events, and raised again
+"""
+class Stage:
+	def __init__(self, observer, stage):
+		self.observer = observer
+		self.stage = stage
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		NotifyObserver(self.observer, 'stage_start', stage=self.stage)
+		return self
+
+	def __exit__(self, exc_type, exc_value, exc_traceback):
+		error = None
+		if exc_type is not None:
+			error = "%s: %s" % (exc_type.__name__, exc_value)
+			NotifyObserver(self.observer, 'error', stage=self.stage, error=error, traceback=''.join(traceback.format_exception(exc_type, exc_value, exc_traceback)))
+
+		NotifyObserver(self.observer, 'stage_end', stage=self.stage, seconds=time.perf_counter() - self.start, error=error)
+		return False
+
+
+
+##############################################################################
+### Metrics collector
+
+### Collects the events of one or more builds into a summary
+"""
+Input:
+- None
+Output:
+- An observer; pass it to CreateKmlFile(observer=...), then read Summary() or print Report()
+"""
+class MetricsCollector(BuildObserver):
+	def __init__(self):
+		self.stages = collections.OrderedDict()
+		self.images = []
+		self.errors = []
+		self.outputs = []
+		self.points_read = 0
+		self.points_emitted = 0
+
+	def Notify(self, event, values):
+		if event == 'stage_end':
+			self.stages[values['stage']] = self.stages.get(values['stage'], 0.0) + values['seconds']
+		elif event == 'image':
+			self.images.append(values)
+		elif event == 'points':
+			self.points_read += values['points_read']
+			self.points_emitted += values['points_emitted']
+		elif event == 'output':
+			self.outputs.append(values)
+		elif event == 'error':
+			self.errors.append(values)
+
+	### Returns the metrics, as a dict
+	def Summary(self):
+		processed = [image for image in self.images if image.get('error') is None]
+		timings = {}
+		for key in ('decode_seconds', 'resize_seconds', 'encode_seconds'):
+			values = [image[key] for image in processed if image.get(key) is not None]
+			timings[key] = {
+				'total': sum(values),
+				'mean': sum(values) / len(values) if values else None,
+				'max': max(values) if values else None,
+			}
+
+		return {
+			'stages': dict(self.stages),
+			'slowest_stage': max(self.stages, key=self.stages.get) if self.stages else None,
+			'images_processed': len(processed),
+			'images_failed': len(self.images) - len(processed),
+			'images_bytes': sum(image.get('bytes') or 0 for image in processed),
+			'image_timings': timings,
+			'points_read': self.points_read,
+			'points_emitted': self.points_emitted,
+			'output_bytes': sum(output['bytes'] for output in self.outputs),
+			'errors': [(error['stage'], error['error']) for error in self.errors],
+		}
+
+	### Returns the metrics, as readable text
+	def Report(self):
+		summary = self.Summary()
+
+		lines = ["Stages:"]
+		for stage, seconds in summary['stages'].items():
+			lines.append("  %-20s %10.3f s%s" % (stage, seconds, "  <- slowest" if stage == summary['slowest_stage'] else ""))
+
+		lines.append("Images: %d processed, %d failed, %.2f MB written" % (summary['images_processed'], summary['images_failed'], summary['images_bytes'] / 1024**2))
+		for key, timing in summary['image_timings'].items():
+			if timing['mean'] is not None:
+				lines.append("  %-20s %10.3f s total, %.4f s mean, %.4f s max" % (key.replace('_seconds', ''), timing['total'], timing['mean'], timing['max']))
+
+		lines.append("Points: %d read, %d emitted" % (summary['points_read'], summary['points_emitted']))
+		lines.append("Output: %.2f MB" % (summary['output_bytes'] / 1024**2))
+		for stage, error in summary['errors']:
+			lines.append("Error in '%s': %s" % (stage, error))
+
+		return "\n".join(lines)
+
+
+
+### Adds the time elapsed since a given clock to a timing
+"""Used to split the processing of an image into its decode, resize and encode durations.
+Input:
+- stats: a dict where the timings are added, or None
+- key: the timing key, e.g. 'decode_seconds'
+- clock: the time.perf_counter() value the timing started at
+Output:
+- The current time.perf_counter() value, to be used as the clock of the next timing
+"""
+def AddSeconds(stats, key, clock):
+	now = time.perf_counter()
+	if stats is not None:
+		stats[key] = stats.get(key, 0.0) + now - clock
+
+	return now
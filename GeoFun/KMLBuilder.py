@@ -1,19 +1,39 @@
 import os
 import shutil
 import io
+import time
 import datetime
+import struct
+import math
+import collections
+import tempfile
 from pathlib import Path
 import zipfile
+import itertools
+import functools
+import concurrent.futures
 
 import xml.dom.minidom
 
-from PIL import Image
-import PIL.ExifTags
-
-import pandas as pd
-import numpy as np
-
-from colour import Color
+from .LazyImport import LazyModule
+from .KMLWriter import KmlStreamWriter, KmzArchive, FormatLines
+from .MetadataCache import MetadataCache
+from .TrackTools import SimplifyTrack, InterpolateTrack
+from .TrackCache import TrackArrays, TrackArraysFromColumns, TimeColumn, ReadCoordinateChunks, CachedTracks, WriteTrackCache, LoadTrackCache
+from .ImagePyramid import PYRAMID_HREF, EncodePyramid, PyramidFolder
+from .Tiling import TILES_FOLDER, PyramidBounds, TileBounds, QuadtreeTiles, TileTree, TileFromKey, TileFileName
+from .Clustering import CLUSTER_MAX_LEVEL, GridCells, ClusterPhotos
+from .Instrumentation import NotifyObserver, Stage, AddSeconds
+from .Pipeline import PIPELINE_QUEUE_SIZE, Pipeline
+from .BuildManifest import MANIFEST_FILE_NAME, LoadManifest, SaveManifest, ManifestEntry, CompareManifest
+from .ExportWriters import ExportWriters
+
+# Heavy dependencies, imported on first use (see LazyModule): building from coordinates only never loads PIL
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
+Image = LazyModule('PIL.Image')
+ExifTags = LazyModule('PIL.ExifTags')
+colour = LazyModule('colour')
 
 # import random
 
@@ -32,8 +52,8 @@ Output:
 - A list of HEX-8 digits colours
 """
 def ColourPicker(no_of_colours, extreme_col_1="red", extreme_col_2="blue"):
-	ext_col_1 = Color(extreme_col_1)
-	ext_col_2 = Color(extreme_col_2)
+	ext_col_1 = colour.Color(extreme_col_1)
+	ext_col_2 = colour.Color(extreme_col_2)
 	
 	colours_list = list(ext_col_1.range_to(ext_col_2, no_of_colours))
 
@@ -69,6 +89,8 @@ def ZipArchive(zip_path, zip_file_name):
 	# Archive data
 	for root, dirs, files in os.walk(zip_path):
 		for file in files:
+			if file == MANIFEST_FILE_NAME:
+				continue
 			file_to_archive = os.path.join(root, file)
 			zipf.write(file_to_archive, file_to_archive[len(zip_path_file):] if file_to_archive.startswith(zip_path_file) else file_to_archive)
 
@@ -79,28 +101,29 @@ def ZipArchive(zip_path, zip_file_name):
 ### Get coordinates and parse data into groups:
 """
 Input:
-- df: the CSV
+- df: the CSV, or a TrackArrays (see TrackCache)
+- precision=None: the number of decimals of the coordinates; if None, they are written as they are (shortest exact representation)
+- simplify_tolerance=None: if set, each placemark is simplified so that it deviates at most this many metres from the original track, see SimplifyTrack
+- stats=None: a dict; if given, the number of points before and after the simplification are added to its 'points_before' and 'points_after' keys
 Output:
 - The text string containing the coordinates to be saved into  
 """
-def CoordinatesParser(df):
+def CoordinatesParser(df, precision=None, simplify_tolerance=None, stats=None):
 	## Creates list of unique placemarks from first column of dataframe
-	uq_placemarks = df[['placemark', 'keep_elevation']].drop_duplicates(keep='first', inplace=False).values.tolist()
+	uq_placemarks = UniquePlacemarks(df)
+
+	## Group the rows of each placemark in a single pass, then format each group at once
+	groups = PlacemarkGroups(df)
+	lon, lat, elevation = CoordinatesArrays(df)
 
-	## Loop through them, isolate data from df and create KML-ready text
 	for placemark in uq_placemarks:
 		placemark_name = placemark[0]
 		placemark_keep_elevation = placemark[1]
 
-		df_ = df.loc[df['placemark']==placemark_name]
-
-		# Keep elevation if required, otherwise discard
-		if placemark_keep_elevation == 1:
-			df_1 = "            "+df_['lon'].map(str)+","+df_['lat'].map(str)+","+df_['elevation'].map(str)
-		else:
-			df_1 = "            "+df_['lon'].map(str)+","+df_['lat'].map(str)
+		rows = groups.get(placemark_name, np.empty(0, dtype=np.intp))
+		rows = SimplifiedRows(rows, lon, lat, elevation, placemark_keep_elevation, simplify_tolerance, stats)
 
-		placemark_coords_str = df_1.str.cat(sep='\n')
+		placemark_coords_str = FormatCoordinates(lon[rows], lat[rows], elevation[rows] if placemark_keep_elevation == 1 else None, precision)
 
 		placemark.append('\n'+placemark_coords_str+'\n')
 
@@ -109,16 +132,385 @@ def CoordinatesParser(df):
 
 
 
+### Lists the placemarks
+"""
+Input:
+- df: the dataframe with GPS coordinates, or a TrackArrays
+Output:
+- The distinct [name, keep_elevation] pairs, in order of appearance
+"""
+def UniquePlacemarks(df):
+	if isinstance(df, TrackArrays):
+		return df.Placemarks()
+
+	return df[['placemark', 'keep_elevation']].drop_duplicates(keep='first', inplace=False).values.tolist()
+
+
+
+### Groups the rows of each placemark
+"""
+Input:
+- df: the dataframe with GPS coordinates, or a TrackArrays
+Output:
+- A dict mapping each placemark name to the positions of its rows, in their original order
+"""
+def PlacemarkGroups(df):
+	if isinstance(df, TrackArrays):
+		return df.Groups()
+
+	return df.groupby('placemark', sort=False).indices
+
+
+
+### Extracts the coordinates columns as NumPy arrays
+"""
+Input:
+- df: the dataframe with GPS coordinates, or a TrackArrays
+Output:
+- A tuple with the 'lon', 'lat' and 'elevation' arrays; 'elevation' is None if the column is missing
+"""
+def CoordinatesArrays(df):
+	if isinstance(df, TrackArrays):
+		return df.lon, df.lat, df.elevation
+
+	elevation = df['elevation'].to_numpy() if 'elevation' in df.columns else None
+
+	return df['lon'].to_numpy(), df['lat'].to_numpy(), elevation
+
+
+
+### Extracts the times of the points
+"""
+Input:
+- df: the dataframe with GPS coordinates, or a TrackArrays
+Output:
+- The 'time' column as a datetime64 array (see TimeColumn), or None if the column is missing
+"""
+def CoordinatesTimes(df):
+	if isinstance(df, TrackArrays):
+		return df.time
+
+	return TimeColumn(df['time']) if 'time' in df.columns else None
+
+
+
+### Extracts the times of the points, for gx:Track output
+"""
+Input:
+- df: the dataframe with GPS coordinates, or a TrackArrays
+Output:
+- The times, see CoordinatesTimes; if missing, this is reported, and the tracks are written as LineStrings instead
+"""
+def GxTrackTimes(df):
+	times = CoordinatesTimes(df)
+	if times is None:
+		print("The tracks are written as LineStrings: gx:Track output needs a 'time' column in the coordinates.")
+
+	return times
+
+
+
+### Simplifies the track of a placemark
+"""
+Input:
+- rows: the positions of the placemark rows
+- lon, lat, elevation: the coordinates arrays, as returned by CoordinatesArrays
+- keep_elevation: whether the elevation is kept (1), in which case distances are measured in 3D
+- simplify_tolerance: the simplification tolerance in metres; if None, the rows are returned as they are
+- stats=None: a dict where the 'points_before' and 'points_after' counts are added
+Output:
+- The positions of the rows kept
+"""
+def SimplifiedRows(rows, lon, lat, elevation, keep_elevation, simplify_tolerance, stats=None):
+	if simplify_tolerance is not None:
+		placemark_elevation = elevation[rows] if keep_elevation == 1 and elevation is not None else None
+		simplified_rows = rows[SimplifyTrack(lon[rows], lat[rows], placemark_elevation, simplify_tolerance)]
+	else:
+		simplified_rows = rows
+
+	if stats is not None:
+		stats['points_before'] = stats.get('points_before', 0) + len(rows)
+		stats['points_after'] = stats.get('points_after', 0) + len(simplified_rows)
+
+	return simplified_rows
+
+
+
+### Formats arrays of coordinates as KML text
+"""The whole block is produced by a single string formatting operation (see FormatLines), instead of one str() call per value.
+Input:
+- lon: the longitudes array
+- lat: the latitudes array
+- elevation=None: the elevations array, if elevation is to be kept
+- precision=None: the number of decimals; if None, the values are written as they are (same as str())
+Output:
+- The coordinates text, one point per line
+"""
+def FormatCoordinates(lon, lat, elevation=None, precision=None):
+	columns = [lon, lat] if elevation is None else [lon, lat, elevation]
+
+	value_fmt = '%s' if precision is None else '%.'+str(int(precision))+'f'
+	line_fmt = "            "+",".join([value_fmt]*len(columns))
+
+	return FormatLines(line_fmt, columns)
+
+
+
+### Formats arrays of times as the <when> elements of a gx:Track
+"""The times are turned into text by NumPy all at once, then the whole block is produced by a single string formatting operation.
+Input:
+- times: the times array (datetime64, UTC), without NaT
+Output:
+- The <when> elements, one per line (indented by the writer, see KmlStreamWriter.WriteElementLines); times are written to the second,
+  or to the millisecond if any has a fraction of a second
+"""
+def FormatWhens(times):
+	times = np.asarray(times, dtype='datetime64[ns]')
+	unit = 'ms' if np.any(times.astype(np.int64) % 1000000000) else 's'
+
+	return "\n".join(["<when>%s</when>"]*len(times)) % tuple(np.datetime_as_string(times, unit=unit, timezone='UTC').tolist())
+
+
+
+### Formats arrays of coordinates as the <gx:coord> elements of a gx:Track
+"""Same as FormatCoordinates, with the values separated by spaces.
+Input:
+- lon: the longitudes array
+- lat: the latitudes array
+- elevation=None: the elevations array, if elevation is to be kept; otherwise the altitude is written as 0
+- precision=None: the number of decimals, see FormatCoordinates
+Output:
+- The <gx:coord> elements, one per line, see FormatWhens
+"""
+def FormatTrackCoords(lon, lat, elevation=None, precision=None):
+	columns = [lon, lat] if elevation is None else [lon, lat, elevation]
+
+	value_fmt = '%s' if precision is None else '%.'+str(int(precision))+'f'
+	line_fmt = "<gx:coord>"+" ".join([value_fmt]*len(columns))+(" 0" if elevation is None else "")+"</gx:coord>"
+
+	return FormatLines(line_fmt, columns)
+
+
+
+### Formats a set of coordinates as KML text
+"""
+Input:
+- df_: the dataframe with the coordinates of (part of) a placemark
+- keep_elevation: whether to keep the elevation (1) or discard it (0)
+- precision=None: the number of decimals, see FormatCoordinates
+Output:
+- The coordinates text, one point per line
+"""
+def CoordinatesText(df_, keep_elevation, precision=None):
+	# Keep elevation if required, otherwise discard
+	elevation = df_['elevation'].to_numpy() if keep_elevation == 1 else None
+
+	return FormatCoordinates(df_['lon'].to_numpy(), df_['lat'].to_numpy(), elevation, precision)
+
+
+
+### Tells whether coordinates have been provided
+"""
+Input:
+- coords: the coordinates input, as given to CreateKmlFile
+Output:
+- True if coords is a dataframe, a TrackArrays, a dict (or structured array) of NumPy columns, a file name or an iterator of dataframes
+"""
+def IsCoordinatesInput(coords):
+	return isinstance(coords, (pd.DataFrame, TrackArrays, dict, np.ndarray, str, os.PathLike)) or (coords is not None and hasattr(coords, '__iter__'))
+
+
+
+### Tells whether coordinates are held in memory as a whole, with their columns at hand
+"""
+Input:
+- coords: the coordinates input
+Output:
+- True if coords is a dataframe or a TrackArrays
+"""
+def IsCoordinatesTable(coords):
+	return isinstance(coords, (pd.DataFrame, TrackArrays))
+
+
+
+### Reads coordinates in chunks
+"""
+Input:
+- coords: a dataframe, a TrackArrays, a dict (or structured array) of NumPy columns, a file name (CSV, Parquet, Arrow or a track cache folder,
+		  see ReadCoordinateChunks) or an iterator of dataframes (e.g. from pd.read_csv(chunksize=...))
+- chunksize=1000000: the number of rows read at once from a file
+Output:
+- An iterator of dataframes (or TrackArrays)
+"""
+def CoordinatesChunks(coords, chunksize=1000000):
+	if IsCoordinatesTable(coords):
+		return iter([coords])
+	elif isinstance(coords, (dict, np.ndarray)):
+		return iter([TrackArraysFromColumns(coords)])
+	elif isinstance(coords, (str, os.PathLike)):
+		return ReadCoordinateChunks(coords, chunksize)
+	else:
+		return iter(coords)
+
+
+
+### Spools coordinates read in chunks into a temporary file, grouped by placemark
+"""The coordinates of each chunk are formatted and appended to the spool, so that only one chunk is held in memory at a time;
+the points of a placemark do not need to be contiguous in the input. Placemarks keep the 'keep_elevation' of their first row.
+Input:
+- precision=None: the number of decimals of the coordinates, see CoordinatesParser
+- simplify_tolerance=None: the simplification tolerance in metres, see CoordinatesParser; each chunk of a placemark is simplified separately
+- stats=None: a dict where the points counts are added, see CoordinatesParser
+- track=False: whether the points are spooled as gx:Track elements (see FormatWhens), from the 'time' column; points without a time are dropped.
+			   If the first chunk has no 'time' column, the coordinates are spooled as text instead, and 'track' is set back to False.
+			   The first chunk decides for all: in a track, the points of a later chunk without a 'time' column are dropped, as without a time
+Output:
+- A spool object; Add chunks to it, then read each placemark's coordinates text with TextChunks (or its elements with TrackChunks)
+"""
+class CoordinatesSpool:
+	def __init__(self, precision=None, simplify_tolerance=None, stats=None, track=False):
+		self.precision = precision
+		self.simplify_tolerance = simplify_tolerance
+		self.stats = stats
+		self.track = track
+		self.file = tempfile.TemporaryFile()
+		self.placemarks = collections.OrderedDict()
+		self.points = 0
+		self.chunks = 0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.Close()
+
+	def Add(self, df):
+		for placemark_name, placemark_keep_elevation in UniquePlacemarks(df):
+			if placemark_name not in self.placemarks:
+				self.placemarks[placemark_name] = [placemark_keep_elevation, [], []]
+
+		groups = PlacemarkGroups(df)
+		lon, lat, elevation = CoordinatesArrays(df)
+
+		times = None
+		if self.track and self.chunks == 0:
+			times = GxTrackTimes(df)
+			self.track = times is not None
+		elif self.track:
+			times = CoordinatesTimes(df)
+			if times is None:
+				# Never switch to text once blocks have been spooled as gx:Track elements
+				times = np.full(len(df), np.datetime64('NaT'), dtype='datetime64[ns]')
+
+		self.file.seek(0, 2)
+		for placemark_name, rows in groups.items():
+			placemark_keep_elevation, blocks, when_blocks = self.placemarks[placemark_name]
+			if times is not None:
+				rows = rows[~np.isnat(times[rows])]
+			rows = SimplifiedRows(rows, lon, lat, elevation, placemark_keep_elevation, self.simplify_tolerance, self.stats)
+			placemark_elevation = elevation[rows] if placemark_keep_elevation == 1 else None
+
+			if times is None:
+				text = (FormatCoordinates(lon[rows], lat[rows], placemark_elevation, self.precision)+'\n').encode('utf-8')
+			else:
+				when_text = (FormatWhens(times[rows])+'\n').encode('utf-8')
+				when_blocks.append((self.file.tell(), len(when_text)))
+				self.file.write(when_text)
+				text = (FormatTrackCoords(lon[rows], lat[rows], placemark_elevation, self.precision)+'\n').encode('utf-8')
+			blocks.append((self.file.tell(), len(text)))
+			self.file.write(text)
+
+		self.points += len(df)
+		self.chunks += 1
+
+	### Returns the [name, keep_elevation] of each placemark, in order of appearance
+	def Placemarks(self):
+		return [[placemark_name, values[0]] for placemark_name, values in self.placemarks.items()]
+
+	### Yields the coordinates text of a placemark, one chunk at a time (same text as CoordinatesParser)
+	def TextChunks(self, placemark_name):
+		blocks = self.placemarks[placemark_name][1]
+
+		yield '\n'
+		if len(blocks) == 0:
+			yield '\n'
+		yield from self.ReadBlocks(blocks)
+
+	### Returns the <when> and the <gx:coord> elements of a placemark spooled as a track, as two iterators of chunks, to be read in this order
+	def TrackChunks(self, placemark_name):
+		placemark_keep_elevation, blocks, when_blocks = self.placemarks[placemark_name]
+
+		return self.ReadBlocks(when_blocks), self.ReadBlocks(blocks)
+
+	def ReadBlocks(self, blocks):
+		for offset, length in blocks:
+			self.file.seek(offset)
+			yield self.file.read(length).decode('utf-8')
+
+	def Close(self):
+		self.file.close()
+
+
+
+### Spools coordinates, reading them in chunks
+"""
+Input:
+- coords: a dataframe, a CSV file name or an iterator of dataframes
+- precision=None: the number of decimals of the coordinates, see CoordinatesParser
+- chunksize=1000000: the number of rows read at once from a CSV file
+- simplify_tolerance=None: the simplification tolerance in metres, see CoordinatesSpool
+- stats=None: a dict where the points counts are added, see CoordinatesParser
+- track=False: whether the points are spooled as gx:Track elements, see CoordinatesSpool
+Output:
+- A CoordinatesSpool with all the coordinates
+"""
+def SpoolCoordinates(coords, precision=None, chunksize=1000000, simplify_tolerance=None, stats=None, track=False):
+	spool = CoordinatesSpool(precision, simplify_tolerance, stats, track)
+	for chunk in CoordinatesChunks(coords, chunksize):
+		spool.Add(chunk)
+
+	return spool
+
+
+
+### Chooses the altitude mode and line width of a placemark
+"""
+Input:
+- placemark_is_flight: the 'keep_elevation' flag of the placemark
+Output:
+- A tuple with the altitude mode and the line width
+"""
+def PlacemarkStyle(placemark_is_flight):
+	if placemark_is_flight == 0:
+		alt_mode = 'clampToGround'
+		line_width = 2
+	else:
+		alt_mode = 'absolute'
+		line_width = 1
+
+	return alt_mode, line_width
+
+
+
 ### Creates placemark(s) for GPS coordinates
 """
 Input:
-- gps_coords_df: the dataframe with GPS coordinates
+- gps_coords_df: the dataframe with GPS coordinates, or a CSV file name or an iterator of dataframes (read in chunks, see SpoolCoordinates)
 - kml_doc: the KML doc
+- document=None: the Document element to append the placemarks to; if None, the last Document of kml_doc is used
+- precision=None: the number of decimals of the coordinates, see CoordinatesParser
+- simplify_tolerance=None: the simplification tolerance in metres, see CoordinatesParser
+- stats=None: a dict where the points counts are added, see CoordinatesParser
 Output:
 - Same KML doc inputted, with appended placemark 
 """ 
-def CreatePlacemark(gps_coords_df, kml_doc):
-	placemarks_list = CoordinatesParser(gps_coords_df)
+def CreatePlacemark(gps_coords_df, kml_doc, document=None, precision=None, simplify_tolerance=None, stats=None):
+	if IsCoordinatesTable(gps_coords_df):
+		placemarks_list = CoordinatesParser(gps_coords_df, precision, simplify_tolerance, stats)
+	else:
+		# The document is held in memory anyway: the spool only avoids loading the whole input at once
+		with SpoolCoordinates(gps_coords_df, precision, simplify_tolerance=simplify_tolerance, stats=stats) as spool:
+			placemarks_list = [[name, keep, ''.join(spool.TextChunks(name))] for name, keep in spool.Placemarks()]
 	placemark_no = len(placemarks_list)
 
 	# color_palette = ['96ceb4dd','ffeeaddd','ffcc5cdd','ff6f69dd','6b5b95dd','feb236dd','d64161dd','ff7b25dd','3e4444dd','82b74bdd','405d27dd','c1946add', '7F8080dd', '7F0000FF', '7F8080dd', '7FFFAAdd']
@@ -126,6 +518,9 @@ def CreatePlacemark(gps_coords_df, kml_doc):
 
 	selected_palette = ColourPicker(placemark_no)#, extreme_col_1="red", extreme_col_2="blue")
 
+	if document is None:
+		document = kml_doc.getElementsByTagName('Document')[-1]
+
 
 	## For each trip/placemark, add KML doc requirements, assigning a different colour for each 
 	col_ix = 0
@@ -134,179 +529,1091 @@ def CreatePlacemark(gps_coords_df, kml_doc):
 		placemark_is_flight = each_placemark[1]
 		placemark_coords = each_placemark[2]
 
-		if placemark_is_flight == 0:
-			alt_mode = 'clampToGround'
-			line_width = 2
-		else:
-			alt_mode = 'absolute'
-			line_width = 1
+		alt_mode, line_width = PlacemarkStyle(placemark_is_flight)
+
+		col_pick = selected_palette[col_ix]
+		col_ix += 1
+
+
+		pl = kml_doc.createElement('Placemark')
+
+		name = kml_doc.createElement('name')
+		name.appendChild(kml_doc.createTextNode(placemark_name))
+		
+		LineString = kml_doc.createElement('LineString')
+		extrude = kml_doc.createElement('extrude')
+		extrude.appendChild(kml_doc.createTextNode('1'))
+		altitudeMode = kml_doc.createElement('altitudeMode')
+		altitudeMode.appendChild(kml_doc.createTextNode(alt_mode))
+		coordinates = kml_doc.createElement('coordinates')
+		coordinates.appendChild(kml_doc.createTextNode(placemark_coords))
+		LineString.appendChild(extrude)
+		LineString.appendChild(altitudeMode)
+		LineString.appendChild(coordinates)
+
+		Style = kml_doc.createElement('Style')
+		LineStyle = kml_doc.createElement('LineStyle')
+		color = kml_doc.createElement('color')
+		color.appendChild(kml_doc.createTextNode(col_pick))
+		width = kml_doc.createElement('width')
+		width.appendChild(kml_doc.createTextNode(str(line_width)))
+		LineStyle.appendChild(color)
+		LineStyle.appendChild(width)
+		Style.appendChild(LineStyle)
+
+		pl.appendChild(name)
+		pl.appendChild(LineString)
+		pl.appendChild(Style)
+
+		document.appendChild(pl)
+
+
+
+### Streams placemark(s) for GPS coordinates
+"""
+Input:
+- gps_coords_df: the dataframe with GPS coordinates, or a CSV file name or an iterator of dataframes (read in chunks, see SpoolCoordinates)
+- writer: the KmlStreamWriter the placemarks are written to
+- chunk_size=100000: the number of points formatted (or read from a CSV file) at once; this bounds the size of the coordinates text held in memory
+- precision=None: the number of decimals of the coordinates, see CoordinatesParser
+- simplify_tolerance=None: the simplification tolerance in metres, see CoordinatesParser
+- stats=None: a dict where the points counts are added, see CoordinatesParser
+- gx_track=False: whether the placemarks are written as gx:Track elements, a <when> and a <gx:coord> per point, from the 'time' column (so that
+				  viewers can animate and time-filter them); points without a time are dropped. Without a 'time' column, LineStrings are written
+Output:
+- The placemarks, written to the writer
+"""
+def StreamPlacemarks(gps_coords_df, writer, chunk_size=100000, precision=None, simplify_tolerance=None, stats=None, gx_track=False):
+	if not IsCoordinatesTable(gps_coords_df):
+		with SpoolCoordinates(gps_coords_df, precision, chunk_size, simplify_tolerance, stats, gx_track) as spool:
+			uq_placemarks = spool.Placemarks()
+			selected_palette = ColourPicker(len(uq_placemarks))
+
+			col_ix = 0
+			for placemark_name, placemark_is_flight in uq_placemarks:
+				alt_mode, line_width = PlacemarkStyle(placemark_is_flight)
+				if spool.track:
+					writer.WriteTrack(placemark_name, alt_mode, line_width, selected_palette[col_ix], *spool.TrackChunks(placemark_name))
+				else:
+					writer.WritePlacemark(placemark_name, alt_mode, line_width, selected_palette[col_ix], spool.TextChunks(placemark_name))
+				col_ix += 1
+
+		return
+
+	uq_placemarks = UniquePlacemarks(gps_coords_df)
+	selected_palette = ColourPicker(len(uq_placemarks))
+
+	groups = PlacemarkGroups(gps_coords_df)
+	lon, lat, elevation = CoordinatesArrays(gps_coords_df)
+	times = GxTrackTimes(gps_coords_df) if gx_track else None
+
+	col_ix = 0
+	for placemark_name, placemark_is_flight in uq_placemarks:
+		rows = groups.get(placemark_name, np.empty(0, dtype=np.intp))
+		if times is not None:
+			rows = rows[~np.isnat(times[rows])]
+		rows = SimplifiedRows(rows, lon, lat, elevation, placemark_is_flight, simplify_tolerance, stats)
+		alt_mode, line_width = PlacemarkStyle(placemark_is_flight)
+
+		if times is not None:
+			def WhenChunks():
+				for start in range(0, len(rows), chunk_size):
+					yield FormatWhens(times[rows[start:start+chunk_size]])+'\n'
+
+			def CoordChunks():
+				for start in range(0, len(rows), chunk_size):
+					chunk = rows[start:start+chunk_size]
+					yield FormatTrackCoords(lon[chunk], lat[chunk], elevation[chunk] if placemark_is_flight == 1 else None, precision)+'\n'
+
+			writer.WriteTrack(placemark_name, alt_mode, line_width, selected_palette[col_ix], WhenChunks(), CoordChunks())
+
+		else:
+			def PlacemarkChunks():
+				yield '\n'
+				if len(rows) == 0:
+					yield '\n'
+				for start in range(0, len(rows), chunk_size):
+					chunk = rows[start:start+chunk_size]
+					yield FormatCoordinates(lon[chunk], lat[chunk], elevation[chunk] if placemark_is_flight == 1 else None, precision)+'\n'
+
+			writer.WritePlacemark(placemark_name, alt_mode, line_width, selected_palette[col_ix], PlacemarkChunks())
+		col_ix += 1
+
+
+
+### Reads the coordinates once, into tracks shared by all the outputs
+"""Coordinates read in chunks (files and iterators of dataframes) can only be read once, or at the cost of parsing them again: they are
+written to a binary track cache (see WriteTrackCache) and memory-mapped from there, so that the KML and the exports all read the same columns
+while memory stays bounded.
+Input:
+- coords: the coordinates input, see CoordinatesChunks
+- cache_folder: the folder where the track cache is written, if needed
+- chunksize=1000000: the number of rows read at once from a file
+Output:
+- A dataframe or a TrackArrays
+"""
+def SharedTracks(coords, cache_folder, chunksize=1000000):
+	if IsCoordinatesTable(coords):
+		return coords
+	elif isinstance(coords, (dict, np.ndarray)):
+		return TrackArraysFromColumns(coords)
+
+	tracks = LoadTrackCache(coords) if isinstance(coords, (str, os.PathLike)) and os.path.isdir(coords) else None
+	if tracks is None:
+		tracks = LoadTrackCache(WriteTrackCache(CoordinatesChunks(coords, chunksize), cache_folder))
+
+	return tracks
+
+
+
+### Writes the tracks to the export writers
+"""The tracks are simplified as in the KML (see SimplifiedRows), and handed to the writers in chunks of points; unlike gx:Track, points without a
+time are kept.
+Input:
+- coords_df: the dataframe with GPS coordinates, or a TrackArrays (see SharedTracks)
+- exports: the ExportWriters the tracks are written to
+- chunk_size=100000: the number of points handed to the writers at once
+- simplify_tolerance=None: the simplification tolerance in metres, see CoordinatesParser
+Output:
+- The tracks, written to the export writers
+"""
+def ExportTracks(coords_df, exports, chunk_size=100000, simplify_tolerance=None):
+	groups = PlacemarkGroups(coords_df)
+	lon, lat, elevation = CoordinatesArrays(coords_df)
+	times = CoordinatesTimes(coords_df)
+
+	for placemark_name, placemark_keep_elevation in UniquePlacemarks(coords_df):
+		rows = groups.get(placemark_name, np.empty(0, dtype=np.intp))
+		rows = SimplifiedRows(rows, lon, lat, elevation, placemark_keep_elevation, simplify_tolerance)
+		keep_elevation = placemark_keep_elevation == 1 and elevation is not None
+
+		def Chunks():
+			for start in range(0, len(rows), chunk_size):
+				chunk = rows[start:start+chunk_size]
+				yield lon[chunk], lat[chunk], elevation[chunk] if keep_elevation else None, times[chunk] if times is not None else None
+
+		exports.WriteTrack(placemark_name, placemark_keep_elevation, Chunks)
+
+
+
+##############################################################################
+### Images 
+
+### Record of a photo, produced once per image (by ScanFile, or ProcessFile) and carried through the pipeline
+"""Slotted, so that each photo costs a few hundred bytes at most, whatever the size of the image: no PIL image, nor dict of headers, is kept open
+or carried along. Records are picklable, so they can be sent to and from worker processes.
+Input:
+- path: the file name
+- timestamp=None: the 'DateTimeOriginal' as a datetime, or None
+- latitude, longitude, altitude=None: the GPS position (as returned by GetGps), or None
+- width, height=None: the image size declared in the EXIF, or the actual frame size if not declared
+- output=None: the file name of the processed image (relative to the KML output, e.g. 'img/photo.jpg'), once known, see ProcessImages
+Output:
+- A PhotoMetadata object
+"""
+class PhotoMetadata:
+	__slots__ = ('path', 'timestamp', 'latitude', 'longitude', 'altitude', 'width', 'height', 'output')
+
+	def __init__(self, path, timestamp=None, latitude=None, longitude=None, altitude=None, width=None, height=None, output=None):
+		self.path = path
+		self.timestamp = timestamp
+		self.latitude = latitude
+		self.longitude = longitude
+		self.altitude = altitude
+		self.width = width
+		self.height = height
+		self.output = output
+
+	def __repr__(self):
+		return 'PhotoMetadata(%s)' % ', '.join('%s=%r' % (field, getattr(self, field)) for field in self.__slots__)
+
+	def __eq__(self, other):
+		return isinstance(other, PhotoMetadata) and all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+	### Returns a copy of the record, with the given fields changed
+	def Replace(self, **changes):
+		values = {field: getattr(self, field) for field in self.__slots__}
+		values.update(changes)
+		return PhotoMetadata(**values)
+
+	### Returns the values read from the file (all the fields but the path and the output), as kept by a MetadataCache
+	def Values(self):
+		return (self.timestamp, self.latitude, self.longitude, self.altitude, self.width, self.height)
+
+
+
+### EXIF tags read by ScanFile
+EXIF_TAGS = {
+	0x0100: 'ImageWidth',
+	0x0101: 'ImageLength',
+	0x8769: 'ExifOffset',
+	0x8825: 'GPSInfo',
+	0x9003: 'DateTimeOriginal',
+	0xA002: 'ExifImageWidth',
+	0xA003: 'ExifImageHeight',
+}
+
+### Size in bytes of the TIFF field types: BYTE, ASCII, SHORT, LONG, RATIONAL, SBYTE, UNDEFINED, SSHORT, SLONG, SRATIONAL
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8}
+
+
+
+### Reads an IFD (image file directory) from the TIFF structure of the EXIF segment
+"""
+Input:
+- tiff: the bytes of the TIFF structure (the APP1 segment after the 'Exif' header)
+- offset: the offset of the IFD
+- endian: '<' or '>', as declared in the TIFF header
+Output:
+- A dict mapping tag numbers to values; rationals are (numerator, denominator) tuples
+"""
+def ReadIfd(tiff, offset, endian):
+	ifd = {}
+	entries_no = struct.unpack_from(endian+'H', tiff, offset)[0]
+
+	for i in range(entries_no):
+		tag, tiff_type, count, value_offset = struct.unpack_from(endian+'HHI4s', tiff, offset+2+i*12)
+		size = TIFF_TYPE_SIZES.get(tiff_type)
+		if size is None:
+			continue
+
+		if size*count <= 4:
+			raw = value_offset[:size*count]
+		else:
+			data_offset = struct.unpack(endian+'I', value_offset)[0]
+			raw = tiff[data_offset:data_offset+size*count]
+			if len(raw) < size*count:
+				continue
+
+		if tiff_type == 2:
+			value = raw.split(b'\x00', 1)[0].decode('ascii', 'replace')
+		elif tiff_type in (5, 10):
+			fmt = 'I' if tiff_type == 5 else 'i'
+			numbers = struct.unpack(endian+fmt*(2*count), raw)
+			value = tuple(zip(numbers[0::2], numbers[1::2]))
+		elif tiff_type in (3, 4, 8, 9):
+			fmt = {3: 'H', 4: 'I', 8: 'h', 9: 'i'}[tiff_type]
+			value = struct.unpack(endian+fmt*count, raw)
+		else:
+			value = raw
+
+		if isinstance(value, tuple) and len(value) == 1:
+			value = value[0]
+
+		ifd[tag] = value
+
+	return ifd
+
+
+
+### Parses the EXIF segment into headers
+"""
+Input:
+- tiff: the bytes of the TIFF structure (the APP1 segment after the 'Exif' header)
+Output:
+- A dict mapping the EXIF_TAGS names to their values, in the same layout as GetHeaders ('GPSInfo' is a dict keyed by GPS tag number)
+"""
+def ParseExif(tiff):
+	endian = '<' if tiff[:2] == b'II' else '>'
+	ifd0 = ReadIfd(tiff, struct.unpack_from(endian+'I', tiff, 4)[0], endian)
+
+	tags = dict(ifd0)
+	if 0x8769 in ifd0:
+		tags.update(ReadIfd(tiff, ifd0[0x8769], endian))
+	if 0x8825 in ifd0:
+		tags[0x8825] = ReadIfd(tiff, ifd0[0x8825], endian)
+
+	return {EXIF_TAGS[k]: v for k, v in tags.items() if k in EXIF_TAGS}
+
+
+
+### Reads the EXIF segment and the frame size of a JPEG, without decoding it
+"""
+Input:
+- file_name: the name of the file
+- max_bytes=262144: the maximum number of bytes read from the file
+Output:
+- A tuple with the EXIF headers dict (None if not found) and the (width, height) of the frame (None if not found)
+"""
+def ReadJpegHeaders(file_name, max_bytes=262144):
+	data = None
+	frame_size = None
+
+	with open(file_name, 'rb') as f:
+		if f.read(2) != b'\xff\xd8':
+			raise IOError("Not a JPEG file")
+
+		bytes_read = 2
+		while bytes_read < max_bytes:
+			marker = f.read(4)
+			bytes_read += 4
+			if len(marker) < 4 or marker[0] != 0xFF:
+				break
+
+			marker_type = marker[1]
+			length = struct.unpack('>H', marker[2:])[0] - 2
+
+			# Start of scan: no headers after this
+			if marker_type == 0xDA:
+				break
+
+			# APP1 'Exif' segment
+			elif marker_type == 0xE1 and data is None and bytes_read+length <= max_bytes:
+				segment = f.read(length)
+				bytes_read += length
+				if segment[:6] == b'Exif\x00\x00':
+					data = ParseExif(segment[6:])
+
+			# Start of frame (baseline, progressive, etc.), but not DHT, JPG and DAC
+			elif 0xC0 <= marker_type <= 0xCF and marker_type not in (0xC4, 0xC8, 0xCC):
+				segment = f.read(5)
+				bytes_read += 5
+				height, width = struct.unpack('>HH', segment[1:5])
+				frame_size = (width, height)
+				f.seek(length-5, 1)
+
+			else:
+				f.seek(length, 1)
+
+			if data is not None and frame_size is not None:
+				break
+
+	return data, frame_size
+
+
+
+### Reads the metadata of a photo, without decoding its pixels
+"""Only the EXIF segment (and the frame header) of JPEG files is read; other formats are read with PIL, whose Image.open does not decode pixels either.
+Input:
+- file_name: the name of the file
+- max_bytes=262144: the maximum number of bytes read from JPEG files
+Output:
+- A PhotoMetadata record; fields that could not be read are None
+"""
+def ScanFile(file_name, max_bytes=262144):
+	data = None
+	frame_size = None
+
+	try:
+		data, frame_size = ReadJpegHeaders(file_name, max_bytes)
+	except:
+		try:
+			with Image.open(file_name) as img:
+				data = GetHeaders(img)
+				frame_size = img.size
+		except:
+			pass
+
+	return RecordFromHeaders(file_name, data, frame_size)
+
+
+
+### Builds the record of a photo from its headers
+"""
+Input:
+- file_name: the name of the file
+- data: the headers, as returned by GetHeaders (or ReadJpegHeaders), or None
+- frame_size=None: the actual (width, height) of the image, used if the EXIF does not declare it
+Output:
+- A PhotoMetadata record; fields that could not be read are None
+"""
+def RecordFromHeaders(file_name, data, frame_size=None):
+	if data is None:
+		data = {}
+
+	try:
+		timestamp = datetime.datetime.strptime(data['DateTimeOriginal'], "%Y:%m:%d %H:%M:%S")
+	except:
+		timestamp = None
+
+	latitude, longitude, altitude = GetGps(data)
+
+	width = data.get('ExifImageWidth', data.get('ImageWidth'))
+	height = data.get('ExifImageHeight', data.get('ImageLength'))
+	if (width is None or height is None) and frame_size is not None:
+		width, height = frame_size
+
+	return PhotoMetadata(file_name, timestamp, latitude, longitude, altitude, width, height)
+
+
+
+### Reads the metadata of all the photos in a folder, concurrently
+"""
+Input:
+- folder='input/images/': The folder where images to be processed are saved 
+- workers=8: the number of files read at the same time; reading is I/O-bound, so threads are used
+- max_bytes=262144: the maximum number of bytes read from JPEG files
+- cache=None: a MetadataCache; if given, only new or modified files are read, and their metadata is added to the cache
+Output:
+- A generator of PhotoMetadata records, one per file, in directory order
+"""
+def ScanFolder(folder='input/images/', workers=8, max_bytes=262144, cache=None):
+	file_names = [folder+entry.name for entry in Path(folder).iterdir() if entry.is_file()]
+
+	if cache is None:
+		records = [None]*len(file_names)
+		to_scan = list(range(len(file_names)))
+
+	else:
+		records = []
+		to_scan = []
+		stats = []
+		for i, file_name in enumerate(file_names):
+			file_stat = os.stat(file_name)
+			stats.append(file_stat)
+
+			values = cache.Get(file_name, file_stat.st_size, file_stat.st_mtime_ns)
+			if values is None:
+				records.append(None)
+				to_scan.append(i)
+			else:
+				records.append(PhotoMetadata(file_name, *values))
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+		scanned = executor.map(ScanFile, [file_names[i] for i in to_scan], itertools.repeat(max_bytes))
+		for i, record in zip(to_scan, scanned):
+			records[i] = record
+			if cache is not None:
+				cache.Put(record.path, stats[i].st_size, stats[i].st_mtime_ns, record.Values())
+
+	for record in records:
+		yield record
+
+
+
+### Iterates through image files, returning their metadata
+"""
+Input:
+- folder='input/images/': The folder where images to be processed are saved 
+- workers=8: the number of files read at the same time
+- cache=None: a MetadataCache, see ScanFolder
+Output:
+- The PhotoMetadata records, ordered by picture taken date; files without a readable date go last
+"""
+def PhotosIterator(folder='input/images/', workers=8, cache=None):
+	records = list(ScanFolder(folder, workers, cache=cache))
+	records.sort(key=lambda x: (x.timestamp is None, x.timestamp or datetime.datetime.min))
+
+	return records
+
+
+
+### Reads the times and positions of all the track points
+"""
+Input:
+- coords: the coordinates input, see CoordinatesChunks; iterators of dataframes are consumed
+Output:
+- A tuple with the 'time' (datetime64), 'lon', 'lat' and 'elevation' arrays; all None if there is no 'time' column, and 'elevation' None if missing
+"""
+def TrackTimes(coords):
+	times, lons, lats, elevations = [], [], [], []
+	for chunk in CoordinatesChunks(coords):
+		chunk_times = CoordinatesTimes(chunk)
+		if chunk_times is None:
+			return None, None, None, None
+
+		lon, lat, elevation = CoordinatesArrays(chunk)
+		times.append(chunk_times)
+		lons.append(lon)
+		lats.append(lat)
+		elevations.append(elevation)
+
+	if not times:
+		return None, None, None, None
+	if any(elevation is None for elevation in elevations):
+		elevations = None
+
+	return np.concatenate(times), np.concatenate(lons), np.concatenate(lats), np.concatenate(elevations) if elevations is not None else None
+
+
+
+### Places the photos without a GPS position on the tracks, from the time they were taken
+"""All the photos are placed at once, see InterpolateTrack; the photos already located, or without a 'DateTimeOriginal', are left as they are.
+Input:
+- records: the PhotoMetadata records, as returned by PhotosIterator
+- coords: the coordinates input, with a 'time' column, see TrackTimes
+- offset=0.0: the seconds added to the camera clock to match the track clock, e.g. -3600 for a camera set to UTC+1 and a track in UTC
+- max_gap=60.0: the maximum time gap, in seconds, around a photo, see InterpolateTrack
+Output:
+- A tuple with the records, the located ones updated, and the number of photos located
+"""
+def GeotagPhotos(records, coords, offset=0.0, max_gap=60.0):
+	missing = [record_ix for record_ix, record in enumerate(records) if record.latitude is None and record.timestamp is not None]
+	if not missing:
+		return records, 0
+
+	track_times, lon, lat, elevation = TrackTimes(coords)
+	if track_times is None:
+		print("The photos cannot be geotagged: the coordinates have no 'time' column.")
+		return records, 0
+
+	photo_times = np.array([np.datetime64(records[record_ix].timestamp, 'ns') for record_ix in missing]) + np.timedelta64(int(round(offset * 1e9)), 'ns')
+	photo_lon, photo_lat, photo_elevation = InterpolateTrack(track_times, lon, lat, elevation, photo_times, max_gap)
+
+	records = list(records)
+	located = 0
+	for position, record_ix in enumerate(missing):
+		if np.isnan(photo_lat[position]):
+			continue
+
+		altitude = 0
+		if photo_elevation is not None and not np.isnan(photo_elevation[position]):
+			altitude = float(photo_elevation[position])
+		records[record_ix] = records[record_ix].Replace(latitude=float(photo_lat[position]), longitude=float(photo_lon[position]), altitude=altitude)
+		located += 1
+
+	return records, located
+
+
+
+### Iterates through image files
+"""
+Input:
+- folder='input/images/': The folder where images to be processed are saved 
+Output:
+- The filenames, ordered by picture taken date
+"""
+def FilesIterator(folder='input/images/'):
+	return [record.path for record in PhotosIterator(folder)]
+
+
+
+### Function used to determine sides of newly resized image, given a new area and original sides measures
+"""
+Input:
+- chosen_A: The new, chosen area
+- given_w: the original width
+- given_h: the original height
+Output:
+- The new width and height of the resized image
+"""
+def FindSides(chosen_A, given_w, given_h):
+	given_R = float(given_w) / float(given_h)		# Find W/H ratio
+	new_h = (chosen_A / given_R)**(1/2.0)
+	new_w = new_h * given_R
+	
+	new_h = int(round(new_h, 0))
+	new_w = int(round(new_w, 0))
+	
+	result_find_sides = (new_w,new_h)
+	
+	return result_find_sides
+
+
+
+### Tells whether a resizing option keeps the images as they are
+"""
+Input:
+- resize_opt: the image resizing option, see GetFile
+Output:
+- True for None (passthrough) and 1.0 (100% of the area): the originals are placed into the output without being decoded, see PlaceFile
+"""
+def IsPassthrough(resize_opt):
+	return resize_opt is None or resize_opt == 1.0
+
+
+
+### Copies a file, letting the kernel (and the file system) do the work
+"""os.copy_file_range copies without going through user space, and shares the blocks (a reflink) on file systems that support it,
+e.g. Btrfs or XFS; where it is not available, shutil.copyfile is used (itself relying on sendfile, or fcopyfile on macOS).
+Input:
+- source: the file to copy
+- destination: the file name of the copy
+Output:
+- The file name of the copy
+"""
+def CopyFile(source, destination):
+	if hasattr(os, 'copy_file_range'):
+		try:
+			with open(source, 'rb') as f_in, open(destination, 'wb') as f_out:
+				remaining = os.fstat(f_in.fileno()).st_size
+				while remaining > 0:
+					copied = os.copy_file_range(f_in.fileno(), f_out.fileno(), remaining)
+					if copied == 0:
+						break
+					remaining -= copied
+			if remaining <= 0:
+				return destination
+		except OSError:
+			pass
+
+	return shutil.copyfile(source, destination)
+
+
+
+### Removes an output file about to be written again
+"""Output images may be hard links, to the originals (see PlaceFile) or to the images of another build (see BatchRunner.SeedImages):
+writing into them would change the linked file too, so they are replaced instead of being written through.
+Input:
+- file_name: the output file
+Output:
+- None
+"""
+def UnlinkOutput(file_name):
+	if os.path.lexists(file_name):
+		os.unlink(file_name)
+
+
+
+### Places an original image into the output, as it is
+"""The file is hard linked where possible, and copied otherwise (see CopyFile): it is neither decoded nor encoded again.
+Input:
+- source: the original file
+- destination: the file name in the output; an existing file is replaced, see UnlinkOutput
+Output:
+- The file name in the output
+"""
+def PlaceFile(source, destination):
+	UnlinkOutput(destination)
+
+	try:
+		os.link(source, destination)
+	except OSError:
+		CopyFile(source, destination)
+
+	return destination
+
+
+
+### Handles the opening of an individual file.
+"""
+Input:
+- file_name: the name of the file to get
+- destination_folder: the folder where images (resized or otherwise) are saved
+- resize_opt=1.0: the image resizing option; if less than 1, it'd percentage resizing, otherwise in KILOBYTES; None (or 1.0) places the
+  original as it is, without decoding it (see PlaceFile)
+Returns:
+A file, or None if the file could not be processed
+"""
+def GetFile(file_name, destination_folder, resize_opt=1.0, resize_tolerance=5):
+	try:
+		new_img = ResizeFile(file_name, destination_folder, resize_opt, resize_tolerance)
+	except:
+		new_img = None
+
+	return new_img
+
+
+
+### Resizes an individual file and saves it into the destination folder
+"""Same as GetFile, but errors are raised instead of being turned into None.
+Input:
+- file_name: the name of the file to get
+- destination_folder: the folder where images (resized or otherwise) are saved, or a binary file-like object the image is written to
+  (then, if passed through or if the resizing is ignored, the original file is copied into it)
+- resize_opt=1.0: the image resizing option, see GetFile
+- resize_tolerance=5: the tolerance (in %) on the target filesize
+- stats=None: a dict; if given, the number of encoding iterations used to reach the target filesize is saved in its 'iterations' key,
+  and the seconds spent decoding, resizing and encoding the image are added to its 'decode_seconds', 'resize_seconds' and 'encode_seconds' keys
+- source_data=None: the bytes of the file, if already read; the file is then not opened again
+Returns:
+A file
+"""
+def ResizeFile(file_name, destination_folder, resize_opt=1.0, resize_tolerance=5, stats=None, source_data=None):
+	filename = os.path.basename(file_name)
+
+	in_memory = not isinstance(destination_folder, str)
+	if in_memory:
+		filename_destination = destination_folder
+	else:
+		filename_destination = destination_folder+filename
+		UnlinkOutput(filename_destination)
+
+	if IsPassthrough(resize_opt):
+		# Image.open only reads the headers: the pixels are not decoded
+		return PassthroughFile(file_name, filename_destination, source_data)
+
+	def OpenImage():
+		return Image.open(file_name) if source_data is None else Image.open(io.BytesIO(source_data))
+
+	img = OpenImage()
+	img_size_KB = (os.stat(file_name).st_size if source_data is None else len(source_data)) / 1024
+	exif = img.info['exif']
+
+	original_w, original_h = img.size
+	original_area = original_w * original_h
+
+	if resize_opt >= 0.01 and resize_opt < 1.0:
+		resize_ratio = resize_opt
+
+		new_area = original_area * resize_ratio
+		new_w, new_h = FindSides(new_area, original_w, original_h)
+
+		# Let the JPEG decoder downscale (DCT scaling) when the new size is far below the original one
+		img.draft(img.mode, (new_w*2, new_h*2))
+
+		clock = time.perf_counter()
+		img.load()
+		clock = AddSeconds(stats, 'decode_seconds', clock)
+
+		new_img = img.resize((new_w,new_h), Image.LANCZOS)
+		clock = AddSeconds(stats, 'resize_seconds', clock)
+
+		new_img.save(filename_destination, format=img.format if in_memory else None, exif=exif)
+		AddSeconds(stats, 'encode_seconds', clock)
+		if in_memory:
+			filename_destination.seek(0)
+		new_img = Image.open(filename_destination)
+
+	elif resize_opt > 50.0 and resize_opt <= img_size_KB:
+		# Bytes are roughly proportional to the area: predict the sides from the original filesize and decode at (at least) twice those
+		predicted_scale = (resize_opt / img_size_KB)**0.5
+		img.draft(img.mode, (int(original_w*predicted_scale*2), int(original_h*predicted_scale*2)))
+
+		clock = time.perf_counter()
+		img.load()
+		AddSeconds(stats, 'decode_seconds', clock)
+
+		data, iterations = FitFileSize(img, exif, resize_opt, resize_tolerance, start_scale=predicted_scale*original_w/img.size[0], stats=stats)
+
+		min_size = resize_opt*1024 * (100 - resize_tolerance) / 100
+		if len(data) < min_size and img.size[0] < original_w:
+			# Re-encoded pixels take far fewer bytes than the original ones: even the whole drafted image is too small, so decode at full size
+			# and carry on the search from the scale the drafted image reached
+			drafted_scale = img.size[0] / original_w
+			img.close()
+			img = OpenImage()
+
+			clock = time.perf_counter()
+			img.load()
+			AddSeconds(stats, 'decode_seconds', clock)
+
+			full_data, full_iterations = FitFileSize(img, exif, resize_opt, resize_tolerance, start_scale=drafted_scale*(resize_opt*1024 / len(data))**0.5, stats=stats)
+			iterations += full_iterations
+			if len(full_data) > len(data) and len(full_data) <= resize_opt*1024 * (100 + resize_tolerance) / 100:
+				data = full_data
+
+		if stats is not None:
+			stats['iterations'] = iterations
+
+		if in_memory:
+			filename_destination.write(data)
+			filename_destination.seek(0)
+		else:
+			with open(filename_destination, "wb") as f:
+				f.write(data)
+		new_img = Image.open(filename_destination)
+
+	else:
+		img.close()
+		new_img = PassthroughFile(file_name, filename_destination, source_data)
+		print("File resizing ignored: the file resize chosen is either below the 50KB or 1% thresholds, or larger than the original size. Please chose a different figure for 'resize_opt'.")
+
+	return new_img
+
+
+
+### Places an original file into the destination, and opens it without decoding its pixels
+"""
+Input:
+- file_name: the name of the file
+- filename_destination: the destination file name, or a binary file-like object the file is written to
+- source_data=None: the bytes of the file, if already read
+Output:
+- The PIL image of the file
+"""
+def PassthroughFile(file_name, filename_destination, source_data=None):
+	if not isinstance(filename_destination, str):
+		if source_data is not None:
+			filename_destination.write(source_data)
+		else:
+			with open(file_name, 'rb') as f:
+				shutil.copyfileobj(f, filename_destination)
+		filename_destination.seek(0)
+		return Image.open(filename_destination)
+
+	if source_data is not None:
+		with open(filename_destination, "wb") as f:
+			f.write(source_data)
+	else:
+		PlaceFile(file_name, filename_destination)
+
+	return Image.open(filename_destination)
+
+
+
+### Finds the image size matching a target filesize
+"""Searches the scale of the image whose JPEG encoding is as close as possible to, but not above, the target filesize.
+Each step predicts the scale from the last two encoded sizes (bytes grow as a power of the scale, roughly the square) and is kept within the bisection bracket.
+Input:
+- img: the PIL image, possibly already reduced with Image.draft
+- exif: the EXIF bytes to embed
+- resize_opt: the target filesize in KILOBYTES
+- resize_tolerance=5: the tolerance (in %) on the target filesize
+- max_iterations=10: the maximum number of encodings tried before settling for the best fitting one
+- start_scale=1.0: the first scale tried, e.g. as predicted from the original filesize
+- stats=None: a dict where the seconds spent resizing and encoding are added, see ResizeFile
+Output:
+- A tuple with the encoded JPEG bytes and the number of encodings done
+"""
+def FitFileSize(img, exif, resize_opt, resize_tolerance=5, max_iterations=10, start_scale=1.0, stats=None):
+	target_size = resize_opt*1024
+	max_size = target_size * (100 + resize_tolerance) / 100
+	min_size = target_size * (100 - resize_tolerance) / 100
+
+	def Encode(scale):
+		clock = time.perf_counter()
+		if scale < 1:
+			resized = img.resize((max(1, int(img.size[0]*scale)), max(1, int(img.size[1]*scale))), Image.LANCZOS)
+		else:
+			resized = img
+		clock = AddSeconds(stats, 'resize_seconds', clock)
+
+		with io.BytesIO() as buffer:
+			resized.save(buffer, format="JPEG", exif=exif)
+			AddSeconds(stats, 'encode_seconds', clock)
+			return buffer.getvalue()
+
+	best = None
+	low, high = 0.0, 1.0
+	scale = min(1.0, start_scale)
+	previous = None
+	full_size_tried = False
+	iterations = 0
+	while iterations < max_iterations or best is None:
+		data = Encode(scale)
+		iterations += 1
+		full_size_tried = full_size_tried or scale >= 1.0
+
+		if len(data) <= max_size or max(img.size)*scale < 1:
+			if best is None or len(data) > len(best):
+				best = data
+			low = max(low, scale)
+			# filesize fits: stop if close enough, or if the image cannot get any larger (or smaller)
+			if len(data) >= min_size or scale >= 1.0 or max(img.size)*scale < 1:
+				break
+		else:
+			high = min(high, scale)
+
+		if iterations >= max_iterations and best is None:
+			# no fitting size found yet: halve until one fits
+			scale = high / 2
+			continue
+
+		exponent = 2.0
+		if previous is not None and previous[0] != scale and previous[1] != len(data):
+			exponent = min(3.0, max(1.0, math.log(len(data) / previous[1]) / math.log(scale / previous[0])))
+		previous = (scale, len(data))
 
-		col_pick = selected_palette[col_ix]
-		col_ix += 1
+		scale = scale * (target_size / len(data))**(1 / exponent)
+		if scale >= 1.0 and not full_size_tried:
+			scale = 1.0
+		elif not low < scale < high:
+			scale = (low + high) / 2
 
+	return best, iterations
 
-		pl = kml_doc.createElement('Placemark')
 
-		name = kml_doc.createElement('name')
-		name.appendChild(kml_doc.createTextNode(placemark_name))
-		
-		LineString = kml_doc.createElement('LineString')
-		extrude = kml_doc.createElement('extrude')
-		extrude.appendChild(kml_doc.createTextNode('1'))
-		altitudeMode = kml_doc.createElement('altitudeMode')
-		altitudeMode.appendChild(kml_doc.createTextNode(alt_mode))
-		coordinates = kml_doc.createElement('coordinates')
-		coordinates.appendChild(kml_doc.createTextNode(placemark_coords))
-		LineString.appendChild(extrude)
-		LineString.appendChild(altitudeMode)
-		LineString.appendChild(coordinates)
 
-		Style = kml_doc.createElement('Style')
-		LineStyle = kml_doc.createElement('LineStyle')
-		color = kml_doc.createElement('color')
-		color.appendChild(kml_doc.createTextNode(col_pick))
-		width = kml_doc.createElement('width')
-		width.appendChild(kml_doc.createTextNode(str(line_width)))
-		LineStyle.appendChild(color)
-		LineStyle.appendChild(width)
-		Style.appendChild(LineStyle)
+### Processes an individual file, reporting errors instead of hiding them
+"""Used by GetFiles; it is defined at module level so that it can be sent to worker processes.
+Input:
+- file_name: the name of the file to get, or its PhotoMetadata record (as returned by PhotosIterator)
+- destination_folder: the folder where images (resized or otherwise) are saved; if None, they are kept in memory
+- resize_opt=1.0: the image resizing option, see GetFile
+- pyramid_tile_size=None: if set, the image pyramid of the processed image is also produced, with tiles of this size (see ImagePyramid)
+- source_data=None: the bytes of the file, if already read (see ResizeFile)
+Output:
+- A tuple with the file name, the destination file name, the metadata of the processed image (None on failure) and the error message (None on success);
+  if destination_folder is None, the destination is a dict mapping the names of the files produced (relative to the images folder) to their bytes.
+  The metadata is the PhotoMetadata record if one was given, as the headers are not read again, otherwise the record built from the headers of
+  the processed image, which is closed before returning; with an image pyramid, its size is the one of the processed image. The last item is a dict with the timings of the processing (see ResizeFile)
+"""
+def ProcessFile(file_name, destination_folder, resize_opt=1.0, pyramid_tile_size=None, source_data=None):
+	record = None
+	if isinstance(file_name, PhotoMetadata):
+		record = file_name
+		file_name = record.path
+
+	filename = os.path.basename(file_name)
+	timings = {}
+	if destination_folder is None:
+		buffer = io.BytesIO()
+		destination = None
+	else:
+		buffer = None
+		destination = destination_folder+filename
 
-		pl.appendChild(name)
-		pl.appendChild(LineString)
-		pl.appendChild(Style)
+	try:
+		new_img = ResizeFile(file_name, destination_folder if buffer is None else buffer, resize_opt, stats=timings, source_data=source_data)
 
-		document = kml_doc.getElementsByTagName('Document')[-1]
-		document.appendChild(pl)
+		if record is None:
+			data = RecordFromHeaders(file_name, GetHeaders(new_img), new_img.size)
+		else:
+			data = record
 
+		pyramid = {}
+		if pyramid_tile_size:
+			pyramid = EncodePyramid(new_img, pyramid_tile_size)
+			data = ProcessedSize(data, new_img.size)
 
+		if buffer is not None:
+			destination = {filename: buffer.getvalue()}
+			for tile_name, tile_data in pyramid.items():
+				destination[PyramidFolder(filename)+tile_name] = tile_data
+		else:
+			for tile_name, tile_data in pyramid.items():
+				os.makedirs(os.path.dirname(destination_folder+PyramidFolder(filename)+tile_name), exist_ok=True)
+				UnlinkOutput(destination_folder+PyramidFolder(filename)+tile_name)
+				with open(destination_folder+PyramidFolder(filename)+tile_name, "wb") as f:
+					f.write(tile_data)
+		new_img.close()
+
+		error = None
+	except Exception as e:
+		data = None
+		error = "%s: %s" % (type(e).__name__, e)
 
-##############################################################################
-### Images 
+	return file_name, destination, data, error, timings
 
-### Iterates through image files
-"""
+
+
+### Places an original image into the output, without decoding it
+"""Used by ProcessImages instead of GetFiles when the images are passed through (see IsPassthrough) with no image pyramid: only the headers are read.
 Input:
-- folder='input/images/': The folder where images to be processed are saved 
+- file_name: the name of the file, or its PhotoMetadata record
+- destination_folder: the folder where the image is placed, see PlaceFile; ignored if archive is given
+- archive=None: a KmzArchive the image is streamed into, from the file, instead
 Output:
-- The filenames, ordered by picture taken date
+- The ProcessFile tuple; with an archive, the destination is the name of the entry
 """
-def FilesIterator(folder='input/images/'):
-	entries = Path(folder)
+def PassthroughImage(file_name, destination_folder, archive=None):
+	record = file_name if isinstance(file_name, PhotoMetadata) else None
+	if record is not None:
+		file_name = record.path
 
-	valid_files = []
-	for entry in entries.iterdir():
-		if entry.is_file():
-			try:
-				img = Image.open(entry)
-				data = GetHeaders(img)
-				date_original = data['DateTimeOriginal']
-
-				date_original = datetime.datetime.strptime(date_original, "%Y:%m:%d %H:%M:%S")
-			except:
-				date_original = None
+	filename = os.path.basename(file_name)
+	try:
+		data = record if record is not None else ScanFile(file_name)
+		if data.width is None or data.height is None:
+			# Not an image (e.g. a text file in the folder): reported and skipped, as when it is opened to be resized
+			return file_name, None, None, "UnidentifiedImageError: cannot identify image file '%s'" % file_name, {}
 
-			valid_files.append([folder+entry.name, date_original])
+		if archive is None:
+			destination = PlaceFile(file_name, destination_folder+filename)
+		else:
+			destination = "img/"+filename
+			archive.AddFile(destination, file_name)
 
-	valid_files.sort(key=lambda x: x[1])
-	valid_files_ordered = []
-	for each_file in valid_files:
-		valid_files_ordered.append(each_file[0])
+		error = None
+	except Exception as e:
+		destination = None if archive is None else "img/"+filename
+		data = None
+		error = "%s: %s" % (type(e).__name__, e)
 
-	return valid_files_ordered
+	return file_name, destination, data, error, {}
 
 
 
-### Function used to determine sides of newly resized image, given a new area and original sides measures
+### Sets the size of a processed image into its metadata
 """
 Input:
-- chosen_A: The new, chosen area
-- given_w: the original width
-- given_h: the original height
+- data: the PhotoMetadata record, as returned by ProcessFile
+- size: the (width, height) of the processed image
 Output:
-- The new width and height of the resized image
+- A copy of the record, with the size of the processed image
 """
-def FindSides(chosen_A, given_w, given_h):
-	given_R = float(given_w) / float(given_h)		# Find W/H ratio
-	new_h = (chosen_A / given_R)**(1/2.0)
-	new_w = new_h * given_R
-	
-	new_h = int(round(new_h, 0))
-	new_w = int(round(new_w, 0))
-	
-	result_find_sides = (new_w,new_h)
-	
-	return result_find_sides
+def ProcessedSize(data, size):
+	return data.Replace(width=size[0], height=size[1])
 
 
 
-### Handles the opening of an individual file.
+### Reads the bytes of a file, for the read stage of the pipelined GetFiles
 """
 Input:
-- file_name: the name of the file to get
-- destination_folder: the folder where images (resized or otherwise) are saved
-- resize_opt=1.0: the image resizing option; if less than 1, it'd percentage resizing, otherwise in KILOBYTES 
-Returns:
-A file
+- file_name: the name of the file, or its PhotoMetadata record
+Output:
+- The bytes of the file, or None if it could not be read (ProcessFile then reports the error, when it fails to open it)
 """
-def GetFile(file_name, destination_folder, resize_opt=1.0, resize_tolerance=5):
-
-	new_img = None
+def ReadSourceData(file_name):
+	if isinstance(file_name, PhotoMetadata):
+		file_name = file_name.path
 
 	try:
-		img = img_orig = Image.open(file_name)
-		exif = img.info['exif']
+		with open(file_name, "rb") as f:
+			return f.read()
+	except OSError:
+		return None
 
-		img_size_KB = (os.stat(file_name).st_size) / 1024
-		filename = os.path.basename(file_name)
 
-		original_w, original_h = img.size
-		original_area = original_w * original_h
 
-		filename_destination = destination_folder+filename
+### Processes the bytes of a file in memory, for the process stage of the pipelined GetFiles
+"""Defined at module level, so that it can be sent to worker processes.
+Input:
+- file_name: the name of the file, or its PhotoMetadata record
+- source_data: the bytes of the file, as returned by ReadSourceData
+- resize_opt=1.0, pyramid_tile_size=None: see ProcessFile
+Output:
+- The ProcessFile tuple, with the files produced kept in memory
+"""
+def ProcessSourceData(file_name, source_data, resize_opt=1.0, pyramid_tile_size=None):
+	return ProcessFile(file_name, None, resize_opt, pyramid_tile_size, source_data)
 
-		if resize_opt >= 0.01 and resize_opt <= 1.0:
-			resize_ratio = resize_opt
 
-			new_area = original_area * resize_ratio
-			new_w, new_h = FindSides(new_area, original_w, original_h)
 
-			new_img = img.resize((new_w,new_h), Image.ANTIALIAS)
+### Saves the files produced in memory by ProcessFile, for the write stage of the pipelined GetFiles
+"""
+Input:
+- destination_folder: the folder where images (resized or otherwise) are saved
+- result: the ProcessFile tuple, with the files produced kept in memory
+Output:
+- The ProcessFile tuple, as if the files had been saved by ProcessFile itself
+"""
+def WriteProcessedFile(destination_folder, result):
+	file_name, produced, data, error, timings = result
+	destination = destination_folder+os.path.basename(file_name)
 
-			new_img.save(filename_destination, exif=exif)
-			new_img = Image.open(filename_destination)
+	if error is None:
+		try:
+			for produced_name, produced_data in produced.items():
+				os.makedirs(os.path.dirname(destination_folder+produced_name), exist_ok=True)
+				UnlinkOutput(destination_folder+produced_name)
+				with open(destination_folder+produced_name, "wb") as f:
+					f.write(produced_data)
+		except Exception as e:
+			data = None
+			error = "%s: %s" % (type(e).__name__, e)
 
-		elif resize_opt > 50.0 and resize_opt <= img_size_KB:
-			aspect = img.size[0] / img.size[1]
+	return file_name, destination, data, error, timings
 
-			while True:
-				with io.BytesIO() as buffer:
-					img.save(buffer, format="JPEG", exif=exif)
-					data = buffer.getvalue()
-				filesize = len(data)    
-				size_deviation = filesize / (resize_opt*1024)
 
-				if size_deviation <= (100 + resize_tolerance) / 100:
-					# filesize fits
-					with open(filename_destination, "wb") as f:
-						f.write(data)
-					new_img = Image.open(filename_destination)
-					break
-				
-				else:
-					# filesize not good enough => adapt width and height; use sqrt of deviation since applied both in width and height
-					new_width = img.size[0] / size_deviation**0.5    
-					new_height = new_width / aspect
-					# resize from img_orig to not lose quality
-					img = img_orig.resize((int(new_width), int(new_height)))
 
-		else:
-			new_img = img
-			print("File resizing ignored: the file resize chosen is either below the 50KB or 1% thresholds, or larger than the original size. Please chose a different figure for 'resize_opt'.")
+### Processes many files, optionally in parallel
+"""
+Input:
+- file_names: the files to process, e.g. as ordered by FilesIterator, or their PhotoMetadata records, as ordered by PhotosIterator
+- destination_folder: the folder where images (resized or otherwise) are saved; if None, they are kept in memory, see ProcessFile
+- resize_opt=1.0: the image resizing option, see GetFile
+- workers=None: the number of parallel workers; None or 1 processes the files one at a time
+- pool="process": the kind of pool used by the workers, either "process" (best for resizing, which is CPU-bound) or "thread"
+- pyramid_tile_size=None: the tile size of the image pyramids, if any, see ProcessFile
+- pipelined=False: whether reading, processing and writing the files overlap, with bounded queues between them (see Pipeline): the files
+				   are read and written by I/O threads while the workers (at least one) process them, so that slow storage does not leave the cores idle
+- queue_size=PIPELINE_QUEUE_SIZE: the maximum number of files waiting between two stages, when pipelined
+Output:
+- A generator of the ProcessFile tuples, in the same order as file_names
+"""
+def GetFiles(file_names, destination_folder, resize_opt=1.0, workers=None, pool="process", pyramid_tile_size=None, pipelined=False, queue_size=PIPELINE_QUEUE_SIZE):
+	if pipelined:
+		process = functools.partial(ProcessSourceData, resize_opt=resize_opt, pyramid_tile_size=pyramid_tile_size)
+		write = None if destination_folder is None else functools.partial(WriteProcessedFile, destination_folder)
+		for result in Pipeline(file_names, ReadSourceData, process, write, workers, pool, queue_size):
+			yield result
 
-	except:
-		new_img = None
+	elif workers is None or workers <= 1:
+		for file_name in file_names:
+			yield ProcessFile(file_name, destination_folder, resize_opt, pyramid_tile_size)
 
-	return new_img
+	else:
+		if pool == "thread":
+			executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+		else:
+			executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+		chunksize = max(1, len(file_names) // (workers*4))
+		with executor:
+			for result in executor.map(ProcessFile, file_names, itertools.repeat(destination_folder), itertools.repeat(resize_opt), itertools.repeat(pyramid_tile_size), chunksize=chunksize):
+				yield result
 
 
 
@@ -320,9 +1627,9 @@ Output:
 def GetHeaders(the_file):#file_name):
 	try:
 		data = {
-			PIL.ExifTags.TAGS[k]: v
+			ExifTags.TAGS[k]: v
 			for k, v in the_file._getexif().items()
-			if k in PIL.ExifTags.TAGS
+			if k in ExifTags.TAGS
 		}			
 
 	except IOError:
@@ -355,6 +1662,23 @@ def DmsToDecimal(degree_num, degree_den, minute_num, minute_den, second_num, sec
 
 
 
+### Splits an EXIF rational into numerator and denominator
+"""Older Pillow versions (and ScanFile) return rationals as (numerator, denominator) tuples, newer ones as IFDRational objects.
+Input:
+- value: the rational value
+Output:
+- A (numerator, denominator) tuple
+"""
+def RationalParts(value):
+	if isinstance(value, tuple):
+		return value
+	elif hasattr(value, 'numerator'):
+		return value.numerator, value.denominator
+	else:
+		return value, 1
+
+
+
 ### Parses out the the GPS headers from the headers data.
 """Parses out the GPS coordinates from the file.
 Input:
@@ -366,7 +1690,7 @@ def GetGps(data):
 
 	latitude = None
 	try:
-		lat_dms = data['GPSInfo'][2]
+		lat_dms = [RationalParts(v) for v in data['GPSInfo'][2]]
 		lat_ref = data['GPSInfo'][1]
 
 		latitude = DmsToDecimal(lat_dms[0][0], lat_dms[0][1], lat_dms[1][0], lat_dms[1][1], lat_dms[2][0], lat_dms[2][1])
@@ -378,7 +1702,7 @@ def GetGps(data):
 
 	longitude = None
 	try:
-		long_dms = data['GPSInfo'][4]
+		long_dms = [RationalParts(v) for v in data['GPSInfo'][4]]
 		long_ref = data['GPSInfo'][3]
 
 		longitude = DmsToDecimal(long_dms[0][0], long_dms[0][1], long_dms[1][0], long_dms[1][1], long_dms[2][0], long_dms[2][1])
@@ -391,8 +1715,7 @@ def GetGps(data):
 
 	altitude = None
 	try:
-		alt_cm = data['GPSInfo'][6][0]
-		alt_ref = data['GPSInfo'][6][1]
+		alt_cm, alt_ref = RationalParts(data['GPSInfo'][6])
 
 		altitude = alt_cm/alt_ref
 
@@ -406,60 +1729,136 @@ def GetGps(data):
 
 
 
-### Creates an individual PhotoOverlay XML element object.
-"""Creates a PhotoOverlay element in the kml_doc element.
+### Computes the values of an individual PhotoOverlay
+"""Computes the values needed by the PhotoOverlay element from the record of the photo; the headers are only read if given a PIL image.
 Input:
-- kml_doc: An XML document object.
 - file_name: The name of the file.
-- the_file: The file object.
+- the_file: Its PhotoMetadata record (as returned by ProcessFile), or a PIL image (or dict of its headers).
 - file_iterator: The file iterator, used to create the id.
-Input:
-- An XML element representing the PhotoOverlay.
+- pyramid_tile_size=None: if set, the overlay points to the image pyramid (see ImagePyramid) instead of the image itself.
+Output:
+- A dict with the PhotoOverlay values (id, name, description, href, coordinates and FOV), as text; with an image pyramid,
+  'image_pyramid' holds its values too (tile_size, max_width, max_height, grid_origin). 'position' holds the (longitude, latitude)
+  of the record as they are (floats, or None), see OverlayPositions.
 """
-def CreatePhotoOverlay(kml_doc, file_name, the_file, file_iterator):
+def PhotoOverlayValues(file_name, the_file, file_iterator, pyramid_tile_size=None):
 	file_basename = os.path.basename(file_name)
 	file_name_clean, file_extension = os.path.splitext(file_basename)
 	correct_file_name = "img/"+file_basename
 
 	photo_id = 'photo%s' % file_iterator
-	data = GetHeaders(the_file)
-	coords = GetGps(data)
+
+	if not isinstance(the_file, PhotoMetadata):
+		if isinstance(the_file, dict):
+			the_file = RecordFromHeaders(file_name, the_file)
+		else:
+			the_file = RecordFromHeaders(file_name, GetHeaders(the_file), the_file.size)
+
+	coords = (the_file.latitude, the_file.longitude, the_file.altitude)
+
+	# Determines the proportions of the image and uses them to set FOV.
+	width = float(the_file.width)
+	length = float(the_file.height)
+
+	overlay = {
+		'photo_id': photo_id,
+		'name': file_name_clean,
+		'description': '<a href="#%s">Click here to fly into photo</a>' % photo_id,
+		'href': correct_file_name,
+		'longitude': str(coords[1]),
+		'latitude': str(coords[0]),
+		'left_fov': str(width/length * -20.0),
+		'right_fov': str(width/length * 20.0),
+		'point': '%s,%s,%s' %(coords[1], coords[0], coords[2]),
+		'image_href': correct_file_name,
+		'position': (the_file.longitude, the_file.latitude),
+	}
+
+	if pyramid_tile_size:
+		overlay['href'] = "img/"+PyramidFolder(file_basename)+PYRAMID_HREF
+		overlay['image_pyramid'] = {
+			'tile_size': str(pyramid_tile_size),
+			'max_width': str(int(width)),
+			'max_height': str(int(length)),
+			'grid_origin': 'upperLeft',
+		}
+
+	return overlay
+
+
+
+### Extracts the positions of the photos
+"""Used to place the photos into tiles and clusters.
+Input:
+- overlays: the PhotoOverlay values of the photos, as returned by PhotoOverlayValues
+Output:
+- A tuple with the longitudes and latitudes arrays; NaN for the photos without a position
+"""
+def OverlayPositions(overlays):
+	positions = np.array([[np.nan if value is None else value for value in overlay['position']] for overlay in overlays], dtype=np.float64).reshape(-1, 2)
+
+	return positions[:, 0], positions[:, 1]
+
+
+
+### Computes the values of a photo for the export writers
+"""
+Input:
+- file_name: The name of the file.
+- the_file: Its PhotoMetadata record (as returned by ProcessImages).
+Output:
+- A dict with the name, href (the image in the output, e.g. 'img/photo.jpg'), timestamp (ISO 8601 text, camera clock), latitude, longitude,
+  altitude, width and height of the photo; values that could not be read are None
+"""
+def PhotoExportValues(file_name, the_file):
+	file_basename = os.path.basename(file_name)
+
+	return {
+		'name': os.path.splitext(file_basename)[0],
+		'href': "img/"+file_basename,
+		'timestamp': the_file.timestamp.isoformat() if the_file.timestamp is not None else None,
+		'latitude': the_file.latitude,
+		'longitude': the_file.longitude,
+		'altitude': the_file.altitude,
+		'width': the_file.width,
+		'height': the_file.height,
+	}
+
+
+
+### Creates an individual PhotoOverlay XML element object.
+"""Creates a PhotoOverlay element in the kml_doc element.
+Input:
+- kml_doc: An XML document object.
+- file_name: The name of the file.
+- the_file: The file object, or its metadata (as returned by ProcessFile).
+- file_iterator: The file iterator, used to create the id.
+- document=None: The Document element to append the PhotoOverlay to; if None, the last Document of kml_doc is used.
+Input:
+- An XML element representing the PhotoOverlay.
+"""
+def CreatePhotoOverlay(kml_doc, file_name, the_file, file_iterator, document=None, pyramid_tile_size=None):
+	overlay = PhotoOverlayValues(file_name, the_file, file_iterator, pyramid_tile_size)
 
 	po = kml_doc.createElement('PhotoOverlay')
-	po.setAttribute('id', photo_id)
+	po.setAttribute('id', overlay['photo_id'])
 	name = kml_doc.createElement('name')
-	name.appendChild(kml_doc.createTextNode(file_name_clean))
+	name.appendChild(kml_doc.createTextNode(overlay['name']))
 	description = kml_doc.createElement('description')
-	description.appendChild(kml_doc.createCDATASection('<a href="#%s">'
-													 'Click here to fly into '
-													 'photo</a>' % photo_id))
+	description.appendChild(kml_doc.createCDATASection(overlay['description']))
 	po.appendChild(name)
 	po.appendChild(description)
 	icon = kml_doc.createElement('Icon')
 	href = kml_doc.createElement('href')
-	href.appendChild(kml_doc.createTextNode(correct_file_name))
+	href.appendChild(kml_doc.createTextNode(overlay['href']))
 	camera = kml_doc.createElement('Camera')
 	longitude = kml_doc.createElement('longitude')
 	latitude = kml_doc.createElement('latitude')
 	altitude = kml_doc.createElement('altitude')
 	tilt = kml_doc.createElement('tilt')
 	
-	# Determines the proportions of the image and uses them to set FOV.
-	try:
-		width = float(data['ExifImageWidth'])
-	except:
-		width = float(data['ImageWidth'])
-
-	try:
-		length = float(data['ExifImageHeight'])
-	except:
-		length = float(data['ImageLength'])
-
-	lf = str(width/length * -20.0)
-	rf = str(width/length * 20.0)
-	
-	longitude.appendChild(kml_doc.createTextNode(str(coords[1])))
-	latitude.appendChild(kml_doc.createTextNode(str(coords[0])))
+	longitude.appendChild(kml_doc.createTextNode(overlay['longitude']))
+	latitude.appendChild(kml_doc.createTextNode(overlay['latitude']))
 	altitude.appendChild(kml_doc.createTextNode('30'))
 	tilt.appendChild(kml_doc.createTextNode('0'))
 	camera.appendChild(longitude)
@@ -473,8 +1872,8 @@ def CreatePhotoOverlay(kml_doc, file_name, the_file, file_iterator):
 	bottomfov = kml_doc.createElement('bottomFov')
 	topfov = kml_doc.createElement('topFov')
 	near = kml_doc.createElement('near')
-	leftfov.appendChild(kml_doc.createTextNode(lf))
-	rightfov.appendChild(kml_doc.createTextNode(rf))
+	leftfov.appendChild(kml_doc.createTextNode(overlay['left_fov']))
+	rightfov.appendChild(kml_doc.createTextNode(overlay['right_fov']))
 	bottomfov.appendChild(kml_doc.createTextNode('-20'))
 	topfov.appendChild(kml_doc.createTextNode('20'))
 	near.appendChild(kml_doc.createTextNode('10'))
@@ -486,13 +1885,21 @@ def CreatePhotoOverlay(kml_doc, file_name, the_file, file_iterator):
 	po.appendChild(camera)
 	po.appendChild(icon)
 	po.appendChild(viewvolume)
+	if overlay.get('image_pyramid'):
+		imagepyramid = kml_doc.createElement('ImagePyramid')
+		for tag, key in (('tileSize', 'tile_size'), ('maxWidth', 'max_width'), ('maxHeight', 'max_height'), ('gridOrigin', 'grid_origin')):
+			element = kml_doc.createElement(tag)
+			element.appendChild(kml_doc.createTextNode(overlay['image_pyramid'][key]))
+			imagepyramid.appendChild(element)
+		po.appendChild(imagepyramid)
 	point = kml_doc.createElement('point')
 	coordinates = kml_doc.createElement('coordinates')
-	coordinates.appendChild(kml_doc.createTextNode('%s,%s,%s' %(coords[1], coords[0], coords[2])))
+	coordinates.appendChild(kml_doc.createTextNode(overlay['point']))
 	point.appendChild(coordinates)
 	po.appendChild(point)
 
-	document = kml_doc.getElementsByTagName('Document')[-1]
+	if document is None:
+		document = kml_doc.getElementsByTagName('Document')[-1]
 	document.appendChild(po)
 
 
@@ -500,6 +1907,371 @@ def CreatePhotoOverlay(kml_doc, file_name, the_file, file_iterator):
 ##############################################################################
 ### WRAPPERS
 
+### Processes the image files one at a time
+"""
+Input:
+- file_names: the image files, as returned by FilesIterator, or their records, as returned by PhotosIterator
+- out_folder_img: the folder where images (resized or otherwise) are saved
+- resize_opt: the image resizing option, see GetFile
+- verbose=False: whether to print the progress
+- workers=None: the number of parallel workers resizing the images, see GetFiles
+- pool="process": the kind of pool used by the workers, see GetFiles
+- up_to_date=None: the set of source file names whose output image is up to date (see CompareManifest); these are not processed again
+- manifest=None: the manifest images dict (see LoadManifest), updated with the processed images
+- archive=None: a KmzArchive; if given, the images are written into its 'img/' folder (stored, not compressed) instead of out_folder_img
+- pyramid_tile_size=None: if set, the image pyramids are also produced, see ProcessFile
+- observer=None: a BuildObserver (or callable) receiving an 'image' event for each processed image, see Instrumentation
+- pipelined=False: whether reading, processing and writing the images overlap, see GetFiles
+Output:
+- A generator of (destination file name, PhotoMetadata record) tuples, in the same order as file_names, the record 'output' set to the
+  destination; unreadable files are reported and skipped
+"""
+def ProcessImages(file_names, out_folder_img, resize_opt, verbose=False, workers=None, pool="process", up_to_date=None, manifest=None, archive=None, pyramid_tile_size=None, observer=None, pipelined=False):
+	if up_to_date is None:
+		up_to_date = set()
+
+	def SourcePath(file_name):
+		return file_name.path if isinstance(file_name, PhotoMetadata) else file_name
+
+	to_process = [f for f in file_names if SourcePath(f) not in up_to_date]
+	if IsPassthrough(resize_opt) and not pyramid_tile_size:
+		# Nothing to decode: the images are linked or copied (or streamed into the archive) at disk speed, no workers needed
+		results = (PassthroughImage(f, out_folder_img, archive) for f in to_process)
+	else:
+		results = GetFiles(to_process, out_folder_img if archive is None else None, resize_opt, workers, pool, pyramid_tile_size, pipelined)
+
+	file_counter = 0
+	tot_files = len(file_names)
+	for each_file in file_names:
+		file_counter += 1
+		source = SourcePath(each_file)
+		filename = os.path.basename(source)
+
+		if source in up_to_date:
+			destination = out_folder_img+filename
+			data = each_file if isinstance(each_file, PhotoMetadata) else ScanFile(source)
+			if pyramid_tile_size:
+				with Image.open(destination) as output_img:
+					data = ProcessedSize(data, output_img.size)
+
+		else:
+			file_name, destination, data, error, timings = next(results)
+			if isinstance(destination, dict):
+				output_bytes = sum(len(produced_data) for produced_data in destination.values())
+			elif archive is not None:
+				output_bytes = os.path.getsize(file_name) if error is None else 0
+			else:
+				output_bytes = os.path.getsize(destination) if error is None and os.path.exists(destination) else 0
+			NotifyObserver(observer, 'image', file_name=file_name, decode_seconds=timings.get('decode_seconds'), resize_seconds=timings.get('resize_seconds'),
+				encode_seconds=timings.get('encode_seconds'), iterations=timings.get('iterations'), bytes=output_bytes, error=error)
+
+			if error is not None:
+				print("'%s' is unreadable (%s)\n" % (file_name, error))
+				if manifest is not None:
+					manifest.pop(filename, None)
+				continue
+
+			if isinstance(destination, dict):
+				for produced_name, produced_data in destination.items():
+					archive.WriteFile("img/"+produced_name, produced_data)
+				destination = "img/"+filename
+
+			if manifest is not None:
+				manifest[filename] = ManifestEntry(source, resize_opt, pyramid_tile_size=pyramid_tile_size)
+
+		yield destination, data.Replace(output=destination)
+
+		if verbose:
+			print("Image "+str(file_counter)+" out of "+str(tot_files)+" added to KML file: "+filename)
+
+
+
+### Hands the processed images to the export writers, as the KML consumes them
+"""The images are only processed once, whatever the number of outputs.
+Input:
+- images: the processed images, as returned by ProcessImages
+- exports: the ExportWriters the photos are written to
+Output:
+- A generator of the same (destination file name, PhotoMetadata record) tuples
+"""
+def ExportPhotos(images, exports):
+	for complete_file_name, the_file in images:
+		exports.WritePhoto(PhotoExportValues(complete_file_name, the_file))
+
+		yield complete_file_name, the_file
+
+
+
+### Builds the KML document in memory and writes it once
+"""
+Input:
+- kml_file_name: the file name of the KML output
+- new_file_name: the name of the KML document
+- coords_df=None: the dataframe with GPS coordinates, if any
+- images=None: the processed images, as returned by ProcessImages, if any
+- checkpoint_every=None: if set to N, the partial KML file is also written every N images
+- precision=None: the number of decimals of the coordinates, see CoordinatesParser
+- simplify_tolerance=None: the simplification tolerance in metres, see CoordinatesParser
+- stats=None: a dict where the points counts are added, see CoordinatesParser
+- pyramid_tile_size=None: if set, the PhotoOverlays point to the image pyramids, see PhotoOverlayValues
+Output:
+- The KML file
+"""
+def BuildKmlDom(kml_file_name, new_file_name, coords_df=None, images=None, checkpoint_every=None, precision=None, simplify_tolerance=None, stats=None, pyramid_tile_size=None):
+	kml_doc = CreateKmlDoc(new_file_name)
+
+	if images is None:
+		CreatePlacemark(coords_df, kml_doc, precision=precision, simplify_tolerance=simplify_tolerance, stats=stats)
+
+	else:
+		## Sub-documents and placemarks are created once; overlays are then appended as images are processed
+		if coords_df is None:
+			pictures_doc = kml_doc.getElementsByTagName('Document')[-1]
+		else:
+			pictures_doc = CreateSubDocument(kml_doc, "Pictures")
+			trips_doc = CreateSubDocument(kml_doc, "Trips")
+			CreatePlacemark(coords_df, kml_doc, trips_doc, precision, simplify_tolerance, stats)
+
+		file_iterator = 0
+		for complete_file_name, the_file in images:
+			CreatePhotoOverlay(kml_doc, complete_file_name, the_file, file_iterator, pictures_doc, pyramid_tile_size)
+			file_iterator += 1
+
+			if checkpoint_every and file_iterator % checkpoint_every == 0:
+				WriteKmlDoc(kml_doc, kml_file_name)
+
+	WriteKmlDoc(kml_doc, kml_file_name)
+
+
+
+### Streams the KML elements to the file as they are produced
+"""
+Input:
+- kml_output: the file name of the KML output, or a file-like object
+- new_file_name: the name of the KML document
+- coords_df=None: the dataframe with GPS coordinates, if any
+- images=None: the processed images, as returned by ProcessImages, if any
+- checkpoint_every=None: if set to N, the KML file is flushed every N images
+- pretty_print=True: whether to indent the KML file
+- precision=None: the number of decimals of the coordinates, see CoordinatesParser
+- simplify_tolerance=None: the simplification tolerance in metres, see CoordinatesParser
+- stats=None: a dict where the points counts are added, see CoordinatesParser
+- pyramid_tile_size=None: if set, the PhotoOverlays point to the image pyramids, see PhotoOverlayValues
+- cluster_photos=False: whether to cluster the photos by zoom level, see StreamPhotoClusters; all the photos are then read before being written
+- gx_track=False: whether the tracks are written as gx:Track elements, from the 'time' column, see StreamPlacemarks
+Output:
+- The KML file
+"""
+def StreamKml(kml_output, new_file_name, coords_df=None, images=None, checkpoint_every=None, pretty_print=True, precision=None, simplify_tolerance=None, stats=None, pyramid_tile_size=None, cluster_photos=False, gx_track=False):
+	with KmlStreamWriter(kml_output, pretty_print=pretty_print) as writer:
+		writer.StartDocument(new_file_name, gx_namespace=gx_track)
+
+		if images is None:
+			StreamPlacemarks(coords_df, writer, precision=precision, simplify_tolerance=simplify_tolerance, stats=stats, gx_track=gx_track)
+
+		else:
+			if coords_df is not None:
+				writer.StartSubDocument("Pictures")
+
+			if cluster_photos:
+				StreamPhotoClusters([PhotoOverlayValues(complete_file_name, the_file, file_iterator, pyramid_tile_size) for file_iterator, (complete_file_name, the_file) in enumerate(images)], writer)
+
+			else:
+				file_iterator = 0
+				for complete_file_name, the_file in images:
+					writer.WritePhotoOverlay(PhotoOverlayValues(complete_file_name, the_file, file_iterator, pyramid_tile_size))
+					file_iterator += 1
+
+					if checkpoint_every and file_iterator % checkpoint_every == 0:
+						writer.Flush()
+
+			if coords_df is not None:
+				writer.EndSubDocument()
+				writer.StartSubDocument("Trips")
+				StreamPlacemarks(coords_df, writer, precision=precision, simplify_tolerance=simplify_tolerance, stats=stats, gx_track=gx_track)
+				writer.EndSubDocument()
+
+
+
+### Streams the photos, clustered by zoom level
+"""Zoomed out, each cell of a grid (see Clustering) holding two or more photos is shown as a single placemark, with the number of photos,
+their bounding box and the photo closest to their centre as icon; zooming in, the grid is split in four at each level (the Region of a cluster
+is active while its cell covers between min_lod_pixels and twice as many pixels), until each photo is alone in its cell and shown by itself.
+Input:
+- overlays: the PhotoOverlay values of the photos, as returned by PhotoOverlayValues
+- writer: the KmlStreamWriter the clusters and PhotoOverlays are written to
+- min_lod_pixels=128: the size (in pixels) of a grid cell on screen where the next level takes over
+Output:
+- The clusters, in a folder per level, then the PhotoOverlays, written to the writer
+"""
+def StreamPhotoClusters(overlays, writer, min_lod_pixels=128):
+	photo_lon, photo_lat = OverlayPositions(overlays)
+	located = np.flatnonzero(~(np.isnan(photo_lon) | np.isnan(photo_lat)))
+
+	bounds, levels, photo_levels = ClusterPhotos(photo_lon[located], photo_lat[located], max_level=CLUSTER_MAX_LEVEL)
+
+	if levels:
+		writer.StartElement('Folder')
+		writer.WriteElement('name', 'Clusters')
+
+		for level in levels:
+			writer.StartElement('Folder')
+			writer.WriteElement('name', 'Level %d' % level['level'])
+
+			cell_bounds = TileBounds(bounds, level['level'], level['x'], level['y'])
+			for cluster_ix in range(len(level['count'])):
+				count = int(level['count'][cluster_ix])
+				representative = overlays[located[level['representative'][cluster_ix]]]
+				writer.WriteClusterPlacemark({
+					'name': '%d photos' % count,
+					'description': '<img src="%s" width="256"/><br/>%d photos, around %s' % (representative['image_href'], count, representative['name']),
+					'icon_href': representative['image_href'],
+					'scale': '%.2f' % min(3.0, 1.0 + 0.5*math.log10(count)),
+					'region': (tuple(float(side[cluster_ix]) for side in cell_bounds), min_lod_pixels if level['level'] > 0 else 0, 2*min_lod_pixels),
+					'count': str(count),
+					'west': repr(float(level['west'][cluster_ix])),
+					'south': repr(float(level['south'][cluster_ix])),
+					'east': repr(float(level['east'][cluster_ix])),
+					'north': repr(float(level['north'][cluster_ix])),
+					'point': '%r,%r' % (float(level['lon'][cluster_ix]), float(level['lat'][cluster_ix])),
+				})
+
+			writer.EndElement()
+
+		writer.EndElement()
+
+	# Each photo shows up from the level where it is alone in its cell; photos never alone (same position) once the deepest clusters are gone
+	photo_regions = {}
+	for photo_level in np.unique(photo_levels).tolist():
+		members = located[photo_levels == photo_level]
+		level = min(photo_level, CLUSTER_MAX_LEVEL)
+		if photo_level == 0:
+			min_lod = 0
+		elif photo_level <= CLUSTER_MAX_LEVEL:
+			min_lod = min_lod_pixels
+		else:
+			min_lod = 2*min_lod_pixels
+
+		cell_bounds = TileBounds(bounds, level, *GridCells(photo_lon[members], photo_lat[members], bounds, level))
+		for member_ix, photo_ix in enumerate(members.tolist()):
+			photo_regions[photo_ix] = (tuple(float(side[member_ix]) for side in cell_bounds), min_lod)
+
+	for photo_ix, overlay in enumerate(overlays):
+		if photo_ix in photo_regions:
+			overlay = dict(overlay, region=photo_regions[photo_ix])
+		writer.WritePhotoOverlay(overlay)
+
+
+
+### Writes the KML as a pyramid of tiles, linked through Regions
+"""Photos and track points are split into a quadtree of tiles (see Tiling.QuadtreeTiles); each tile is written to its own KML in the
+'tiles/' folder, and only linked (NetworkLink) from its parent tile with a Region, so that viewers only load the tiles in view.
+Tracks are cut into one LineString per tile they cross, each segment running up to the first point of the next one.
+The coordinates are loaded in memory to be tiled, even if given as a CSV file name or in chunks.
+Input:
+- out_folder: the KML output folder; the root KML is written there, the tiles into its 'tiles/' folder (replaced if it exists)
+- new_file_name: the name of the KML document
+- coords_df=None: the dataframe with GPS coordinates (or a CSV file name or an iterator of dataframes), if any
+- images=None: the processed images, as returned by ProcessImages, if any; photos without location are put in the root KML
+- pretty_print=True: whether to indent the KML files
+- precision=None: the number of decimals of the coordinates, see CoordinatesParser
+- simplify_tolerance=None: the simplification tolerance in metres, see CoordinatesParser
+- stats=None: a dict where the points counts are added, see CoordinatesParser
+- max_items=1000: the maximum number of photos and track points in a tile
+- min_lod_pixels=128: the size on screen (in pixels) from which a tile is loaded
+- pyramid_tile_size=None: if set, the PhotoOverlays point to the image pyramids, see PhotoOverlayValues
+Output:
+- The number of tiles written
+"""
+def StreamTiledKml(out_folder, new_file_name, coords_df=None, images=None, pretty_print=True, precision=None, simplify_tolerance=None, stats=None, max_items=1000, min_lod_pixels=128, pyramid_tile_size=None):
+	tiles_folder = out_folder+TILES_FOLDER
+	shutil.rmtree(tiles_folder, ignore_errors=True)
+	os.makedirs(tiles_folder)
+
+	## Photos: the overlays are computed first, their position places them into the tiles
+	overlays = []
+	if images is not None:
+		file_iterator = 0
+		for complete_file_name, the_file in images:
+			overlays.append(PhotoOverlayValues(complete_file_name, the_file, file_iterator, pyramid_tile_size))
+			file_iterator += 1
+
+	photo_lon, photo_lat = OverlayPositions(overlays)
+	located = np.flatnonzero(~(np.isnan(photo_lon) | np.isnan(photo_lat)))
+
+	## Tracks
+	placemarks = []
+	lon = lat = elevation = np.empty(0)
+	if coords_df is not None:
+		if not IsCoordinatesTable(coords_df):
+			coords_df = pd.concat(list(CoordinatesChunks(coords_df)), ignore_index=True)
+
+		groups = PlacemarkGroups(coords_df)
+		lon, lat, elevation = CoordinatesArrays(coords_df)
+		for placemark_name, placemark_is_flight in UniquePlacemarks(coords_df):
+			rows = groups.get(placemark_name, np.empty(0, dtype=np.intp))
+			rows = SimplifiedRows(rows, lon, lat, elevation, placemark_is_flight, simplify_tolerance, stats)
+			placemarks.append((placemark_name, placemark_is_flight, rows))
+	selected_palette = ColourPicker(len(placemarks))
+
+	track_rows = np.concatenate([rows for _, _, rows in placemarks] + [np.empty(0, dtype=np.intp)])
+
+	## Tiling: the photos come first, then the track points in placemark order
+	tiles = {}
+	all_lon = np.concatenate([photo_lon[located], lon[track_rows]])
+	all_lat = np.concatenate([photo_lat[located], lat[track_rows]])
+	if len(all_lon):
+		bounds = PyramidBounds(all_lon, all_lat)
+		keys = QuadtreeTiles(all_lon, all_lat, bounds, max_items)
+		tiles = TileTree(keys)
+
+		# Contents of the leaves: photo positions, and (placemark, first row, last row) segments
+		photos_in = collections.defaultdict(list)
+		for photo_ix, key in zip(located, keys[:len(located)]):
+			photos_in[int(key)].append(photo_ix)
+
+		segments_in = collections.defaultdict(list)
+		offset = len(located)
+		for placemark_ix, (_, _, rows) in enumerate(placemarks):
+			rows_keys = keys[offset:offset+len(rows)]
+			offset += len(rows)
+			starts = np.flatnonzero(np.r_[True, rows_keys[1:] != rows_keys[:-1]]) if len(rows) else []
+			for start, end in zip(starts, list(starts[1:])+[len(rows)-1]):
+				segments_in[int(rows_keys[start])].append((placemark_ix, start, end))
+
+	## Root KML
+	with KmlStreamWriter(out_folder+new_file_name+".kml", pretty_print=pretty_print) as writer:
+		writer.StartDocument(new_file_name)
+		for photo_ix in np.flatnonzero(np.isnan(photo_lon) | np.isnan(photo_lat)):
+			writer.WritePhotoOverlay(overlays[photo_ix])
+		if tiles:
+			root_key = min(tiles)
+			writer.WriteNetworkLink(new_file_name, TILES_FOLDER+TileFileName(root_key))
+
+	## Tiles: links to the children, or the photos and track segments of the leaves
+	for key, children in tiles.items():
+		with KmlStreamWriter(tiles_folder+TileFileName(key), pretty_print=pretty_print) as writer:
+			writer.StartDocument(TileFileName(key)[:-4])
+
+			for child in children:
+				writer.WriteNetworkLink(TileFileName(child)[:-4], TileFileName(child), TileBounds(bounds, *TileFromKey(child)), min_lod_pixels)
+
+			for photo_ix in photos_in.get(key, []):
+				overlay = dict(overlays[photo_ix])
+				overlay['href'] = '../'+overlay['href']
+				writer.WritePhotoOverlay(overlay)
+
+			for placemark_ix, start, end in segments_in.get(key, []):
+				placemark_name, placemark_is_flight, rows = placemarks[placemark_ix]
+				segment = rows[start:end+1]
+				alt_mode, line_width = PlacemarkStyle(placemark_is_flight)
+				coordinates = FormatCoordinates(lon[segment], lat[segment], elevation[segment] if placemark_is_flight == 1 else None, precision)
+				writer.WritePlacemark(placemark_name, alt_mode, line_width, selected_palette[placemark_ix], ['\n', coordinates+'\n'])
+
+	return len(tiles)
+
+
+
 ### Create final KML file:
 """Creates the KML Document with the PhotoOverlays, and writes it to a file.
 Input:
@@ -530,7 +2302,7 @@ Input:
 - kml_doc: the KML object
 - media_type=["Pictures", "Trips"]: whether images or coordinates
 Output:
-- Same KML doc but with a sub-'document' appended to it
+- Same KML doc but with a sub-'document' appended to it; the new sub-document element is returned
 """
 def CreateSubDocument(kml_doc, media_type):
 	document = kml_doc.createElement('Document')
@@ -542,23 +2314,79 @@ def CreateSubDocument(kml_doc, media_type):
 	main_document = kml_doc.getElementsByTagName('Document')[0]
 	main_document.appendChild(document)
 
+	return document
+
+
+
+### Writes the KML doc to file
+"""
+Input:
+- kml_doc: the KML object
+- kml_file_name: the file name of the KML output
+Output:
+- The KML file, pretty-printed and utf-8 encoded
+"""
+def WriteKmlDoc(kml_doc, kml_file_name):
+	with open(kml_file_name, 'wb') as kml_file:
+		kml_file.write(kml_doc.toprettyxml('  ', newl='\n', encoding='utf-8'))
+
 
 
 ### Create final KML file
 """
 Input:
 - output_folder: the folder (and filename) of the KML output
-- coords_df: the file location where coordinates are saved (with ['placemark', 'keep_elevation', 'time', 'lat', 'lon', 'elevation'] as headers)
+- coords_df: the dataframe of coordinates (with ['placemark', 'keep_elevation', 'time', 'lat', 'lon', 'elevation'] as headers); to avoid loading large tracks in memory at once,
+			  this can also be the file location of a CSV with the same headers, or an iterator of dataframes (e.g. pd.read_csv(..., chunksize=...)): these are read in chunks.
+			  Parquet and Arrow files (with pyarrow installed), a dict (or structured array) of NumPy columns with the same names, a TrackArrays
+			  and a track cache folder are accepted too (see TrackCache)
 - img_input_folder: the folder where geo-located images are saved
 - resize_opt=1.0: the resizing of images;	- if 0.01=<resize_opt<1.0, the image will be resized as per the % chosen according to the area, 
 											- if 50=<resize_opt=<original size in KB, the image will be resized as per the filesize chosen
-											- anything else will be ignored
+											- if None (or 1.0), the originals are placed as they are (hard linked, or copied), without decoding them
+											- anything else will be ignored, and the originals placed as they are
 - zip_files=False: Whether to archive the output folder and its contents
 - verbose=False: whether to make process verbose
+- checkpoint_every=None: if set to N, the partial KML file is also written (or flushed, with the "stream" engine) every N images; the KML is otherwise written only once, at the end
+- engine="minidom": how the KML is produced;	- "minidom" builds the whole document in memory, then writes it
+												- "stream" writes the elements to the file as they are produced, keeping memory roughly constant
+												- "tiles" splits photos and tracks into a pyramid of tiles, each in its own KML, linked from the main one
+												  and only loaded by the viewer when in view (see StreamTiledKml)
+- pretty_print=True: whether to indent the KML file; only used by the "stream" and "tiles" engines ("minidom" always indents)
+- workers=None: the number of parallel workers resizing the images; None or 1 processes them one at a time
+- pool="process": the kind of pool used by the workers, either "process" or "thread"
+- metadata_cache=None: a folder (or a MetadataCache) where the images metadata is cached between runs, so that only new or modified images are read; keep it outside of output_folder
+- incremental=False: whether to update an existing output folder instead of asking to wipe it; only new or changed images are resized, images whose source was removed are deleted, and the KML is regenerated
+- coords_precision=None: the number of decimals of the coordinates; if None, they are written as they are
+- simplify_tolerance=None: if set, the tracks are simplified so that they deviate at most this many metres from the original ones (in 3D where the elevation is kept)
+- tile_max_items=1000: the maximum number of photos and track points in a tile, with the "tiles" engine
+- kmz=False: whether to write a single KMZ file (next to output_folder, named after it) instead of the output folder; the KML and the images are
+			 written straight into the archive as they are produced, images stored as they are (JPEGs do not compress) and the KML compressed.
+			 The KML is always streamed (engine is not used), and incremental and zip_files are ignored
+- pyramid_tile_size=None: if set (e.g. 256), a tiled image pyramid is also produced for each image, and the PhotoOverlays use it
+						  (ImagePyramid element), so that viewers load large photos progressively, only at the resolution needed
+- observer=None: a BuildObserver, or a callable taking (event, values), receiving the structured events of the build: the start and end of the
+				 "tracks", "scan", "geotag", "manifest", "kml", "export" and "archive" stages, the timings of each image, the points read and emitted, and the bytes written
+				 (see Instrumentation); e.g. a MetricsCollector, whose Report() summarises the build
+- overwrite=None: what to do if the output already exists (and the build is not incremental); None asks, True removes it, False stops without asking
+- pipelined=False: whether reading, resizing and writing the images overlap, with bounded queues between them (see GetFiles); useful on slow storage
+- geotag=False: whether to place the images without a GPS position on the tracks, from the time they were taken and the 'time' column of coords_df (see GeotagPhotos)
+- geotag_offset=0.0: the seconds added to the camera clock to match the clock of the tracks (e.g. to account for the time zone the camera is set to)
+- geotag_max_gap=60.0: the maximum time gap, in seconds, between an image and the track points it is placed from
+- cluster_photos=False: whether to cluster the images by zoom level (see StreamPhotoClusters), so that large collections are shown as a few placemarks
+						until zoomed in; the KML is then streamed, with the "minidom" engine too (the "tiles" engine has its own level of detail and ignores it)
+- gx_track=False: whether to write the tracks as gx:Track elements (a <when> and a <gx:coord> per point) from the 'time' column of coords_df,
+				  instead of LineStrings, so that viewers can animate and time-filter them; the KML is then streamed, with the "minidom" engine too
+				  (the "tiles" engine splits the tracks into LineStrings and ignores it)
+- track_cache=None: a folder (outside of output_folder) where coordinates files are cached as memory-mapped binary columns, grouped by placemark;
+					the following builds from the same (unchanged) file load the cache instead of parsing the file (see CachedTracks)
+- export_formats=None: the other formats to write in the same build, among "geojson", "gpx" and "csv" (see ExportWriters), e.g. ("geojson", "gpx");
+					   they are written next to the KML (or the KMZ), named after it, from the same tracks and images: the coordinates are read once
+					   (see SharedTracks) and the images processed once, whatever the number of formats
 Output:
 - The final KML file and folder
 """
-def CreateKmlFile(output_folder, coords_df=None, img_input_folder=None, resize_opt=1.0, zip_files=False, verbose=False):
+def CreateKmlFile(output_folder, coords_df=None, img_input_folder=None, resize_opt=1.0, zip_files=False, verbose=False, checkpoint_every=None, engine="minidom", pretty_print=True, workers=None, pool="process", metadata_cache=None, incremental=False, coords_precision=None, simplify_tolerance=None, tile_max_items=1000, kmz=False, pyramid_tile_size=None, observer=None, overwrite=None, pipelined=False, track_cache=None, geotag=False, geotag_offset=0.0, geotag_max_gap=60.0, cluster_photos=False, gx_track=False, export_formats=None):
 	### Check that there are not existing folders with same name
 	if output_folder[-1] != "/":
 		out_folder = output_folder+"/"
@@ -571,8 +2399,21 @@ def CreateKmlFile(output_folder, coords_df=None, img_input_folder=None, resize_o
 		new_file_name = output_folder
 		pass
 
-	folder_exists = os.path.exists(out_folder)
-	if folder_exists:
+	kmz_file_name = os.path.normpath(output_folder)+".kmz"
+	exports = None
+	shared_tracks_folder = None
+
+	# An existing folder is updated in place by incremental builds
+	if kmz:
+		folder_exists = os.path.exists(kmz_file_name)
+	else:
+		folder_exists = os.path.exists(out_folder) and not incremental
+	if folder_exists and overwrite is not None:
+		remove_existing = 'yes' if overwrite else 'no'
+	elif folder_exists and kmz:
+		remove_existing = input("\nThe '"+kmz_file_name+"' file already exists!"+"\n"+"--> Do you want to overwrite it?"+"\n   (Please enter yes, y or 1, anything else for no)"+"\n   ")
+		print("\n")
+	elif folder_exists:
 		remove_existing = input("\nThe '"+out_folder+"' folder already exists!"+"\n"+"--> Do you want to remove all existing files/folders from it?"+"\n   (Please enter yes, y or 1, anything else for no)"+"\n   ")
 		print("\n")
 
@@ -584,7 +2425,7 @@ def CreateKmlFile(output_folder, coords_df=None, img_input_folder=None, resize_o
 			print("The process will now stop. Please move or rename the existing folder.")
 
 		else:
-			if folder_exists == True and str(remove_existing).lower() in ('y', 'yes', '1'):
+			if folder_exists == True and str(remove_existing).lower() in ('y', 'yes', '1') and not kmz:
 				for f in os.listdir(out_folder):
 					f_path = os.path.join(out_folder, f)
 
@@ -598,123 +2439,173 @@ def CreateKmlFile(output_folder, coords_df=None, img_input_folder=None, resize_o
 						print(e)
 
 			### START KML PRODUCTION PROCESS:
-			if img_input_folder == None and isinstance(coords_df, pd.DataFrame) != True: # Skip KML file creation if inputs not provided
-				print("\nNo input file(s) was provided: exiting now.")
-				pass
+			kml_file_name = out_folder+new_file_name+".kml"
+			coords_stats = {}
+			tiles_no = None
+
+			if kmz and os.path.dirname(kmz_file_name):
+				os.makedirs(os.path.dirname(kmz_file_name), exist_ok=True)
+
+			if track_cache is not None and isinstance(coords_df, (str, os.PathLike)):
+				with Stage(observer, "tracks"):
+					coords_df, cache_hit = CachedTracks(coords_df, track_cache)
+
+				if verbose:
+					print("Tracks "+("loaded from" if cache_hit else "parsed into")+" the track cache: "+str(len(coords_df))+" points.")
+
+			if export_formats and IsCoordinatesInput(coords_df):
+				# Read once, for the KML and all the exports
+				with Stage(observer, "tracks"):
+					shared_tracks_folder = tempfile.mkdtemp(prefix="geofun_tracks_")
+					coords_df = SharedTracks(coords_df, shared_tracks_folder)
 
-			elif img_input_folder == None and isinstance(coords_df, pd.DataFrame) == True: ## Skip images embedding if not required:
-				try:
-					os.makedirs(out_folder)
-				except:
-					pass
+			if export_formats and (img_input_folder is not None or IsCoordinatesInput(coords_df)):
+				exports = ExportWriters(os.path.normpath(output_folder) if kmz else out_folder+new_file_name, new_file_name, export_formats, coords_precision, pretty_print)
 
-				kml_doc = CreateKmlDoc(new_file_name)
-				CreatePlacemark(coords_df, kml_doc)
+			if img_input_folder == None and IsCoordinatesInput(coords_df) != True: # Skip KML file creation if inputs not provided
+				print("\nNo input file(s) was provided: exiting now.")
+				pass
 
-				kml_file_name = out_folder+new_file_name+".kml"
+			elif img_input_folder == None and IsCoordinatesInput(coords_df) == True: ## Skip images embedding if not required:
+				with Stage(observer, "kml"):
+					if kmz:
+						with KmzArchive(kmz_file_name) as archive:
+							with archive.OpenFile("doc.kml") as kml_file:
+								StreamKml(kml_file, new_file_name, coords_df=coords_df, pretty_print=pretty_print, precision=coords_precision, simplify_tolerance=simplify_tolerance, stats=coords_stats, gx_track=gx_track)
 
-				kml_file = open(kml_file_name, 'wb')
-				kml_file.write(kml_doc.toprettyxml('  ', newl='\n', encoding='utf-8'))
+					else:
+						try:
+							os.makedirs(out_folder)
+						except:
+							pass
+
+						if engine == "tiles":
+							tiles_no = StreamTiledKml(out_folder, new_file_name, coords_df=coords_df, pretty_print=pretty_print, precision=coords_precision, simplify_tolerance=simplify_tolerance, stats=coords_stats, max_items=tile_max_items)
+						elif engine == "stream" or gx_track:
+							StreamKml(kml_file_name, new_file_name, coords_df=coords_df, pretty_print=pretty_print, precision=coords_precision, simplify_tolerance=simplify_tolerance, stats=coords_stats, gx_track=gx_track)
+						else:
+							BuildKmlDom(kml_file_name, new_file_name, coords_df=coords_df, precision=coords_precision, simplify_tolerance=simplify_tolerance, stats=coords_stats)
 
 				if verbose:
 					print("\nThe KML file has been created.")
 
-			elif isinstance(coords_df, pd.DataFrame) != True: # Skip coordinates embedding if these have not been provided
+			else: # Embed images, and coordinates if these have been provided
 				out_folder_img = out_folder+"img/"
 
-				try:
-					os.makedirs(out_folder_img)
-				except:
-					pass
+				if not kmz:
+					try:
+						os.makedirs(out_folder_img)
+					except:
+						pass
 				
-				file_names = FilesIterator(img_input_folder)
+				if IsCoordinatesInput(coords_df) != True:
+					coords_df = None
 
-				files = {}
-				
-				file_counter = 0
-				tot_files = len(file_names)
-				for file_name in file_names:
-					the_file = GetFile(file_name, out_folder_img, resize_opt)
-					if the_file is None:
-						print("'%s' is unreadable\n" % file_name)
-						file_names.remove(file_name)
-						continue
+				with Stage(observer, "scan"):
+					if metadata_cache is None or isinstance(metadata_cache, MetadataCache):
+						file_names = PhotosIterator(img_input_folder, cache=metadata_cache)
 					else:
-						files[file_name] = the_file
-					
-					kml_doc = CreateKmlDoc(new_file_name)
-					file_iterator = 0
-					for key in files.keys():
-						filename = os.path.basename(key)
-						complete_file_name = out_folder_img+filename
-						CreatePhotoOverlay(kml_doc, complete_file_name, files[key], file_iterator)
-						file_iterator += 1
+						with MetadataCache(metadata_cache) as cache:
+							file_names = PhotosIterator(img_input_folder, cache=cache)
 
+						if verbose:
+							print("Images metadata: "+str(cache.hits)+" read from the cache, "+str(cache.misses)+" scanned.")
 
-					kml_file_name = out_folder+new_file_name+".kml"
+				if geotag and coords_df is not None:
+					with Stage(observer, "geotag"):
+						if not IsCoordinatesTable(coords_df) and not isinstance(coords_df, (dict, np.ndarray, str, os.PathLike)) and iter(coords_df) is coords_df:
+							# An iterator of dataframes can only be read once: keep it for the KML too
+							coords_df = pd.concat(list(coords_df), ignore_index=True)
+						file_names, located = GeotagPhotos(file_names, coords_df, geotag_offset, geotag_max_gap)
 
-					kml_file = open(kml_file_name, 'wb')
-					kml_file.write(kml_doc.toprettyxml('  ', newl='\n', encoding='utf-8'))
+					if verbose:
+						print("Geotagging: "+str(located)+" images placed on the tracks from their timestamp.")
+
+				manifest = None
+				up_to_date = None
+				if incremental and not kmz:
+					with Stage(observer, "manifest"):
+						manifest = LoadManifest(out_folder)
+						up_to_date, stale = CompareManifest([record.path for record in file_names], manifest, out_folder_img, resize_opt, pyramid_tile_size)
+						for stale_name in stale:
+							if os.path.isdir(out_folder_img+stale_name):
+								shutil.rmtree(out_folder_img+stale_name)
+							else:
+								os.unlink(out_folder_img+stale_name)
 
 					if verbose:
-						print("Image "+str(file_counter+1)+" out of "+str(tot_files)+" added to KML file: "+filename)
-					file_counter += 1
+						print("Incremental build: "+str(len(up_to_date))+" images up to date, "+str(len(file_names)-len(up_to_date))+" to process, "+str(len(stale))+" removed.")
+
+				# Images are processed as the KML consumes them: their own timings come with the 'image' events
+				with Stage(observer, "kml"):
+					if kmz:
+						# Images go into the archive as they are processed, so the KML is spooled and added last
+						with KmzArchive(kmz_file_name) as archive, tempfile.TemporaryFile() as kml_spool:
+							images = ProcessImages(file_names, None, resize_opt, verbose, workers, pool, archive=archive, pyramid_tile_size=pyramid_tile_size, observer=observer, pipelined=pipelined)
+							if exports is not None:
+								images = ExportPhotos(images, exports)
+							StreamKml(kml_spool, new_file_name, coords_df=coords_df, images=images, pretty_print=pretty_print, precision=coords_precision, simplify_tolerance=simplify_tolerance, stats=coords_stats, pyramid_tile_size=pyramid_tile_size, cluster_photos=cluster_photos, gx_track=gx_track)
+
+							kml_spool.seek(0)
+							with archive.OpenFile("doc.kml") as kml_file:
+								shutil.copyfileobj(kml_spool, kml_file)
 
-				if verbose:
-					print("\nThe images have been loaded into the KML file.")
-			
-			else: # Embed both images and coordinates
-				out_folder_img = out_folder+"img/"
+					else:
+						images = ProcessImages(file_names, out_folder_img, resize_opt, verbose, workers, pool, up_to_date, manifest, pyramid_tile_size=pyramid_tile_size, observer=observer, pipelined=pipelined)
+						if exports is not None:
+							images = ExportPhotos(images, exports)
 
-				try:
-					os.makedirs(out_folder_img)
-				except:
-					pass
-				
-				file_names = FilesIterator(img_input_folder)
+						if engine == "tiles":
+							tiles_no = StreamTiledKml(out_folder, new_file_name, coords_df=coords_df, images=images, pretty_print=pretty_print, precision=coords_precision, simplify_tolerance=simplify_tolerance, stats=coords_stats, max_items=tile_max_items, pyramid_tile_size=pyramid_tile_size)
+						elif engine == "stream" or cluster_photos or gx_track:
+							StreamKml(kml_file_name, new_file_name, coords_df=coords_df, images=images, checkpoint_every=checkpoint_every, pretty_print=pretty_print, precision=coords_precision, simplify_tolerance=simplify_tolerance, stats=coords_stats, pyramid_tile_size=pyramid_tile_size, cluster_photos=cluster_photos, gx_track=gx_track)
+						else:
+							BuildKmlDom(kml_file_name, new_file_name, coords_df=coords_df, images=images, checkpoint_every=checkpoint_every, precision=coords_precision, simplify_tolerance=simplify_tolerance, stats=coords_stats, pyramid_tile_size=pyramid_tile_size)
 
-				files = {}
-					
-				file_counter = 0
-				tot_files = len(file_names)
-				for file_name in file_names:
-					the_file = GetFile(file_name, out_folder_img, resize_opt)
-					if the_file is None:
-						print("'%s' is unreadable\n" % file_name)
-						file_names.remove(file_name)
-						continue
+				if manifest is not None:
+					SaveManifest(out_folder, manifest)
+
+				if verbose:
+					if coords_df is None:
+						print("\nThe images have been loaded into the KML file.")
 					else:
-						files[file_name] = the_file
-					
-					kml_doc = CreateKmlDoc(new_file_name)
-					CreateSubDocument(kml_doc, "Pictures")
-					file_iterator = 0
-					for key in files.keys():
-						filename = os.path.basename(key)
-						complete_file_name = out_folder_img+filename
-						CreatePhotoOverlay(kml_doc, complete_file_name, files[key], file_iterator)
-						file_iterator += 1
+						print("\nBoth images and coordinates have been loaded into the KML file.")
 
-					CreateSubDocument(kml_doc, "Trips")
-					CreatePlacemark(coords_df, kml_doc)
+			if exports is not None:
+				# The tracks come after the photos, as GPX lists its waypoints first
+				with Stage(observer, "export"):
+					if IsCoordinatesInput(coords_df):
+						ExportTracks(coords_df, exports, simplify_tolerance=simplify_tolerance)
+					exports.Close()
 
-					kml_file_name = out_folder+new_file_name+".kml"
+				if verbose:
+					print("Exported to: "+", ".join(exports.FileNames()))
 
-					kml_file = open(kml_file_name, 'wb')
-					kml_file.write(kml_doc.toprettyxml('  ', newl='\n', encoding='utf-8'))
+			if verbose and engine == "tiles" and tiles_no is not None:
+				print("The KML has been split into "+str(tiles_no)+" tiles.")
 
-					if verbose:
-						print("Image "+str(file_counter+1)+" out of "+str(tot_files)+" added to KML file: "+filename)
-						file_counter += 1
+			if verbose and simplify_tolerance is not None and coords_stats:
+				print("Tracks simplified from "+str(coords_stats['points_before'])+" to "+str(coords_stats['points_after'])+" points.")
 
-				if verbose:
-					print("\nBoth images and coordinates have been loaded into the KML file.")
+			if coords_stats:
+				NotifyObserver(observer, 'points', points_read=coords_stats['points_before'], points_emitted=coords_stats['points_after'])
+			for output_file_name in ([kmz_file_name] if kmz else [kml_file_name]) + (exports.FileNames() if exports is not None else []):
+				if os.path.isfile(output_file_name):
+					NotifyObserver(observer, 'output', file_name=output_file_name, bytes=os.path.getsize(output_file_name))
+			if tiles_no:
+				NotifyObserver(observer, 'output', file_name=out_folder+TILES_FOLDER, bytes=sum(entry.stat().st_size for entry in os.scandir(out_folder+TILES_FOLDER)))
 
 			## Archive data, if required
-			if zip_files == True:
-				ZipArchive(out_folder, new_file_name)
+			if zip_files == True and not kmz:
+				with Stage(observer, "archive"):
+					ZipArchive(out_folder, new_file_name)
 	except:
 		print("Something unexpected happened: please check your inputs (e.g. correctly geolocated images and proper coordinates dataframe.)")
+	finally:
+		if exports is not None:
+			exports.Close()
+		if shared_tracks_folder is not None:
+			shutil.rmtree(shared_tracks_folder, ignore_errors=True)
 
 
 
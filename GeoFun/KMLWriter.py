@@ -0,0 +1,355 @@
+import os
+import io
+import time
+import zipfile
+
+from .LazyImport import LazyModule
+
+np = LazyModule('numpy')
+
+
+
+##############################################################################
+### Helpers
+
+KML_NAMESPACE = 'http://www.opengis.net/kml/2.2'
+GX_NAMESPACE = 'http://www.google.com/kml/ext/2.2'
+
+
+
+### Escapes text and attribute values, the same way xml.dom.minidom does
+"""
+Input:
+- data: the string to be escaped
+Output:
+- The escaped string
+"""
+def EscapeXml(data):
+	return data.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+
+
+### Formats rows of values with a template, all at once
+"""The whole block is produced by a single string formatting operation, instead of one str() call per value; used by the coordinates
+formatters (see KMLBuilder.FormatCoordinates) and the export writers.
+Input:
+- line_fmt: the template of a line, with one '%' field per column
+- columns: the arrays of the values, one per field, all of the same length
+Output:
+- The text, one line per row
+"""
+def FormatLines(line_fmt, columns):
+	values = np.empty((len(columns[0]), len(columns)), dtype=object)
+	for i, column in enumerate(columns):
+		values[:, i] = column
+
+	return "\n".join([line_fmt]*len(values)) % tuple(values.ravel().tolist())
+
+
+
+##############################################################################
+### Streaming writer
+
+### Writes a KML file incrementally, element by element
+"""Emits the KML straight to a file (or file-like object) instead of building an xml.dom.minidom tree,
+so that memory stays roughly constant regardless of the number of placemarks, points or photos.
+The pretty-printed output is the same as the one produced by 'toprettyxml'.
+Input:
+- output: the file name of the KML, or a file-like object (binary or text) to write to
+- pretty_print=True: whether to indent the elements and put them on separate lines
+- indent='  ': the indentation added at each level, if pretty printing
+- newl='\n': the new line string, if pretty printing
+- encoding='utf-8': the encoding of the KML
+Output:
+- A writer object; close it (or use it as a context manager) to finalise the file
+"""
+class KmlStreamWriter:
+	def __init__(self, output, pretty_print=True, indent='  ', newl='\n', encoding='utf-8'):
+		if isinstance(output, (str, os.PathLike)):
+			self.file = open(output, 'wb')
+			self.own_file = True
+		else:
+			self.file = output
+			self.own_file = False
+
+		self.binary = not isinstance(self.file, io.TextIOBase)
+		self.encoding = encoding
+		self.indent = indent if pretty_print else ''
+		self.newl = newl if pretty_print else ''
+		self.open_tags = []
+		self.bytes_written = 0
+		self.closed = False
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.Close()
+
+	### Low level writing
+	def Write(self, data):
+		if self.binary:
+			data = data.encode(self.encoding)
+
+		self.bytes_written += len(data)
+		self.file.write(data)
+
+	def StartElement(self, tag, attributes=None):
+		attrs = ''
+		if attributes:
+			attrs = ''.join(' %s="%s"' % (k, EscapeXml(str(v))) for k, v in attributes.items())
+
+		self.Write(self.indent*len(self.open_tags)+'<'+tag+attrs+'>'+self.newl)
+		self.open_tags.append(tag)
+
+	def EndElement(self):
+		tag = self.open_tags.pop()
+		self.Write(self.indent*len(self.open_tags)+'</'+tag+'>'+self.newl)
+
+	def WriteElement(self, tag, text, cdata=False):
+		if cdata:
+			text = '<![CDATA['+text+']]>'
+		else:
+			text = EscapeXml(str(text))
+
+		self.Write(self.indent*len(self.open_tags)+'<'+tag+'>'+text+'</'+tag+'>'+self.newl)
+
+	### Writes chunks of already formatted (and escaped) elements, one per line, e.g. the <when> elements of a gx:Track; each chunk ends with
+	### a new line, and its lines are indented (or joined, if not pretty printing) as the other elements
+	def WriteElementLines(self, chunks):
+		indent = self.indent*len(self.open_tags)
+		for chunk in chunks:
+			if len(chunk) > 1:
+				self.Write(indent+chunk[:-1].replace('\n', self.newl+indent)+self.newl)
+
+	### Writes an element whose text is given in chunks, e.g. long lists of coordinates
+	def WriteChunkedElement(self, tag, text_chunks):
+		self.Write(self.indent*len(self.open_tags)+'<'+tag+'>')
+		for chunk in text_chunks:
+			self.Write(EscapeXml(chunk))
+		self.Write('</'+tag+'>'+self.newl)
+
+	def Flush(self):
+		self.file.flush()
+
+	def Close(self):
+		if self.closed:
+			return
+
+		while self.open_tags:
+			self.EndElement()
+
+		self.Flush()
+		if self.own_file:
+			self.file.close()
+		self.closed = True
+
+	### KML structure; gx_namespace declares the Google extensions namespace, needed by gx:Track
+	def StartDocument(self, new_file_name, gx_namespace=False):
+		attributes = {'xmlns': KML_NAMESPACE}
+		if gx_namespace:
+			attributes['xmlns:gx'] = GX_NAMESPACE
+
+		self.Write('<?xml version="1.0" encoding="%s"?>' % self.encoding+self.newl)
+		self.StartElement('kml', attributes)
+		self.StartSubDocument(new_file_name)
+
+	def StartSubDocument(self, media_type):
+		self.StartElement('Document')
+		self.WriteElement('name', media_type)
+
+	def EndSubDocument(self):
+		self.EndElement()
+
+	### Writes a Region: the enclosing feature is only active when its (west, south, east, north) bounds cover at least min_lod_pixels on screen
+	def WriteRegion(self, bounds, min_lod_pixels=128, max_lod_pixels=-1):
+		west, south, east, north = bounds
+
+		self.StartElement('Region')
+		self.StartElement('LatLonAltBox')
+		self.WriteElement('north', repr(north))
+		self.WriteElement('south', repr(south))
+		self.WriteElement('east', repr(east))
+		self.WriteElement('west', repr(west))
+		self.EndElement()
+
+		self.StartElement('Lod')
+		self.WriteElement('minLodPixels', str(min_lod_pixels))
+		self.WriteElement('maxLodPixels', str(max_lod_pixels))
+		self.EndElement()
+		self.EndElement()
+
+	### Writes a NetworkLink to another KML file; with bounds, the file is only loaded when their Region is active
+	def WriteNetworkLink(self, name, href, bounds=None, min_lod_pixels=128, max_lod_pixels=-1):
+		self.StartElement('NetworkLink')
+		self.WriteElement('name', name)
+		if bounds is not None:
+			self.WriteRegion(bounds, min_lod_pixels, max_lod_pixels)
+
+		self.StartElement('Link')
+		self.WriteElement('href', href)
+		if bounds is not None:
+			self.WriteElement('viewRefreshMode', 'onRegion')
+		self.EndElement()
+
+		self.EndElement()
+
+	### Writes a Placemark with a LineString; 'coordinates_chunks' is an iterable of already formatted text
+	def WritePlacemark(self, placemark_name, alt_mode, line_width, colour, coordinates_chunks):
+		self.StartElement('Placemark')
+		self.WriteElement('name', placemark_name)
+
+		self.StartElement('LineString')
+		self.WriteElement('extrude', '1')
+		self.WriteElement('altitudeMode', alt_mode)
+		self.WriteChunkedElement('coordinates', coordinates_chunks)
+		self.EndElement()
+
+		self.WriteLineStyle(colour, line_width)
+		self.EndElement()
+
+	### Writes a Placemark with a gx:Track; 'when_chunks' and 'coord_chunks' are iterables of already formatted <when> and <gx:coord> elements,
+	### one per line, with the same number of each, in the same order (see KMLBuilder.FormatWhens and FormatTrackCoords)
+	def WriteTrack(self, placemark_name, alt_mode, line_width, colour, when_chunks, coord_chunks):
+		self.StartElement('Placemark')
+		self.WriteElement('name', placemark_name)
+
+		self.StartElement('gx:Track')
+		self.WriteElement('extrude', '1')
+		self.WriteElement('altitudeMode', alt_mode)
+		self.WriteElementLines(when_chunks)
+		self.WriteElementLines(coord_chunks)
+		self.EndElement()
+
+		self.WriteLineStyle(colour, line_width)
+		self.EndElement()
+
+	def WriteLineStyle(self, colour, line_width):
+		self.StartElement('Style')
+		self.StartElement('LineStyle')
+		self.WriteElement('color', colour)
+		self.WriteElement('width', str(line_width))
+		self.EndElement()
+		self.EndElement()
+
+	### Writes a PhotoOverlay; 'overlay' is the dict of values returned by KMLBuilder.PhotoOverlayValues
+	def WritePhotoOverlay(self, overlay):
+		self.StartElement('PhotoOverlay', {'id': overlay['photo_id']})
+		self.WriteElement('name', overlay['name'])
+		self.WriteElement('description', overlay['description'], cdata=True)
+
+		self.StartElement('Camera')
+		self.WriteElement('longitude', overlay['longitude'])
+		self.WriteElement('latitude', overlay['latitude'])
+		self.WriteElement('altitude', '30')
+		self.WriteElement('tilt', '0')
+		self.EndElement()
+
+		if overlay.get('region'):
+			self.WriteRegion(*overlay['region'])
+
+		self.StartElement('Icon')
+		self.WriteElement('href', overlay['href'])
+		self.EndElement()
+
+		self.StartElement('ViewVolume')
+		self.WriteElement('leftFov', overlay['left_fov'])
+		self.WriteElement('rightFov', overlay['right_fov'])
+		self.WriteElement('bottomFov', '-20')
+		self.WriteElement('topFov', '20')
+		self.WriteElement('near', '10')
+		self.EndElement()
+
+		if overlay.get('image_pyramid'):
+			self.StartElement('ImagePyramid')
+			self.WriteElement('tileSize', overlay['image_pyramid']['tile_size'])
+			self.WriteElement('maxWidth', overlay['image_pyramid']['max_width'])
+			self.WriteElement('maxHeight', overlay['image_pyramid']['max_height'])
+			self.WriteElement('gridOrigin', overlay['image_pyramid']['grid_origin'])
+			self.EndElement()
+
+		self.StartElement('point')
+		self.WriteElement('coordinates', overlay['point'])
+		self.EndElement()
+
+		self.EndElement()
+
+	### Writes a Placemark standing for a cluster of photos; 'cluster' is the dict of values computed by KMLBuilder.StreamPhotoClusters
+	def WriteClusterPlacemark(self, cluster):
+		self.StartElement('Placemark')
+		self.WriteElement('name', cluster['name'])
+		self.WriteElement('description', cluster['description'], cdata=True)
+
+		self.StartElement('Style')
+		self.StartElement('IconStyle')
+		self.WriteElement('scale', cluster['scale'])
+		self.StartElement('Icon')
+		self.WriteElement('href', cluster['icon_href'])
+		self.EndElement()
+		self.EndElement()
+		self.EndElement()
+
+		self.WriteRegion(*cluster['region'])
+
+		self.StartElement('ExtendedData')
+		for data_name in ('count', 'west', 'south', 'east', 'north'):
+			self.StartElement('Data', {'name': data_name})
+			self.WriteElement('value', cluster[data_name])
+			self.EndElement()
+		self.EndElement()
+
+		self.StartElement('Point')
+		self.WriteElement('coordinates', cluster['point'])
+		self.EndElement()
+
+		self.EndElement()
+
+
+
+##############################################################################
+### KMZ archive
+
+### Writes a KMZ (zipped KML) archive, one entry at a time
+"""Entries are added as they are produced, so that no intermediate folder is needed. Already compressed media (e.g. JPEGs)
+are best stored as they are: deflating them again costs time and saves next to nothing.
+Input:
+- kmz_file_name: the file name of the KMZ
+Output:
+- An archive object; close it (or use it as a context manager) to finalise the file
+"""
+class KmzArchive:
+	def __init__(self, kmz_file_name):
+		self.zip = zipfile.ZipFile(kmz_file_name, 'w', zipfile.ZIP_DEFLATED)
+		self.bytes_written = 0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.Close()
+
+	def EntryInfo(self, name, compress):
+		info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+		info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+		return info
+
+	### Adds an entry with the given bytes; stored as they are unless compress is True
+	def WriteFile(self, name, data, compress=False):
+		self.zip.writestr(self.EntryInfo(name, compress), data)
+		self.bytes_written += len(data)
+
+	### Adds an entry from a file, streamed from the disk rather than read whole; stored as it is unless compress is True
+	def AddFile(self, name, file_name, compress=False):
+		self.zip.write(file_name, name, zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+		self.bytes_written += os.path.getsize(file_name)
+
+	### Opens an entry to be written incrementally (e.g. by a KmlStreamWriter); close it before adding other entries
+	def OpenFile(self, name, compress=True):
+		return self.zip.open(self.EntryInfo(name, compress), 'w', force_zip64=True)
+
+	def Close(self):
+		if self.zip is None:
+			return
+
+		self.zip.close()
+		self.zip = None
@@ -0,0 +1,39 @@
+import importlib
+import threading
+
+
+
+##############################################################################
+### Lazy imports
+
+### A module imported on first use
+"""Heavy dependencies (pandas, NumPy, PIL, colour) are only imported when one of their attributes is first needed, so that importing GeoFun
+stays fast, and a build that does not need them (e.g. a coordinates-only build, without PIL) never loads them.
+The attributes are kept once looked up, so that later uses cost no more than with a module.
+Input:
+- name: the name of the module, e.g. 'PIL.Image'
+Output:
+- A LazyModule object, standing for the module
+"""
+class LazyModule:
+	def __init__(self, name):
+		self.__dict__['_name'] = name
+		self.__dict__['_module'] = None
+		self.__dict__['_lock'] = threading.Lock()
+
+	def __getattr__(self, attribute):
+		value = getattr(self.Load(), attribute)
+		self.__dict__[attribute] = value
+		return value
+
+	def __repr__(self):
+		return "<LazyModule '%s'%s>" % (self._name, '' if self._module is None else ' (loaded)')
+
+	### Imports the module, if not done yet, and returns it
+	def Load(self):
+		if self._module is None:
+			with self._lock:
+				if self._module is None:
+					self.__dict__['_module'] = importlib.import_module(self._name)
+
+		return self._module
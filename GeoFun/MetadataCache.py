@@ -0,0 +1,100 @@
+import os
+import sqlite3
+import datetime
+import time
+
+
+
+##############################################################################
+### Photo metadata cache
+
+CACHE_FILE_NAME = 'GeoFun_metadata.sqlite'
+
+
+
+### Persistent cache of the photo metadata, stored in SQLite
+"""Entries are keyed by file path and are only valid as long as the file size and modification time are unchanged.
+When the cache holds more than max_entries, the least recently used entries are evicted.
+Input:
+- cache_folder: the folder where the cache file is saved; it is created if needed. Keep it outside of the KML output folder, which may be wiped
+- max_entries=200000: the maximum number of photos kept in the cache
+Output:
+- A cache object; close it (or use it as a context manager) to save the new entries
+"""
+class MetadataCache:
+	def __init__(self, cache_folder, max_entries=200000):
+		os.makedirs(cache_folder, exist_ok=True)
+
+		self.cache_file = os.path.join(cache_folder, CACHE_FILE_NAME)
+		self.max_entries = max_entries
+		self.hits = 0
+		self.misses = 0
+		self.new_entries = []
+		self.used_paths = []
+
+		# Builds running in parallel may share the cache: wait for each other's writes rather than failing
+		self.connection = sqlite3.connect(self.cache_file, timeout=60)
+		self.connection.execute('''CREATE TABLE IF NOT EXISTS photos (
+			path TEXT PRIMARY KEY,
+			size INTEGER,
+			mtime_ns INTEGER,
+			timestamp TEXT,
+			latitude REAL,
+			longitude REAL,
+			altitude REAL,
+			width INTEGER,
+			height INTEGER,
+			last_used REAL)''')
+		self.connection.execute('CREATE INDEX IF NOT EXISTS photos_last_used ON photos (last_used)')
+		self.connection.commit()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.Close()
+
+	### Returns the cached (timestamp, latitude, longitude, altitude, width, height) of a file, or None if missing or stale
+	def Get(self, path, size, mtime_ns):
+		row = self.connection.execute('SELECT size, mtime_ns, timestamp, latitude, longitude, altitude, width, height FROM photos WHERE path = ?', (path,)).fetchone()
+
+		if row is None or row[0] != size or row[1] != mtime_ns:
+			self.misses += 1
+			return None
+
+		self.hits += 1
+		self.used_paths.append(path)
+
+		timestamp = row[2]
+		if timestamp is not None:
+			timestamp = datetime.datetime.fromisoformat(timestamp)
+
+		return (timestamp,) + tuple(row[3:])
+
+	### Stores the (timestamp, latitude, longitude, altitude, width, height) of a file; saved on Commit
+	def Put(self, path, size, mtime_ns, values):
+		timestamp = values[0]
+		if timestamp is not None:
+			timestamp = timestamp.isoformat()
+
+		self.new_entries.append((path, size, mtime_ns, timestamp) + tuple(values[1:]))
+
+	### Saves the new entries, refreshes the used ones and evicts the least recently used ones
+	def Commit(self):
+		now = time.time()
+
+		with self.connection:
+			self.connection.executemany('INSERT OR REPLACE INTO photos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [entry+(now,) for entry in self.new_entries])
+			self.connection.executemany('UPDATE photos SET last_used = ? WHERE path = ?', [(now, path) for path in self.used_paths])
+			self.connection.execute('DELETE FROM photos WHERE path IN (SELECT path FROM photos ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+		self.new_entries = []
+		self.used_paths = []
+
+	def Close(self):
+		if self.connection is None:
+			return
+
+		self.Commit()
+		self.connection.close()
+		self.connection = None
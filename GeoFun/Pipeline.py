@@ -0,0 +1,183 @@
+import queue
+import functools
+import threading
+import concurrent.futures
+
+from .LazyImport import LazyModule
+
+# Only needed once a pipeline runs
+asyncio = LazyModule('asyncio')
+
+
+
+##############################################################################
+### Pipelined execution
+
+### Default size of the queues between the stages of a pipeline
+PIPELINE_QUEUE_SIZE = 8
+
+### Marks the end of the items flowing through a queue
+PIPELINE_END = object()
+
+
+
+### Calls a function with the arguments packed in a tuple
+"""Defined at module level, so that (with functools.partial) it can be sent to worker processes.
+Input:
+- function: the function to call
+- args: the tuple of its arguments
+Output:
+- The result of the function
+"""
+def CallUnpacked(function, args):
+	return function(*args)
+
+
+
+### Runs items through read, process and write stages that overlap, with bounded queues between them
+"""An asyncio loop, run in a background thread, drives the stages: reads and writes run in a pool of I/O threads, the processing
+in a pool of processes (or threads), so that the disk and the cores are kept busy at the same time. Each queue holds at most queue_size
+items, and at most max_in_flight items are read but not yet consumed: a slow stage (or a slow consumer) stalls the ones before it.
+Input:
+- items: the items to run through the stages
+- read: a function taking an item and returning its data, e.g. the bytes of a file; run in the I/O threads
+- process: a function taking (item, data) and returning a result; run in the workers, so it must be picklable with pool="process"
+- write=None: a function taking the result of process and returning the final result, e.g. once saved; run in the I/O threads
+- workers=None: the number of processing workers; None uses one
+- pool="process": the kind of pool used by the processing workers, either "process" or "thread"
+- queue_size=PIPELINE_QUEUE_SIZE: the maximum number of items waiting between two stages
+- io_workers=4: the number of threads reading and writing
+- max_in_flight=None: the maximum number of items read but not yet consumed; None allows enough to fill the queues and the workers
+Output:
+- An iterable of the final results, in the same order as items; an error raised by a stage is raised again when its item is reached
+"""
+class Pipeline:
+	def __init__(self, items, read, process, write=None, workers=None, pool="process", queue_size=PIPELINE_QUEUE_SIZE, io_workers=4, max_in_flight=None):
+		self.items = list(items)
+		self.read = read
+		self.process = process
+		self.write = write
+		self.workers = workers if workers else 1
+		self.pool = pool
+		self.queue_size = queue_size
+		self.io_workers = io_workers
+		self.max_in_flight = max_in_flight if max_in_flight else 2*queue_size + self.workers + 2*io_workers
+
+		self.results = queue.Queue()
+		self.stopping = threading.Event()
+		self.loop = None
+		self.task = None
+		self.window = None
+
+	def __iter__(self):
+		if not self.items:
+			return
+
+		thread = threading.Thread(target=self.RunLoop, daemon=True)
+		thread.start()
+		try:
+			for _ in range(len(self.items)):
+				result = self.results.get()
+				if isinstance(result, BaseException):
+					raise result
+
+				# The item has left the pipeline: let the next one in
+				self.loop.call_soon_threadsafe(self.window.release)
+				yield result
+		finally:
+			self.Stop()
+			thread.join()
+
+	### Runs the event loop, in the background thread
+	def RunLoop(self):
+		try:
+			asyncio.run(self.Run())
+		except asyncio.CancelledError:
+			pass
+		except Exception as e:
+			self.results.put(e)
+
+	### Stops the pipeline, e.g. when the consumer stops early
+	def Stop(self):
+		self.stopping.set()
+		try:
+			self.loop.call_soon_threadsafe(self.task.cancel)
+		except (AttributeError, RuntimeError):
+			# not started yet, or already finished
+			pass
+
+	async def Run(self):
+		self.loop = asyncio.get_running_loop()
+		self.task = asyncio.current_task()
+		self.window = asyncio.Semaphore(self.max_in_flight)
+		if self.stopping.is_set():
+			return
+
+		if self.pool == "thread":
+			cpu_executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+		else:
+			cpu_executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+		io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.io_workers)
+
+		stages = [
+			(io_executor, self.io_workers, lambda item: (item, self.read(item))),
+			(cpu_executor, self.workers, functools.partial(CallUnpacked, self.process)),
+		]
+		if self.write is not None:
+			stages.append((io_executor, self.io_workers, self.write))
+
+		queues = [asyncio.Queue(self.queue_size) for _ in range(len(stages) + 1)]
+		try:
+			await asyncio.gather(
+				self.Feed(queues[0]),
+				*(self.RunStage(queues[stage_ix], queues[stage_ix + 1], executor, n_workers, function) for stage_ix, (executor, n_workers, function) in enumerate(stages)),
+				self.Deliver(queues[-1]),
+			)
+		finally:
+			io_executor.shutdown(wait=True)
+			cpu_executor.shutdown(wait=True)
+
+	### Puts the items into the first queue, as long as the number of items in flight allows it
+	async def Feed(self, outbox):
+		for item_ix, item in enumerate(self.items):
+			await self.window.acquire()
+			await outbox.put((item_ix, item))
+
+		await outbox.put(PIPELINE_END)
+
+	### Runs the workers of a stage, then tells the next stage that no more items will come
+	async def RunStage(self, inbox, outbox, executor, n_workers, function):
+		await asyncio.gather(*(self.StageWorker(inbox, outbox, executor, function) for _ in range(n_workers)))
+		await outbox.put(PIPELINE_END)
+
+	async def StageWorker(self, inbox, outbox, executor, function):
+		while True:
+			entry = await inbox.get()
+			if entry is PIPELINE_END:
+				# leave it for the other workers of the stage
+				await inbox.put(PIPELINE_END)
+				return
+
+			item_ix, value = entry
+			if not isinstance(value, BaseException):
+				try:
+					value = await self.loop.run_in_executor(executor, function, value)
+				except Exception as e:
+					value = e
+
+			await outbox.put((item_ix, value))
+
+	### Hands the results to the consumer, in the same order as the items
+	async def Deliver(self, inbox):
+		pending = {}
+		next_ix = 0
+		while True:
+			entry = await inbox.get()
+			if entry is PIPELINE_END:
+				return
+
+			item_ix, value = entry
+			pending[item_ix] = value
+			while next_ix in pending:
+				self.results.put(pending.pop(next_ix))
+				next_ix += 1
@@ -0,0 +1,147 @@
+from .LazyImport import LazyModule
+
+np = LazyModule('numpy')
+
+
+
+##############################################################################
+### Quadtree tiling, used for the Region based level of detail
+
+TILE_MAX_LEVEL = 16
+TILES_FOLDER = 'tiles/'
+
+
+
+### Computes the bounds of the tile pyramid
+"""
+Input:
+- lon: the longitudes array (decimal WGS84) of all the points to be tiled
+- lat: the latitudes array (decimal WGS84) of all the points to be tiled
+Output:
+- A (west, south, east, north) tuple; a degenerate box (e.g. a single point) is padded so that tiles have a size
+"""
+def PyramidBounds(lon, lat):
+	west, east = float(np.min(lon)), float(np.max(lon))
+	south, north = float(np.min(lat)), float(np.max(lat))
+
+	pad = 1e-4
+	if east - west < pad:
+		west, east = west - pad, east + pad
+	if north - south < pad:
+		south, north = south - pad, north + pad
+
+	return west, south, east, north
+
+
+
+### Computes the bounds of a tile
+"""
+Input:
+- bounds: the (west, south, east, north) bounds of the pyramid, as returned by PyramidBounds
+- level, x, y: the tile; level 0 is a single tile covering the pyramid, each level splits the tiles of the previous one in four
+Output:
+- A (west, south, east, north) tuple
+"""
+def TileBounds(bounds, level, x, y):
+	west, south, east, north = bounds
+	cells = 2**level
+	tile_width = (east - west) / cells
+	tile_height = (north - south) / cells
+
+	return west + x*tile_width, south + y*tile_height, west + (x+1)*tile_width, south + (y+1)*tile_height
+
+
+
+### Encodes tiles into single integers, and back
+"""
+Input:
+- level, x, y: the tiles (scalars or arrays), with level up to 20
+- key: the encoded tiles
+Output:
+- The encoded tiles, or a (level, x, y) tuple
+"""
+def TileKey(level, x, y):
+	return (np.asarray(level, dtype=np.int64) << 42) | (np.asarray(x, dtype=np.int64) << 21) | np.asarray(y, dtype=np.int64)
+
+def TileFromKey(key):
+	key = int(key)
+	return key >> 42, (key >> 21) & 0x1FFFFF, key & 0x1FFFFF
+
+
+
+### Assigns points to the leaf tiles of a quadtree
+"""Starting from a single tile, the tiles holding more than max_items points are split in four, level by level; all the points
+of a level are assigned at once with NumPy. A tile that is split keeps no points, so each point belongs to exactly one leaf.
+Input:
+- lon: the longitudes array (decimal WGS84)
+- lat: the latitudes array (decimal WGS84)
+- bounds: the (west, south, east, north) bounds of the pyramid, see PyramidBounds
+- max_items=1000: the maximum number of points in a tile, unless max_level is reached
+- max_level=TILE_MAX_LEVEL: the deepest level of the pyramid
+Output:
+- The array of the keys (see TileKey) of the leaf tile of each point
+"""
+def QuadtreeTiles(lon, lat, bounds, max_items=1000, max_level=TILE_MAX_LEVEL):
+	west, south, east, north = bounds
+	fx = np.clip((np.asarray(lon, dtype=np.float64) - west) / (east - west), 0.0, 1.0)
+	fy = np.clip((np.asarray(lat, dtype=np.float64) - south) / (north - south), 0.0, 1.0)
+
+	keys = np.zeros(len(fx), dtype=np.int64)
+	active = np.arange(len(fx))
+	for level in range(max_level+1):
+		cells = 2**level
+		x = np.minimum((fx[active] * cells).astype(np.int64), cells-1)
+		y = np.minimum((fy[active] * cells).astype(np.int64), cells-1)
+		keys[active] = TileKey(level, x, y)
+
+		if level == max_level:
+			break
+
+		# Tiles with too many points are split: their points move to the next level
+		_, inverse, counts = np.unique(keys[active], return_inverse=True, return_counts=True)
+		active = active[counts[inverse] > max_items]
+		if not len(active):
+			break
+
+	return keys
+
+
+
+### Builds the tree of the tiles, from the leaves to the root
+"""
+Input:
+- leaf_keys: the keys of the leaf tiles (see TileKey)
+Output:
+- A dict mapping each tile key (leaves and their ancestors) to the sorted list of its children keys; leaves have none
+"""
+def TileTree(leaf_keys):
+	tree = {}
+	for key in sorted(set(int(k) for k in leaf_keys)):
+		tree.setdefault(key, [])
+
+		level, x, y = TileFromKey(key)
+		while level > 0:
+			parent = int(TileKey(level-1, x >> 1, y >> 1))
+			children = tree.setdefault(parent, [])
+			if key in children:
+				break
+			children.append(key)
+
+			key, level, x, y = parent, level-1, x >> 1, y >> 1
+
+	for children in tree.values():
+		children.sort()
+
+	return tree
+
+
+
+### Names the KML file of a tile
+"""
+Input:
+- key: the tile key (see TileKey)
+Output:
+- The file name, relative to the tiles folder
+"""
+def TileFileName(key):
+	return '%d_%d_%d.kml' % TileFromKey(key)
@@ -0,0 +1,309 @@
+import os
+import json
+import hashlib
+import tempfile
+
+from .LazyImport import LazyModule
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+
+
+##############################################################################
+### Columnar tracks
+
+TRACK_CACHE_VERSION = 1
+TRACK_INDEX_FILE_NAME = 'tracks.json'
+
+
+
+### Parses the times of the track points
+"""
+Input:
+- values: the 'time' column, as strings, datetimes or datetime64
+Output:
+- A datetime64[ns] array; times with a time zone are converted to UTC, and unreadable ones are NaT
+"""
+def TimeColumn(values):
+	times = pd.to_datetime(pd.Series(np.asarray(values)), errors='coerce', utc=True)
+
+	return times.dt.tz_localize(None).to_numpy('datetime64[ns]')
+
+
+
+### Tracks held as NumPy columns, with the rows of each placemark contiguous
+"""Accepted wherever a dataframe of coordinates is; the columns can be memory-mapped (see LoadTrackCache), so that nothing is parsed or copied on load.
+Input:
+- names: the placemark names, in order of appearance
+- keep_elevation: the 'keep_elevation' flag of each placemark
+- offsets: the first row of each placemark, followed by the number of rows (len(names)+1 values)
+- lon, lat: the coordinates arrays, in decimal WGS84 degrees
+- elevation=None: the elevations array (metres), if any
+- time=None: the timestamps array (datetime64), if any
+Output:
+- A TrackArrays object
+"""
+class TrackArrays:
+	def __init__(self, names, keep_elevation, offsets, lon, lat, elevation=None, time=None):
+		self.names = list(names)
+		self.keep_elevation = [int(keep) for keep in keep_elevation]
+		self.offsets = np.asarray(offsets, dtype=np.int64)
+		self.lon = lon
+		self.lat = lat
+		self.elevation = elevation
+		self.time = time
+
+	def __len__(self):
+		return len(self.lon)
+
+	### Returns the [name, keep_elevation] of each placemark, in order of appearance
+	def Placemarks(self):
+		return [[name, keep] for name, keep in zip(self.names, self.keep_elevation)]
+
+	### Returns a dict mapping each placemark name to the positions of its rows
+	def Groups(self):
+		return {name: np.arange(self.offsets[ix], self.offsets[ix+1]) for ix, name in enumerate(self.names)}
+
+
+
+### Groups NumPy columns by placemark
+"""Columns already grouped (the rows of each placemark contiguous, placemarks in order of appearance) are used as they are, without copies.
+Input:
+- columns: a dict of arrays, or a structured array, with the 'placemark', 'keep_elevation', 'lat', 'lon' and optional 'elevation' and 'time' fields
+Output:
+- A TrackArrays object; placemarks keep the 'keep_elevation' of their first row
+"""
+def TrackArraysFromColumns(columns):
+	if isinstance(columns, np.ndarray):
+		columns = {name: columns[name] for name in columns.dtype.names}
+
+	codes, names = pd.factorize(np.asarray(columns['placemark']))
+	counts = np.bincount(codes, minlength=len(names))
+	offsets = np.concatenate([[0], np.cumsum(counts)])
+
+	if np.all(codes[1:] >= codes[:-1]):
+		order = None
+		first_rows = offsets[:-1]
+	else:
+		order = np.argsort(codes, kind='stable')
+		first_rows = order[offsets[:-1]]
+
+	def Column(name):
+		if name not in columns:
+			return None
+		column = np.asarray(columns[name])
+		return column if order is None else column[order]
+
+	time = Column('time')
+	if time is not None and not np.issubdtype(time.dtype, np.datetime64):
+		time = TimeColumn(time)
+
+	return TrackArrays(names.tolist(), np.asarray(columns['keep_elevation'])[first_rows], offsets, Column('lon'), Column('lat'), Column('elevation'), time)
+
+
+
+##############################################################################
+### Coordinates files
+
+### Reads a coordinates file in chunks
+"""CSV files are read with pandas; Parquet ('.parquet', '.pq') and Arrow/Feather ('.arrow', '.feather', '.ipc') files need pyarrow, and are read
+one row group (or record batch) at a time; a track cache folder (see WriteTrackCache) is loaded as a single TrackArrays.
+Input:
+- file_name: the file location
+- chunksize=1000000: the number of rows read at once from a CSV file (or a Parquet file)
+Output:
+- An iterator of dataframes (or of a single TrackArrays)
+"""
+def ReadCoordinateChunks(file_name, chunksize=1000000):
+	if os.path.isfile(os.path.join(file_name, TRACK_INDEX_FILE_NAME)):
+		return iter([LoadTrackCache(file_name)])
+
+	extension = os.path.splitext(str(file_name))[1].lower()
+	if extension in ('.parquet', '.pq', '.arrow', '.feather', '.ipc'):
+		try:
+			import pyarrow.parquet
+			import pyarrow.ipc
+		except ImportError:
+			raise ImportError("Reading '%s' files needs pyarrow: pip install pyarrow" % extension)
+
+		if extension in ('.parquet', '.pq'):
+			return (batch.to_pandas() for batch in pyarrow.parquet.ParquetFile(file_name).iter_batches(batch_size=chunksize))
+
+		reader = pyarrow.ipc.open_file(file_name)
+		return (reader.get_batch(batch_ix).to_pandas() for batch_ix in range(reader.num_record_batches))
+
+	return pd.read_csv(file_name, chunksize=chunksize)
+
+
+
+##############################################################################
+### Binary track cache
+
+### Describes a source file, so that its cache can be told apart from a stale one
+"""
+Input:
+- file_name: the source file
+Output:
+- A dict with the absolute 'path', the 'size' and the 'mtime_ns' of the file
+"""
+def SourceSignature(file_name):
+	stat = os.stat(file_name)
+
+	return {'path': os.path.abspath(file_name), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+
+### Writes tracks to a binary cache, grouped by placemark
+"""The chunks are first appended, as they come, to temporary column files; the rows are then moved to their placemark in blocks (a counting sort),
+so that memory stays bounded by the chunk size whatever the size of the tracks. Each column is saved as a .npy file, next to a JSON index
+with the placemarks and their offsets, written last: an interrupted write leaves no usable cache.
+Input:
+- chunks: an iterator of dataframes, with the 'placemark', 'keep_elevation', 'lat', 'lon' and optional 'elevation' and 'time' columns
+- cache_folder: the folder where the cache is saved; it is created if needed
+- dtype='float64': the type of the coordinates columns; 'float32' halves the size, but keeps only about 7 significant digits (about 1 m in longitude)
+- source=None: the source file, whose signature is saved, see LoadTrackCache
+- block_size=1000000: the number of rows moved at once
+Output:
+- The cache folder
+"""
+def WriteTrackCache(chunks, cache_folder, dtype='float64', source=None, block_size=1000000):
+	os.makedirs(cache_folder, exist_ok=True)
+	index_file = os.path.join(cache_folder, TRACK_INDEX_FILE_NAME)
+	if os.path.exists(index_file):
+		os.unlink(index_file)
+
+	codes_of = {}
+	keep_elevation = []
+	columns = None
+	points = 0
+	with tempfile.TemporaryDirectory(dir=cache_folder) as tmp_folder:
+		spooled = {}
+		try:
+			for chunk in chunks:
+				if columns is None:
+					columns = [column for column in ('lon', 'lat', 'elevation', 'time') if column in chunk.columns]
+					spooled = {column: open(os.path.join(tmp_folder, column), 'wb') for column in ['code'] + columns}
+
+				for name, keep in chunk[['placemark', 'keep_elevation']].drop_duplicates(keep='first', inplace=False).values.tolist():
+					if name not in codes_of:
+						codes_of[name] = len(codes_of)
+						keep_elevation.append(keep)
+
+				chunk['placemark'].map(codes_of).to_numpy(np.int64).tofile(spooled['code'])
+				for column in columns:
+					if column == 'time':
+						TimeColumn(chunk['time']).tofile(spooled[column])
+					else:
+						chunk[column].to_numpy(dtype).tofile(spooled[column])
+				points += len(chunk)
+		finally:
+			for f in spooled.values():
+				f.close()
+
+		if columns is None:
+			columns = ['lon', 'lat']
+		column_types = {column: np.dtype('datetime64[ns]') if column == 'time' else np.dtype(dtype) for column in columns}
+
+		def Spooled(column, column_type):
+			if points == 0:
+				return np.empty(0, dtype=column_type)
+			return np.memmap(os.path.join(tmp_folder, column), dtype=column_type, mode='r')
+
+		codes = Spooled('code', np.int64)
+		counts = np.zeros(len(codes_of), dtype=np.int64)
+		for start in range(0, points, block_size):
+			counts += np.bincount(codes[start:start+block_size], minlength=len(codes_of))
+		offsets = np.concatenate([[0], np.cumsum(counts)])
+
+		sources = {column: Spooled(column, column_type) for column, column_type in column_types.items()}
+		if points == 0:
+			for column, column_type in column_types.items():
+				np.save(os.path.join(cache_folder, column+'.npy'), np.empty(0, dtype=column_type))
+		else:
+			outputs = {column: np.lib.format.open_memmap(os.path.join(cache_folder, column+'.npy'), mode='w+', dtype=column_type, shape=(points,)) for column, column_type in column_types.items()}
+			cursor = offsets[:-1].copy()
+			for start in range(0, points, block_size):
+				block_codes = np.asarray(codes[start:start+block_size])
+				order = np.argsort(block_codes, kind='stable')
+				sorted_codes = block_codes[order]
+				block_counts = np.bincount(block_codes, minlength=len(codes_of))
+				group_starts = np.cumsum(block_counts) - block_counts
+
+				# Each row goes after the rows of its placemark already moved, keeping their order
+				destination = cursor[sorted_codes] + np.arange(len(order)) - group_starts[sorted_codes]
+				for column in columns:
+					outputs[column][destination] = sources[column][start:start+block_size][order]
+				cursor += block_counts
+
+			for output in outputs.values():
+				output.flush()
+			del outputs
+		del codes, sources
+
+	index = {
+		'version': TRACK_CACHE_VERSION,
+		'points': points,
+		'dtype': np.dtype(dtype).name,
+		'columns': columns,
+		'names': list(codes_of),
+		'keep_elevation': keep_elevation,
+		'offsets': offsets.tolist(),
+		'source': SourceSignature(source) if source is not None else None,
+	}
+	with open(index_file, 'w', encoding='utf-8') as f:
+		json.dump(index, f)
+
+	return cache_folder
+
+
+
+### Loads tracks from a binary cache, memory-mapping its columns
+"""
+Input:
+- cache_folder: the folder of the cache, see WriteTrackCache
+- source=None: if given, the cache is only used if it was written from this file, as it is now (same size and modification time)
+- dtype=None: if given, the cache is only used if its coordinates have this type
+Output:
+- A TrackArrays object, or None if the cache is missing or stale
+"""
+def LoadTrackCache(cache_folder, source=None, dtype=None):
+	try:
+		with open(os.path.join(cache_folder, TRACK_INDEX_FILE_NAME), 'r', encoding='utf-8') as f:
+			index = json.load(f)
+	except (OSError, ValueError):
+		return None
+
+	if index.get('version') != TRACK_CACHE_VERSION:
+		return None
+	if source is not None and index.get('source') != SourceSignature(source):
+		return None
+	if dtype is not None and index.get('dtype') != np.dtype(dtype).name:
+		return None
+
+	arrays = {column: np.load(os.path.join(cache_folder, column+'.npy'), mmap_mode='r' if index['points'] else None) for column in index['columns']}
+
+	return TrackArrays(index['names'], index['keep_elevation'], index['offsets'], arrays['lon'], arrays['lat'], arrays.get('elevation'), arrays.get('time'))
+
+
+
+### Returns the tracks of a coordinates file, from its binary cache if up to date
+"""The first build from a file parses it and writes the cache; the following ones load the cache instead, skipping the parsing.
+Input:
+- file_name: the coordinates file (CSV, Parquet or Arrow, see ReadCoordinateChunks)
+- cache_root: the folder where the caches are kept, one subfolder per source file; keep it outside of the KML output folder
+- dtype='float64': the type of the coordinates columns, see WriteTrackCache
+- chunksize=1000000: the number of rows read at once while writing the cache
+Output:
+- A tuple with the TrackArrays, and whether they were loaded from the cache
+"""
+def CachedTracks(file_name, cache_root, dtype='float64', chunksize=1000000):
+	cache_folder = os.path.join(cache_root, hashlib.sha1(os.path.abspath(file_name).encode('utf-8')).hexdigest()[:16])
+
+	tracks = LoadTrackCache(cache_folder, file_name, dtype)
+	if tracks is not None:
+		return tracks, True
+
+	WriteTrackCache(ReadCoordinateChunks(file_name, chunksize), cache_folder, dtype, file_name)
+
+	return LoadTrackCache(cache_folder, file_name, dtype), False
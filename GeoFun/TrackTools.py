@@ -0,0 +1,176 @@
+from .LazyImport import LazyModule
+
+np = LazyModule('numpy')
+
+
+
+##############################################################################
+### Tracks functions
+
+EARTH_RADIUS = 6371008.8
+
+
+
+### Projects coordinates onto a local plane, in metres
+"""An equirectangular projection centred on the mean latitude of the track; accurate enough for distances within a track.
+Input:
+- lon: the longitudes array (decimal WGS84)
+- lat: the latitudes array (decimal WGS84)
+- elevation=None: the elevations array (metres), if the elevation is to be taken into account
+Output:
+- An (n, 2) or (n, 3) array of x, y (and z) coordinates, in metres
+"""
+def LocalProjection(lon, lat, elevation=None):
+	lon = np.asarray(lon, dtype=np.float64)
+	lat = np.asarray(lat, dtype=np.float64)
+
+	cos_lat = np.cos(np.radians(np.nanmean(lat))) if len(lat) else 1.0
+	columns = [np.radians(lon) * EARTH_RADIUS * cos_lat, np.radians(lat) * EARTH_RADIUS]
+	if elevation is not None:
+		columns.append(np.nan_to_num(np.asarray(elevation, dtype=np.float64)))
+
+	return np.column_stack(columns)
+
+
+
+### Simplifies a track with the Douglas-Peucker algorithm
+"""All the segments being split at the same depth are processed at once with NumPy, so the Python loop runs once per level rather than once per segment.
+Input:
+- lon: the longitudes array (decimal WGS84)
+- lat: the latitudes array (decimal WGS84)
+- elevation=None: the elevations array (metres); if given, distances are measured in 3D
+- tolerance=10.0: the maximum distance (metres) between the original track and the simplified one
+Output:
+- A boolean array, True for the points to keep; the first and last points are always kept, and so are the points without a position (NaN),
+  the others being simplified on their own
+"""
+def SimplifyTrack(lon, lat, elevation=None, tolerance=10.0):
+	n = len(lon)
+	keep = np.zeros(n, dtype=bool)
+	if n <= 2:
+		keep[:] = True
+		return keep
+
+	lon = np.asarray(lon, dtype=np.float64)
+	lat = np.asarray(lat, dtype=np.float64)
+	finite = np.isfinite(lon) & np.isfinite(lat)
+	if not np.all(finite):
+		# GPS dropouts are written as they are, without taking part in the distances
+		positions = np.flatnonzero(finite)
+		keep[~finite] = True
+		keep[positions[SimplifyTrack(lon[positions], lat[positions], elevation[positions] if elevation is not None else None, tolerance)]] = True
+		return keep
+
+	columns = [np.ascontiguousarray(column) for column in LocalProjection(lon, lat, elevation).T]
+	keep[0] = keep[-1] = True
+
+	seg_start = np.array([0])
+	seg_end = np.array([n-1])
+	while len(seg_start):
+		# Only segments with points in between can be split
+		lengths = seg_end - seg_start - 1
+		splittable = lengths > 0
+		seg_start, seg_end, lengths = seg_start[splittable], seg_end[splittable], lengths[splittable]
+		if not len(seg_start):
+			break
+
+		# Positions of the points in between, with the segment each belongs to
+		offsets = np.cumsum(lengths) - lengths
+		seg_id = np.repeat(np.arange(len(seg_start)), lengths)
+		idx = np.arange(1, lengths.sum()+1) + np.repeat(seg_start - offsets, lengths)
+
+		# Distance of each point from its segment, one coordinate at a time
+		ap = []
+		ab = []
+		ab_sq = np.zeros(len(seg_start))
+		dot = np.zeros(len(idx))
+		for column in columns:
+			a = column[seg_start]
+			ab_seg = column[seg_end] - a
+			ab_sq += ab_seg**2
+			ap.append(column[idx] - a[seg_id])
+			ab.append(ab_seg[seg_id])
+			dot += ap[-1] * ab[-1]
+
+		t = np.clip(np.divide(dot, ab_sq[seg_id], out=np.zeros(len(idx)), where=ab_sq[seg_id] > 0), 0.0, 1.0)
+		distance_sq = np.zeros(len(idx))
+		for ap_k, ab_k in zip(ap, ab):
+			distance_sq += (ap_k - t*ab_k)**2
+
+		# Farthest point of each segment (the first one, if tied): split there if beyond the tolerance
+		max_distance_sq = np.maximum.reduceat(distance_sq, offsets)
+		position = np.where(distance_sq == max_distance_sq[seg_id], np.arange(len(idx)), len(idx))
+		split_at = idx[np.minimum.reduceat(position, offsets)]
+
+		to_split = max_distance_sq > tolerance**2
+		seg_start, seg_end, split_at = seg_start[to_split], seg_end[to_split], split_at[to_split]
+		keep[split_at] = True
+
+		seg_start, seg_end = np.concatenate([seg_start, split_at]), np.concatenate([split_at, seg_end])
+
+	return keep
+
+
+
+### Interpolates the positions of a track at given times
+"""All the times are placed on the track at once, with a sorted search: each one is interpolated between the track points around it
+(along the shortest way in longitude, across the antimeridian if needed).
+Input:
+- track_times: the times of the track points (datetime64); points without a time (NaT) or a position (NaN) are ignored
+- lon: the longitudes array of the track (decimal WGS84)
+- lat: the latitudes array of the track (decimal WGS84)
+- elevation: the elevations array of the track (metres), or None
+- times: the times to be placed on the track (datetime64)
+- max_gap=60.0: the maximum gap, in seconds, between the track points a time is interpolated between; times in a wider gap, or before the start
+				or after the end of the track, take the position of the nearest point instead, if no farther than max_gap from it
+Output:
+- A tuple with the 'lon', 'lat' and 'elevation' arrays of the positions, NaN where a time could not be placed; 'elevation' is None if not given
+"""
+def InterpolateTrack(track_times, lon, lat, elevation, times, max_gap=60.0):
+	nat = np.datetime64('NaT').astype(np.int64)
+	track_times = np.asarray(track_times, dtype='datetime64[ns]').astype(np.int64)
+	times = np.asarray(times, dtype='datetime64[ns]').astype(np.int64)
+
+	columns = [np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)]
+	if elevation is not None:
+		columns.append(np.asarray(elevation, dtype=np.float64))
+
+	valid = (track_times != nat) & ~np.isnan(columns[0]) & ~np.isnan(columns[1])
+	order = np.argsort(track_times[valid], kind='stable')
+	track_times = track_times[valid][order]
+	columns = [column[valid][order] for column in columns]
+
+	positions = [np.full(len(times), np.nan) for _ in columns]
+	n = len(track_times)
+	if n == 0:
+		return positions[0], positions[1], positions[2] if elevation is not None else None
+
+	# The track points around each time: the last one before it, and the first one at or after it
+	after = np.searchsorted(track_times, times, side='left')
+	before = after - 1
+	has_before = before >= 0
+	has_after = after < n
+	before = np.clip(before, 0, n-1)
+	after = np.clip(after, 0, n-1)
+
+	max_gap_ns = max_gap * 1e9
+	since_before = np.where(has_before, (times - track_times[before]).astype(np.float64), np.inf)
+	until_after = np.where(has_after, (track_times[after] - times).astype(np.float64), np.inf)
+	gap = (track_times[after] - track_times[before]).astype(np.float64)
+
+	interpolated = has_before & has_after & (gap <= max_gap_ns)
+	fraction = np.divide(since_before, gap, out=np.zeros(len(times)), where=interpolated & (gap > 0))
+	nearest = np.where(since_before <= until_after, before, after)
+	snapped = ~interpolated & (np.minimum(since_before, until_after) <= max_gap_ns)
+	placed = (times != nat) & (interpolated | snapped)
+
+	for column_ix, column in enumerate(columns):
+		step = column[after] - column[before]
+		if column_ix == 0:
+			step = (step + 180.0) % 360.0 - 180.0
+		value = np.where(interpolated, column[before] + step*fraction, column[nearest])
+		if column_ix == 0:
+			value = (value + 180.0) % 360.0 - 180.0
+		positions[column_ix][placed] = value[placed]
+
+	return positions[0], positions[1], positions[2] if elevation is not None else None
@@ -0,0 +1,357 @@
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+import multiprocessing
+import concurrent.futures
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+REPOSITORY_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_FOLDER)
+
+from GeoFun import KMLBuilder
+from SyntheticData import MakeTracks, MakePhotos
+
+
+
+##############################################################################
+### Scales
+
+### Photos and points per placemark run by each preset; tracks always have TRACK_PLACEMARKS placemarks
+SCALES = {
+	'small': {'photos': [100], 'points': [1000, 100000]},
+	'medium': {'photos': [100, 1000], 'points': [1000, 100000, 1000000]},
+	'full': {'photos': [100, 1000, 10000, 100000], 'points': [1000, 100000, 1000000, 10000000]},
+}
+TRACK_PLACEMARKS = 10
+RESIZE_SAMPLE = 200
+
+
+
+##############################################################################
+### Stages
+
+### Each stage takes its inputs and a temporary folder, and returns the number of items (points or photos) processed
+
+def CoordinatesStage(inputs, tmp_folder):
+	KMLBuilder.CoordinatesParser(inputs['coords'])
+	return len(inputs['coords'])
+
+def StreamCoordinatesStage(inputs, tmp_folder):
+	with open(os.devnull, 'wb') as devnull:
+		KMLBuilder.StreamKml(devnull, 'benchmark', coords_df=inputs['coords'])
+	return len(inputs['coords'])
+
+def ScanStage(inputs, tmp_folder):
+	return len(KMLBuilder.PhotosIterator(inputs['photos']))
+
+def FilesStage(inputs, tmp_folder):
+	return len(KMLBuilder.FilesIterator(inputs['photos']))
+
+def ResizeStage(inputs, tmp_folder):
+	resized = 0
+	for file_name in KMLBuilder.FilesIterator(inputs['photos'])[:RESIZE_SAMPLE]:
+		new_img = KMLBuilder.GetFile(file_name, tmp_folder, inputs['resize_opt'])
+		if new_img is not None:
+			new_img.close()
+			resized += 1
+	return resized
+
+def BuildStage(inputs, tmp_folder):
+	KMLBuilder.CreateKmlFile(os.path.join(tmp_folder, 'benchmark'), coords_df=inputs.get('coords'), img_input_folder=inputs.get('photos'), resize_opt=inputs.get('resize_opt', 1.0), **inputs.get('options', {}))
+	return inputs['items']
+
+STAGES = {
+	'coordinates': CoordinatesStage,
+	'stream_coordinates': StreamCoordinatesStage,
+	'scan': ScanStage,
+	'files': FilesStage,
+	'resize': ResizeStage,
+	'build': BuildStage,
+}
+
+
+
+### Measures the peak resident memory of the current process
+"""On Linux, the high-water mark of /proc is used: unlike ru_maxrss, it is not inherited from the parent by freshly spawned processes.
+Output:
+- The peak RSS in MB, or None where it cannot be measured (e.g. Windows)
+"""
+def PeakRss():
+	try:
+		with open('/proc/self/status') as f:
+			for line in f:
+				if line.startswith('VmHWM:'):
+					return int(line.split()[1]) / 1024
+	except OSError:
+		pass
+
+	if resource is None:
+		return None
+
+	# ru_maxrss is in KB on Linux, in bytes on macOS
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != 'darwin' else 1024**2)
+
+
+
+### Runs a benchmark case, in the current process
+"""
+Input:
+- stage: the name of the stage, see STAGES
+- inputs: a dict with the inputs of the stage: 'coords' as (placemarks, points) to be generated, 'photos' as a folder, 'resize_opt', 'options'
+- trace_allocations=False: whether to also trace the Python allocations (tracemalloc); this slows down the stage, so timings are less accurate
+Output:
+- A dict with the items processed, the elapsed seconds, the throughput, the peak of the Python allocations (None if not traced), and the peak RSS
+  before (inputs loaded) and after the stage, in MB
+"""
+def RunCase(stage, inputs, trace_allocations=False):
+	inputs = dict(inputs)
+	if 'coords' in inputs:
+		inputs['coords'] = MakeTracks(*inputs['coords'])
+
+	baseline_rss = PeakRss()
+	tmp_folder = tempfile.mkdtemp(prefix='geofun_benchmark_')
+	traced_peak = None
+	try:
+		if trace_allocations:
+			tracemalloc.start()
+		start = time.perf_counter()
+		items = STAGES[stage](inputs, tmp_folder + os.sep)
+		elapsed = time.perf_counter() - start
+		if trace_allocations:
+			traced_peak = tracemalloc.get_traced_memory()[1] / 1024**2
+			tracemalloc.stop()
+	finally:
+		shutil.rmtree(tmp_folder, ignore_errors=True)
+
+	return {
+		'items': items,
+		'seconds': elapsed,
+		'items_per_second': items / elapsed if elapsed > 0 else None,
+		'traced_peak_mb': traced_peak,
+		'baseline_rss_mb': baseline_rss,
+		'peak_rss_mb': PeakRss(),
+	}
+
+
+
+### Runs a benchmark case in a fresh process, so that its peak memory is its own
+"""The process is not a daemon (unlike those of multiprocessing.Pool), so that the cases with workers can start their own processes.
+Input:
+- stage, inputs, trace_allocations: see RunCase
+Output:
+- The RunCase dict, or a dict with the 'error' if the case failed
+"""
+def RunIsolated(stage, inputs, trace_allocations=False):
+	with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+		try:
+			return executor.submit(RunCase, stage, inputs, trace_allocations).result()
+		except Exception as e:
+			return {'error': "%s: %s" % (type(e).__name__, e)}
+
+
+
+##############################################################################
+### Import time
+
+### Seconds each module may take to import, in a fresh interpreter: the heavy dependencies are only loaded on first use
+IMPORT_BUDGETS = {
+	'GeoFun.KMLBuilder': 0.3,
+	'GeoFun.BatchRunner': 0.3,
+}
+### Dependencies that importing GeoFun must not load
+HEAVY_MODULES = ('pandas', 'numpy', 'PIL', 'colour')
+### Dependencies that a build from coordinates only must not load
+COORDINATES_ONLY_FORBIDDEN = ('PIL',)
+
+IMPORT_CODE = """
+import sys, time, json
+start = time.perf_counter()
+import %s
+print(json.dumps([time.perf_counter() - start, sorted(sys.modules)]))
+"""
+
+COORDINATES_ONLY_CODE = """
+import os, sys, json
+import pandas as pd
+from GeoFun import KMLBuilder
+coords = pd.DataFrame({'placemark': ['a', 'a'], 'keep_elevation': [0, 0], 'lat': [41.0, 41.1], 'lon': [16.0, 16.1], 'elevation': [0.0, 0.0]})
+with open(os.devnull, 'wb') as devnull:
+	KMLBuilder.StreamKml(devnull, 'benchmark', coords_df=coords)
+print(json.dumps([0.0, sorted(sys.modules)]))
+"""
+
+
+
+### Runs code in a fresh interpreter, returning the seconds it reports and the modules it loaded
+"""
+Input:
+- code: the code to run; it prints a JSON list with the seconds and the names of the modules loaded
+Output:
+- A tuple with the seconds and the set of the names of the top level modules loaded
+"""
+def RunFresh(code):
+	paths = [REPOSITORY_FOLDER] + ([os.environ['PYTHONPATH']] if os.environ.get('PYTHONPATH') else [])
+	environment = dict(os.environ, PYTHONPATH=os.pathsep.join(paths))
+	output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, env=environment).stdout
+	seconds, modules = json.loads(output.splitlines()[-1])
+
+	return seconds, {module.split('.')[0] for module in modules}
+
+
+
+### Times the imports of the package, and checks which dependencies they load
+"""Each import runs in a fresh interpreter, a few times, keeping the fastest (the others are slowed down by the disk cache).
+Input:
+- repeat=3: the number of times each import is timed
+Output:
+- A list of dicts with the 'case', the 'seconds', the 'budget' (None if none), the 'loaded' forbidden dependencies, and whether it 'passed'
+"""
+def ImportChecks(repeat=3):
+	results = []
+	for module, budget in IMPORT_BUDGETS.items():
+		timings = [RunFresh(IMPORT_CODE % module) for _ in range(repeat)]
+		seconds = min(seconds for seconds, _ in timings)
+		loaded = sorted(set(HEAVY_MODULES) & timings[0][1])
+		results.append({'case': 'import '+module, 'seconds': seconds, 'budget': budget, 'loaded': loaded, 'passed': seconds <= budget and not loaded})
+
+	seconds, modules = RunFresh(COORDINATES_ONLY_CODE)
+	loaded = sorted(set(COORDINATES_ONLY_FORBIDDEN) & modules)
+	results.append({'case': 'StreamKml, coordinates only', 'seconds': None, 'budget': None, 'loaded': loaded, 'passed': not loaded})
+
+	return results
+
+
+
+### Prints the import checks as a table
+"""
+Input:
+- results: the list of dicts returned by ImportChecks
+Output:
+- The table, printed
+"""
+def PrintImportChecks(results):
+	print('%-60s %12s %12s  %-30s %s' % ('import', 'seconds', 'budget', 'forbidden modules loaded', 'result'))
+	for result in results:
+		seconds = '%.3f' % result['seconds'] if result['seconds'] is not None else 'n/a'
+		budget = '%.3f' % result['budget'] if result['budget'] is not None else 'n/a'
+		print('%-60s %12s %12s  %-30s %s' % (result['case'], seconds, budget, ', '.join(result['loaded']) or '-', 'ok' if result['passed'] else 'FAILED'))
+
+
+
+##############################################################################
+### Suite
+
+### Lists the benchmark cases of a run
+"""
+Input:
+- photos: the numbers of photos to benchmark
+- points: the numbers of points per placemark to benchmark
+- data_folder: the folder where the synthetic photos are generated (and reused by later runs)
+- stages: the names of the stages to run
+Output:
+- A list of (case name, stage, inputs) tuples
+"""
+def BenchmarkCases(photos, points, data_folder, stages):
+	cases = []
+
+	for n_points in points:
+		coords = (TRACK_PLACEMARKS, n_points)
+		label = '%dx%d points' % coords
+		if 'coordinates' in stages:
+			cases.append(('CoordinatesParser, '+label, 'coordinates', {'coords': coords}))
+		if 'stream_coordinates' in stages:
+			cases.append(('StreamKml, '+label, 'stream_coordinates', {'coords': coords}))
+		if 'build' in stages:
+			for engine in ('minidom', 'stream'):
+				cases.append(('CreateKmlFile (%s), %s' % (engine, label), 'build', {'coords': coords, 'items': TRACK_PLACEMARKS*n_points, 'options': {'engine': engine}}))
+
+	for n_photos in photos:
+		folder = MakePhotos(os.path.join(data_folder, 'photos_%d' % n_photos, ''), n_photos)
+		label = '%d photos' % n_photos
+		if 'scan' in stages:
+			cases.append(('PhotosIterator, '+label, 'scan', {'photos': folder}))
+		if 'files' in stages:
+			cases.append(('FilesIterator, '+label, 'files', {'photos': folder}))
+		if 'resize' in stages:
+			cases.append(('GetFile 50%% area, %d of %s' % (min(n_photos, RESIZE_SAMPLE), label), 'resize', {'photos': folder, 'resize_opt': 0.5}))
+			cases.append(('GetFile 100KB, %d of %s' % (min(n_photos, RESIZE_SAMPLE), label), 'resize', {'photos': folder, 'resize_opt': 100}))
+		if 'build' in stages:
+			for workers in (None, os.cpu_count()):
+				cases.append(('CreateKmlFile (stream, workers=%s), %s' % (workers, label), 'build', {'photos': folder, 'resize_opt': 0.5, 'items': n_photos, 'options': {'engine': 'stream', 'workers': workers}}))
+				cases.append(('CreateKmlFile (stream, workers=%s, pipelined), %s' % (workers, label), 'build', {'photos': folder, 'resize_opt': 0.5, 'items': n_photos, 'options': {'engine': 'stream', 'workers': workers, 'pipelined': True}}))
+			cases.append(('CreateKmlFile (stream, passthrough), %s' % label, 'build', {'photos': folder, 'resize_opt': None, 'items': n_photos, 'options': {'engine': 'stream'}}))
+
+	return cases
+
+
+
+### Prints the results as a table
+"""
+Input:
+- results: a list of (case name, result dict) tuples
+Output:
+- The table, printed
+"""
+def PrintResults(results):
+	print('%-60s %10s %12s %12s %12s %12s %12s' % ('case', 'items', 'seconds', 'items/s', 'traced MB', 'base RSS MB', 'peak RSS MB'))
+	for name, result in results:
+		if 'error' in result:
+			print('%-60s %s' % (name, result['error']))
+			continue
+
+		memory = ['%.1f' % result[key] if result[key] is not None else 'n/a' for key in ('traced_peak_mb', 'baseline_rss_mb', 'peak_rss_mb')]
+		print('%-60s %10d %12.3f %12.1f %12s %12s %12s' % (name, result['items'], result['seconds'], result['items_per_second'] or 0, memory[0], memory[1], memory[2]))
+
+
+
+def Main(argv=None):
+	parser = argparse.ArgumentParser(description='Benchmarks the KMLBuilder stages on synthetic GPS tracks and geo-located photos.')
+	parser.add_argument('--scale', choices=sorted(SCALES), default='small', help='the preset of photos and points to run')
+	parser.add_argument('--photos', type=int, nargs='*', help='the numbers of photos, overriding the preset')
+	parser.add_argument('--points', type=int, nargs='*', help='the numbers of points per placemark, overriding the preset')
+	parser.add_argument('--stages', nargs='*', choices=sorted(list(STAGES) + ['import']), default=sorted(list(STAGES) + ['import']), help="the stages to run; 'import' times the imports against IMPORT_BUDGETS")
+	parser.add_argument('--data-folder', default=os.path.join(tempfile.gettempdir(), 'geofun_benchmark_data'), help='where the synthetic photos are generated and reused')
+	parser.add_argument('--trace-allocations', action='store_true', help='also trace the peak of the Python allocations (slower, timings are less accurate)')
+	parser.add_argument('--json', help='a file where the results are also saved, as JSON')
+	args = parser.parse_args(argv)
+
+	photos = args.photos if args.photos is not None else SCALES[args.scale]['photos']
+	points = args.points if args.points is not None else SCALES[args.scale]['points']
+
+	import_results = []
+	if 'import' in args.stages:
+		print('Running: import checks')
+		import_results = ImportChecks()
+
+	results = []
+	for name, stage, inputs in BenchmarkCases(photos, points, args.data_folder, args.stages):
+		print('Running: '+name)
+		results.append((name, RunIsolated(stage, inputs, args.trace_allocations)))
+
+	print('')
+	if import_results:
+		PrintImportChecks(import_results)
+		print('')
+	PrintResults(results)
+
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump([dict(result, case=name) for name, result in results] + import_results, f, indent=1)
+
+	# Over budget imports fail the run, e.g. in CI
+	return 0 if all(result['passed'] for result in import_results) else 1
+
+
+
+if __name__ == '__main__':
+	sys.exit(Main())
@@ -0,0 +1,137 @@
+import os
+import io
+import struct
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from PIL import Image
+from PIL.TiffImagePlugin import IFDRational
+
+
+
+##############################################################################
+### Synthetic GPS tracks
+
+### Creates a dataframe of GPS coordinates, as expected by KMLBuilder
+"""Each placemark is a random walk of M points, one per second; placemarks alternate between clamped to the ground and with elevation.
+Input:
+- n_placemarks: the number of placemarks (N)
+- n_points: the number of points of each placemark (M)
+- seed=0: the seed of the random generator, so that the same inputs are produced on every run
+- origin=(41.0, 16.0): the (lat, lon) where the walks start
+Output:
+- A dataframe with the 'placemark', 'keep_elevation', 'time', 'lat', 'lon', 'elevation' columns
+"""
+def MakeTracks(n_placemarks, n_points, seed=0, origin=(41.0, 16.0)):
+	rs = np.random.RandomState(seed)
+	start = np.datetime64('2020-01-01T00:00:00')
+
+	frames = []
+	for placemark in range(n_placemarks):
+		frames.append(pd.DataFrame({
+			'placemark': 'trip%d' % placemark,
+			'keep_elevation': placemark % 2,
+			'time': start + np.arange(n_points).astype('timedelta64[s]'),
+			'lat': origin[0] + np.cumsum(rs.randn(n_points) * 1e-4),
+			'lon': origin[1] + np.cumsum(rs.randn(n_points) * 1e-4),
+			'elevation': 100 + np.cumsum(rs.randn(n_points)),
+		}))
+
+	return pd.concat(frames, ignore_index=True)
+
+
+
+##############################################################################
+### Synthetic geo-located photos
+
+### Converts a decimal degree into EXIF (degrees, minutes, seconds) rationals
+"""
+Input:
+- value: the decimal degree
+Output:
+- A tuple of three IFDRational
+"""
+def DecimalToDms(value):
+	value = abs(value)
+	degrees = int(value)
+	minutes = int((value - degrees) * 60)
+	seconds = round(((value - degrees) * 60 - minutes) * 60 * 100)
+
+	return IFDRational(degrees, 1), IFDRational(minutes, 1), IFDRational(seconds, 100)
+
+
+
+### Builds the EXIF segment (APP1) of a synthetic photo
+"""
+Input:
+- timestamp: the DateTimeOriginal of the photo
+- lat, lon, altitude: the GPS position of the photo
+- width, height: the sides of the photo, in pixels
+Output:
+- The APP1 segment bytes, ready to be inserted after the JPEG SOI marker
+"""
+def ExifSegment(timestamp, lat, lon, altitude, width, height):
+	exif = Image.Exif()
+	exif[0x0110] = 'GeoFun benchmark'
+
+	exif_ifd = exif.get_ifd(0x8769)
+	exif_ifd[0x9003] = timestamp.strftime('%Y:%m:%d %H:%M:%S')
+	exif_ifd[0xA002] = width
+	exif_ifd[0xA003] = height
+
+	gps = exif.get_ifd(0x8825)
+	gps[1] = 'N' if lat >= 0 else 'S'
+	gps[2] = DecimalToDms(lat)
+	gps[3] = 'E' if lon >= 0 else 'W'
+	gps[4] = DecimalToDms(lon)
+	gps[5] = 0
+	gps[6] = IFDRational(int(altitude * 100), 100)
+
+	payload = exif.tobytes()
+
+	return b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+
+
+
+### Creates a folder of JPEGs with synthetic GPSInfo and DateTimeOriginal EXIF
+"""The pixels are encoded once per size and only the EXIF segment changes between photos, so that even 100k photos are produced quickly.
+Photos already in the folder are kept, so that the same folder can be reused across runs.
+Input:
+- folder: the folder where the photos are saved
+- n_photos: the number of photos
+- size=(1600, 1200): the sides of the photos, in pixels
+- seed=0: the seed of the random generator
+- origin=(41.0, 16.0): the (lat, lon) around which the photos are scattered
+Output:
+- The folder, with the photos
+"""
+def MakePhotos(folder, n_photos, size=(1600, 1200), seed=0, origin=(41.0, 16.0)):
+	os.makedirs(folder, exist_ok=True)
+	rs = np.random.RandomState(seed)
+
+	# A smooth image with some noise: it compresses like a real photo rather than like pure noise
+	y, x = np.mgrid[0:size[1], 0:size[0]]
+	pixels = np.stack([x * 255 // size[0], y * 255 // size[1], (x + y) * 255 // (size[0] + size[1])], axis=-1)
+	pixels = np.clip(pixels + rs.randint(-20, 20, pixels.shape), 0, 255).astype('uint8')
+
+	with io.BytesIO() as buffer:
+		Image.fromarray(pixels).save(buffer, format='JPEG', quality=90)
+		jpeg = buffer.getvalue()
+
+	start = datetime.datetime(2020, 1, 1)
+	lats = origin[0] + rs.rand(n_photos) - 0.5
+	lons = origin[1] + rs.rand(n_photos) - 0.5
+	minutes = rs.randint(0, 60*24*365, n_photos)
+
+	for photo in range(n_photos):
+		file_name = os.path.join(folder, 'photo%06d.jpg' % photo)
+		if os.path.exists(file_name):
+			continue
+
+		segment = ExifSegment(start + datetime.timedelta(minutes=int(minutes[photo])), lats[photo], lons[photo], 100.0, size[0], size[1])
+		with open(file_name, 'wb') as f:
+			f.write(jpeg[:2] + segment + jpeg[2:])
+
+	return folder
@@ -13,6 +13,10 @@ setup(
   url = 'https://github.com/rik-git/GeoFun',   # Provide either the link to your github or to your website
   download_url = 'https://github.com/rik-git/GeoFun/archive/0.1.tar.gz',    # I explain this later on
   keywords = ['kml', 'geolocated images', 'GIS', 'kml builder', 'GoogleEarth', 'embed images into kml'],   # Keywords that define your package best
+  entry_points={
+          'console_scripts': ['geofun-batch=GeoFun.BatchRunner:Main'],   # builds many KML files from a JSON manifest of jobs
+      },
+  python_requires='>=3.7',   # asyncio.run, datetime.fromisoformat and ZipFile.open(..., 'w')
   install_requires=[            # I get to this in a second
           'datetime',
           'pathlib',
@@ -27,9 +31,6 @@ setup(
     'Topic :: Software Development :: Build Tools',
     'License :: OSI Approved :: GNU General Public License v3 (GPLv3)',   # Again, pick a license
     'Programming Language :: Python :: 3',      #Specify which pyhton versions that you want to support
-    'Programming Language :: Python :: 3.4',
-    'Programming Language :: Python :: 3.5',
-    'Programming Language :: Python :: 3.6',
     'Programming Language :: Python :: 3.7',
   ],
 )
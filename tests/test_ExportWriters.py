@@ -0,0 +1,59 @@
+import os
+import json
+import xml.dom.minidom
+
+import numpy as np
+
+from GeoFun.ExportWriters import ExportWriters
+
+
+
+##############################################################################
+### Tests
+
+### The photos CSV is only listed (and created) when there are photos
+def test_file_names_list_only_written_files(tmp_path):
+	base_file_name = str(tmp_path / "trip")
+	lon = np.array([16.0, 16.1])
+	lat = np.array([41.0, 41.1])
+
+	def Chunks():
+		yield lon, lat, None, None
+
+	with ExportWriters(base_file_name, "trip", ("geojson", "gpx", "csv")) as exports:
+		exports.WriteTrack("track", 0, Chunks)
+
+	assert sorted(exports.FileNames()) == [base_file_name+".csv", base_file_name+".geojson", base_file_name+".gpx"]
+	assert all(os.path.isfile(file_name) for file_name in exports.FileNames())
+	assert not os.path.exists(base_file_name+"_photos.csv")
+
+	with ExportWriters(base_file_name, "trip", ("csv",)) as exports:
+		exports.WritePhoto({'name': 'photo', 'href': 'img/photo.jpg', 'timestamp': None, 'latitude': 41.0, 'longitude': 16.0, 'altitude': None, 'width': 40, 'height': 30})
+
+	assert exports.FileNames() == [base_file_name+".csv", base_file_name+"_photos.csv"]
+	assert os.path.isfile(base_file_name+"_photos.csv")
+
+
+
+### Track points without a finite position (GPS dropouts) are left out, so that the GeoJSON and the GPX stay valid
+def test_tracks_with_missing_positions(tmp_path):
+	base_file_name = str(tmp_path / "trip")
+	lon = np.array([16.0, 16.1, 16.2, 16.3])
+	lat = np.array([41.0, np.nan, 41.2, 41.3])
+	elevation = np.array([10.0, 20.0, np.inf, 40.0])
+	times = np.array(['2020-01-01T00:00:00', '2020-01-01T00:00:01', '2020-01-01T00:00:02', '2020-01-01T00:00:03'], dtype='datetime64[ns]')
+
+	def Chunks():
+		yield lon[:2], lat[:2], elevation[:2], times[:2]
+		yield lon[2:], lat[2:], elevation[2:], times[2:]
+
+	with ExportWriters(base_file_name, "trip", ("geojson", "gpx")) as exports:
+		exports.WriteTrack("track", 1, Chunks)
+
+	with open(base_file_name+".geojson", encoding='utf-8') as f:
+		feature = json.load(f)['features'][0]
+	assert feature['geometry']['coordinates'] == [[16.0, 41.0, 10.0], [16.3, 41.3, 40.0]]
+	assert feature['properties']['coordTimes'] == ['2020-01-01T00:00:00Z', '2020-01-01T00:00:03Z']
+
+	points = xml.dom.minidom.parse(base_file_name+".gpx").getElementsByTagName('trkpt')
+	assert [(point.getAttribute('lat'), point.getAttribute('lon')) for point in points] == [('41.0', '16.0'), ('41.3', '16.3')]
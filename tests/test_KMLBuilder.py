@@ -0,0 +1,242 @@
+import os
+import datetime
+import xml.dom.minidom
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+from PIL.TiffImagePlugin import IFDRational
+
+from GeoFun import KMLBuilder
+from GeoFun.TrackTools import SimplifyTrack, LocalProjection
+
+
+
+##############################################################################
+### Helpers
+
+### Saves a JPEG with a GPS position and a timestamp in its EXIF
+"""
+Input:
+- file_name: the file location
+- pixels: the (height, width, 3) uint8 array of the image
+- quality=95: the JPEG quality
+- located=True: whether to write the GPS position (41.5N, 16.25E, 123.45 m); the timestamp (2020-01-01 12:00:00) is always written
+Output:
+- The JPEG file
+"""
+def SaveGeotaggedJpeg(file_name, pixels, quality=95, located=True):
+	exif = Image.Exif()
+	exif[0x0110] = 'camera'
+	exif.get_ifd(0x8769)[0x9003] = datetime.datetime(2020, 1, 1, 12).strftime('%Y:%m:%d %H:%M:%S')
+	if not located:
+		Image.fromarray(pixels).save(file_name, exif=exif, quality=quality)
+		return
+
+	gps = exif.get_ifd(0x8825)
+	gps[1] = 'N'
+	gps[2] = (IFDRational(41, 1), IFDRational(30, 1), IFDRational(0, 1))
+	gps[3] = 'E'
+	gps[4] = (IFDRational(16, 1), IFDRational(15, 1), IFDRational(0, 1))
+	gps[5] = 0
+	gps[6] = IFDRational(12345, 100)
+
+	Image.fromarray(pixels).save(file_name, exif=exif, quality=quality)
+
+
+
+##############################################################################
+### Tests
+
+### Files that are not images are reported and skipped when the originals are passed through, instead of failing the whole build
+def test_passthrough_skips_non_image_files(tmp_path, capsys):
+	img_folder = tmp_path / "images"
+	img_folder.mkdir()
+	SaveGeotaggedJpeg(str(img_folder / "photo.jpg"), (np.random.RandomState(0).rand(30, 40, 3)*255).astype('uint8'))
+	(img_folder / "notes.txt").write_text("not an image")
+
+	output_folder = str(tmp_path / "output")
+	KMLBuilder.CreateKmlFile(output_folder, img_input_folder=str(img_folder)+"/", overwrite=True)
+
+	out = capsys.readouterr().out
+	assert "notes.txt' is unreadable" in out
+	assert "Something unexpected happened" not in out
+
+	with open(os.path.join(output_folder, "output.kml"), encoding='utf-8') as f:
+		assert f.read().count("<PhotoOverlay") == 1
+	assert os.listdir(os.path.join(output_folder, "img")) == ["photo.jpg"]
+
+
+
+### A small target filesize is reached within the tolerance, even when re-encoding takes far fewer bytes per pixel than the original
+def test_resize_to_small_filesize_within_tolerance(tmp_path):
+	# Fine noise over a smooth image: costly at full size, it is averaged away by the JPEG draft, so the drafted image encodes too small
+	rng = np.random.default_rng(0)
+	smooth = Image.fromarray(rng.integers(0, 255, (15, 20, 3), dtype=np.uint8)).resize((4000, 3000), Image.BICUBIC)
+	pixels = np.clip(np.asarray(smooth).astype(np.int16) + rng.integers(-40, 41, (3000, 4000, 3)), 0, 255).astype(np.uint8)
+	SaveGeotaggedJpeg(str(tmp_path / "photo.jpg"), pixels)
+
+	output_folder = str(tmp_path / "output") + "/"
+	os.makedirs(output_folder)
+	resize_opt = 120
+	resize_tolerance = 5
+	KMLBuilder.ResizeFile(str(tmp_path / "photo.jpg"), output_folder, resize_opt, resize_tolerance).close()
+
+	size_KB = os.path.getsize(output_folder + "photo.jpg") / 1024
+	assert resize_opt * (100 - resize_tolerance) / 100 <= size_KB <= resize_opt * (100 + resize_tolerance) / 100
+
+
+
+### A straight line is simplified to its endpoints
+def test_simplify_straight_line():
+	lon = np.linspace(16.0, 16.1, 50)
+	lat = np.linspace(41.0, 41.05, 50)
+
+	assert np.flatnonzero(SimplifyTrack(lon, lat, tolerance=1.0)).tolist() == [0, 49]
+
+
+
+### Every point dropped by the simplification lies within the tolerance of the simplified track
+def test_simplify_respects_tolerance():
+	rng = np.random.default_rng(0)
+	lon = 16.0 + np.cumsum(rng.normal(0, 0.0005, 500))
+	lat = 41.0 + np.cumsum(rng.normal(0, 0.0005, 500))
+	tolerance = 10.0
+
+	keep = SimplifyTrack(lon, lat, tolerance=tolerance)
+	assert keep[0] and keep[-1] and 2 < keep.sum() < len(keep)
+
+	# Distances in the same local projection as SimplifyTrack, from each point to the simplified segment around it
+	xy = LocalProjection(lon, lat)
+	kept = np.flatnonzero(keep)
+	for start, end in zip(kept[:-1], kept[1:]):
+		a, b = xy[start], xy[end]
+		points = xy[start+1:end]
+		t = np.clip(((points - a) @ (b - a)) / max((b - a) @ (b - a), 1e-12), 0.0, 1.0)
+		distances = np.linalg.norm(points - (a + t[:, None]*(b - a)), axis=1)
+		assert np.all(distances <= tolerance + 1e-6)
+
+	stats = {}
+	rows = KMLBuilder.SimplifiedRows(np.arange(len(lon)), lon, lat, None, 0, tolerance, stats=stats)
+	assert rows.tolist() == kept.tolist()
+	assert stats == {'points_before': len(lon), 'points_after': len(kept)}
+
+
+
+### Elevation is only taken into account where it is kept: a climb along a straight line is not simplified away
+def test_simplify_with_elevation():
+	lon = np.linspace(16.0, 16.01, 21)
+	lat = np.full(21, 41.0)
+	elevation = np.minimum(np.arange(21), 10) * 20.0
+
+	assert np.flatnonzero(SimplifyTrack(lon, lat, elevation, tolerance=10.0)).tolist() == [0, 10, 20]
+	assert np.flatnonzero(SimplifyTrack(lon, lat, None, tolerance=10.0)).tolist() == [0, 20]
+
+	# SimplifiedRows measures in 3D only for placemarks keeping their elevation
+	assert KMLBuilder.SimplifiedRows(np.arange(21), lon, lat, elevation, 1, 10.0).tolist() == [0, 10, 20]
+	assert KMLBuilder.SimplifiedRows(np.arange(21), lon, lat, elevation, 0, 10.0).tolist() == [0, 20]
+
+
+
+### A point without a position (a GPS dropout) is kept as it is by the simplification, instead of failing the whole build
+def test_simplified_build_with_missing_position(tmp_path, capsys):
+	coords = pd.DataFrame({
+		'placemark': ['track']*4,
+		'keep_elevation': [0]*4,
+		'lat': [41.0, np.nan, 41.0, 41.0],
+		'lon': [16.0, 16.001, 16.002, 16.003],
+		'elevation': [0.0]*4,
+	})
+
+	output_folder = str(tmp_path / "output")
+	KMLBuilder.CreateKmlFile(output_folder, coords_df=coords, simplify_tolerance=5, overwrite=True)
+
+	assert "Something unexpected happened" not in capsys.readouterr().out
+	assert os.path.isfile(os.path.join(output_folder, "output.kml"))
+
+	rows = KMLBuilder.SimplifiedRows(np.arange(4), coords['lon'].to_numpy(), coords['lat'].to_numpy(), None, 0, 5)
+	assert rows.tolist() == [0, 1, 3]
+
+
+
+### Photos without a GPS position are placed on the track from their timestamp, shifted by the offset; located photos are left as they are
+def test_geotag_photos():
+	records = [
+		KMLBuilder.PhotoMetadata('located.jpg', datetime.datetime(2020, 1, 1, 12), 45.0, 10.0, 5.0),
+		KMLBuilder.PhotoMetadata('missing.jpg', datetime.datetime(2020, 1, 1, 12, 0, 5)),
+		KMLBuilder.PhotoMetadata('no_time.jpg'),
+		KMLBuilder.PhotoMetadata('too_far.jpg', datetime.datetime(2020, 1, 1, 14)),
+	]
+	coords = pd.DataFrame({
+		'placemark': ['track']*2,
+		'keep_elevation': [1]*2,
+		'time': ['2020-01-01T11:00:00Z', '2020-01-01T11:00:10Z'],
+		'lat': [41.0, 41.1],
+		'lon': [16.0, 16.1],
+		'elevation': [0.0, 100.0],
+	})
+
+	# The camera is set to UTC+1, the track is in UTC
+	geotagged, located = KMLBuilder.GeotagPhotos(records, coords, offset=-3600)
+
+	assert located == 1
+	assert geotagged[0] == records[0]
+	assert np.isclose(geotagged[1].latitude, 41.05) and np.isclose(geotagged[1].longitude, 16.05) and np.isclose(geotagged[1].altitude, 50.0)
+	assert geotagged[2] == records[2] and geotagged[3] == records[3]
+
+	# Without the offset, the photo is an hour after the end of the track
+	assert KMLBuilder.GeotagPhotos(records, coords)[1] == 0
+
+
+
+### A photo without a GPS position ends up located in the KML of a geotagged build
+def test_geotagged_photo_in_kml(tmp_path, capsys):
+	img_folder = tmp_path / "images"
+	img_folder.mkdir()
+	SaveGeotaggedJpeg(str(img_folder / "photo.jpg"), (np.random.RandomState(0).rand(30, 40, 3)*255).astype('uint8'), located=False)
+	coords = pd.DataFrame({
+		'placemark': ['track']*2,
+		'keep_elevation': [0]*2,
+		'time': ['2020-01-01T11:59:50Z', '2020-01-01T12:00:10Z'],
+		'lat': [41.0, 41.2],
+		'lon': [16.0, 16.2],
+		'elevation': [0.0, 0.0],
+	})
+
+	output_folder = str(tmp_path / "output")
+	KMLBuilder.CreateKmlFile(output_folder, coords_df=coords, img_input_folder=str(img_folder)+"/", geotag=True, overwrite=True)
+	assert "Something unexpected happened" not in capsys.readouterr().out
+
+	with open(os.path.join(output_folder, "output.kml"), encoding='utf-8') as f:
+		kml = f.read()
+	camera = kml[kml.index("<Camera>"):kml.index("</Camera>")]
+	assert np.isclose(float(camera.split("<longitude>")[1].split("<")[0]), 16.1)
+	assert np.isclose(float(camera.split("<latitude>")[1].split("<")[0]), 41.1)
+
+
+
+### The gx:Track mode of chunked coordinates is decided by the first chunk, whatever the 'time' column of the following ones
+def test_chunked_gx_track_mode_set_by_first_chunk(tmp_path):
+	def Chunk(first_row, with_time):
+		chunk = pd.DataFrame({
+			'placemark': ['track']*3,
+			'keep_elevation': [0]*3,
+			'lat': 41.0 + np.arange(first_row, first_row+3) / 1000,
+			'lon': 16.0 + np.arange(first_row, first_row+3) / 1000,
+			'elevation': [0.0]*3,
+		})
+		if with_time:
+			chunk['time'] = ['2020-01-01T00:00:%02dZ' % row for row in range(first_row, first_row+3)]
+		return chunk
+
+	for first_with_time in (True, False):
+		kml_file_name = str(tmp_path / ("track_%s.kml" % first_with_time))
+		KMLBuilder.StreamKml(kml_file_name, "track", coords_df=iter([Chunk(0, first_with_time), Chunk(3, not first_with_time)]), gx_track=True)
+
+		kml = xml.dom.minidom.parse(kml_file_name)
+		if first_with_time:
+			assert len(kml.getElementsByTagName('when')) == len(kml.getElementsByTagName('gx:coord')) == 3
+			assert not kml.getElementsByTagName('coordinates')
+		else:
+			assert not kml.getElementsByTagName('gx:Track')
+			assert len(kml.getElementsByTagName('coordinates')[0].firstChild.data.split()) == 6
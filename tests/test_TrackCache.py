@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from GeoFun.TrackCache import TrackArraysFromColumns, WriteTrackCache, LoadTrackCache, CachedTracks
+
+
+
+##############################################################################
+### Helpers
+
+### Builds the points of three placemarks, interleaved
+"""
+Input:
+- points=30: the number of points
+Output:
+- A dataframe of coordinates; 'lon' holds the position of each row, so that the order of the points can be checked
+"""
+def InterleavedPoints(points=30):
+	names = np.array(['A', 'B', 'C'])[np.arange(points) % 3 * (np.arange(points) % 5 != 0)]
+
+	return pd.DataFrame({
+		'placemark': names,
+		# Only the first row of each placemark counts
+		'keep_elevation': [1 if i < 3 and name != 'B' else 0 for i, name in enumerate(names)],
+		'time': ['2020-01-01T00:00:%02dZ' % (i % 60) for i in range(points)],
+		'lat': 41.0 + np.arange(points) / 1000,
+		'lon': np.arange(points, dtype=np.float64),
+		'elevation': np.arange(points) * 10.0,
+	})
+
+
+
+### Checks tracks against the points they were built from
+def AssertTracks(tracks, df):
+	names = list(dict.fromkeys(df['placemark']))
+	assert tracks.names == names
+	assert tracks.keep_elevation == [int(df['keep_elevation'][df['placemark'] == name].iloc[0]) for name in names]
+
+	counts = [int((df['placemark'] == name).sum()) for name in names]
+	assert tracks.offsets.tolist() == np.concatenate([[0], np.cumsum(counts)]).tolist()
+
+	for ix, name in enumerate(names):
+		rows = slice(tracks.offsets[ix], tracks.offsets[ix+1])
+		expected = df[df['placemark'] == name]
+		assert np.asarray(tracks.lon[rows]).tolist() == expected['lon'].tolist()
+		assert np.asarray(tracks.lat[rows]).tolist() == expected['lat'].tolist()
+		assert np.asarray(tracks.elevation[rows]).tolist() == expected['elevation'].tolist()
+		assert np.asarray(tracks.time[rows]).tolist() == pd.to_datetime(expected['time']).dt.tz_localize(None).to_numpy('datetime64[ns]').tolist()
+
+
+
+##############################################################################
+### Tests
+
+### Placemarks interleaved across chunks are grouped, each keeping the order of its points, with blocks smaller than a chunk
+def test_track_cache_groups_interleaved_chunks(tmp_path):
+	df = InterleavedPoints(30)
+	chunks = (df.iloc[start:start+10].copy() for start in range(0, len(df), 10))
+
+	cache_folder = WriteTrackCache(chunks, str(tmp_path / "cache"), block_size=4)
+	tracks = LoadTrackCache(cache_folder)
+
+	assert len(tracks) == len(df)
+	AssertTracks(tracks, df)
+
+
+
+### Columns are grouped the same way in memory, whether their placemarks are interleaved or already contiguous
+def test_track_arrays_from_columns():
+	df = InterleavedPoints(30)
+	AssertTracks(TrackArraysFromColumns({column: df[column].to_numpy() for column in df.columns}), df)
+
+	grouped = df.sort_values('placemark', kind='stable').reset_index(drop=True)
+	AssertTracks(TrackArraysFromColumns({column: grouped[column].to_numpy() for column in grouped.columns}), grouped)
+
+
+
+### The cache of a file is reused while the file is unchanged, and rebuilt once it has changed
+def test_cached_tracks_rebuilt_when_stale(tmp_path):
+	file_name = str(tmp_path / "coords.csv")
+	cache_root = str(tmp_path / "cache")
+	df = InterleavedPoints(30)
+	df.to_csv(file_name, index=False)
+
+	tracks, cache_hit = CachedTracks(file_name, cache_root, chunksize=7)
+	assert not cache_hit
+	AssertTracks(tracks, df)
+
+	tracks, cache_hit = CachedTracks(file_name, cache_root)
+	assert cache_hit
+	AssertTracks(tracks, df)
+
+	changed = InterleavedPoints(33)
+	changed.to_csv(file_name, index=False)
+	stat = os.stat(file_name)
+	os.utime(file_name, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+	tracks, cache_hit = CachedTracks(file_name, cache_root)
+	assert not cache_hit
+	AssertTracks(tracks, changed)
@@ -0,0 +1,67 @@
+import numpy as np
+
+from GeoFun.TrackTools import InterpolateTrack
+
+
+
+##############################################################################
+### Helpers
+
+START = np.datetime64('2020-01-01T00:00:00', 'ns')
+
+### Returns times the given seconds after START
+def Times(*seconds):
+	return START + (np.array(seconds, dtype=np.float64) * 1e9).astype('timedelta64[ns]')
+
+
+
+##############################################################################
+### Tests
+
+### Times between two track points are placed linearly between them, elevation included
+def test_interpolate_between_points():
+	lon, lat, elevation = InterpolateTrack(Times(0, 10, 20), [16.0, 16.1, 16.1], [41.0, 41.1, 41.3], [0.0, 100.0, 100.0], Times(5, 10, 15))
+
+	assert np.allclose(lon, [16.05, 16.1, 16.1])
+	assert np.allclose(lat, [41.05, 41.1, 41.2])
+	assert np.allclose(elevation, [50.0, 100.0, 100.0])
+
+
+
+### Between points on either side of the antimeridian, the position moves along the shortest way, and stays within [-180, 180)
+def test_interpolate_across_antimeridian():
+	lon, lat, elevation = InterpolateTrack(Times(0, 10), [179.9, -179.9], [0.0, 0.0], None, Times(2.5, 5, 7.5))
+
+	assert np.allclose(lon, [179.95, -180.0, -179.95])
+	assert elevation is None
+
+
+
+### In a gap wider than max_gap, times take the position of the nearest point if close enough to it, and are not placed otherwise
+def test_snap_to_nearest_point_within_max_gap():
+	lon, lat, elevation = InterpolateTrack(Times(0, 600), [16.0, 17.0], [41.0, 42.0], None, Times(30, 300, 590), max_gap=60.0)
+
+	assert np.isclose(lon[0], 16.0) and np.isclose(lat[0], 41.0)
+	assert np.isnan(lon[1]) and np.isnan(lat[1])
+	assert np.isclose(lon[2], 17.0) and np.isclose(lat[2], 42.0)
+
+
+
+### Times before the start, or after the end, of the track take its first (or last) position within max_gap only
+def test_times_outside_the_track():
+	lon, lat, elevation = InterpolateTrack(Times(100, 110), [16.0, 16.1], [41.0, 41.1], None, Times(70, 20, 150, 200), max_gap=60.0)
+
+	assert np.isclose(lon[0], 16.0)
+	assert np.isnan(lon[1])
+	assert np.isclose(lon[2], 16.1)
+	assert np.isnan(lon[3])
+
+
+
+### Track points without a time or a position are ignored, the track does not need to be sorted, and times that are NaT are not placed
+def test_unsorted_track_with_missing_values():
+	track_times = np.concatenate([Times(10), [np.datetime64('NaT', 'ns')], Times(0, 5)])
+	lon, lat, elevation = InterpolateTrack(track_times, [16.1, 50.0, 16.0, np.nan], [41.1, 50.0, 41.0, 41.05], None, np.concatenate([Times(5), [np.datetime64('NaT', 'ns')]]))
+
+	assert np.allclose(lon[0], 16.05) and np.allclose(lat[0], 41.05)
+	assert np.isnan(lon[1])